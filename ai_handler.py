@@ -1,159 +1,447 @@
+import asyncio
+import time
 import requests
+import httpx
 import json
 import logging
 import re
-from config import RESPONSE_STYLES, GOOGLE_API_KEY, GOOGLE_API_BASE_URL, DEFAULT_MODEL
+from config import (
+    GOOGLE_API_KEY, GOOGLE_API_BASE_URL, DEFAULT_MODEL,
+    GEMINI_MAX_CONNECTIONS, GEMINI_MAX_KEEPALIVE_CONNECTIONS,
+    GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT, RESPONSE_CACHE_ENABLED, REGEN_CANDIDATE_COUNT,
+    LOG_PAYLOADS, VOICE_ENABLED, VOICE_MAX_CHARS, TTS_VOICE, TTS_AMHARIC_VOICE
+)
+from response_cache import ResponseCache, make_cache_key
+from candidate_store import CandidateStore
+from prompt_builder import PromptBuilder
+from postprocess import ResponsePostprocessor
+from language_detector import LanguageDetector, ETHIOPIC_PATTERN
+from scheduler import GeminiScheduler, SchedulerOverloaded
+from resilience import ResilientCaller, GeminiUnavailable, RETRYABLE_STATUS
+from metrics import stage, record_stage
+from voice import VoiceSynthesizer
+from model_router import ModelRouter
 
 logger = logging.getLogger(__name__)
 
+FALLBACK_RESPONSE = "I couldn't generate a good response. Please try again."
+BUSY_RESPONSE = "I'm getting a lot of messages right now. Please try again in a moment."
+
+# How a 400 for a model without multi-candidate support reads ("Multiple candidates is not
+# enabled for ...", "Only one candidate can be specified ..."), as opposed to a bad request
+CANDIDATE_COUNT_ERROR = re.compile(r"candidate", re.IGNORECASE)
+
 class AIHandler:
-    def __init__(self, model=DEFAULT_MODEL):
+    def __init__(self, model=DEFAULT_MODEL, base_url=GOOGLE_API_BASE_URL, cache=None, scheduler=None,
+                 resilience=None, prompt_builder=None, candidates=None, postprocessor=None, voice=None,
+                 router=None):
         self.model = model
         self.api_key = GOOGLE_API_KEY
-        self.base_url = GOOGLE_API_BASE_URL
+        self.base_url = base_url
         self.default_style = "romantic"
+        self.detector = LanguageDetector()
+        # Token-budgeted prompt assembly with cached instructions and personal details
+        self.prompt_builder = prompt_builder if prompt_builder is not None else PromptBuilder()
+        # Precompiled clean-up rules applied to every reply
+        self.postprocessor = postprocessor if postprocessor is not None else ResponsePostprocessor()
+        # Responses for repeated (message, style, language, personal context) inputs
+        if cache is None and RESPONSE_CACHE_ENABLED:
+            cache = ResponseCache()
+        self.cache = cache
+        # Spare candidates from batch generation, served on later regenerate presses
+        self.candidates = candidates if candidates is not None else CandidateStore()
+        self.multi_candidate = True  # cleared if the model rejects candidateCount
+        # Concurrency cap, rate limit and fair queuing for async Gemini calls
+        self.scheduler = scheduler if scheduler is not None else GeminiScheduler()
+        # Retries, hedging and circuit breaking around each async Gemini call
+        self.resilience = resilience if resilience is not None else ResilientCaller()
+        # Model and generation settings per entry point, with a fallback while a model is slow
+        self.router = router if router is not None else ModelRouter(default_model=model)
+        # Text-to-speech in worker processes, with clips cached by content
+        if voice is None and VOICE_ENABLED:
+            voice = VoiceSynthesizer()
+        self.voice = voice
+        # Shared keep-alive pool for the async path, created lazily on the serving loop
+        self._async_client = None
     
     def is_amharic(self, text):
         """Check if text contains Amharic characters."""
-        # Amharic Unicode range: \u1200-\u137F
-        amharic_pattern = re.compile(r'[\u1200-\u137F]')
-        return bool(amharic_pattern.search(text))
+        return bool(ETHIOPIC_PATTERN.search(text))
 
     def is_transliterated_amharic(self, text):
         """Check if text might be Amharic written in Latin alphabet."""
-        # Common Amharic transliteration patterns
-        amharic_markers = [
-            r'\b(ene|ante|anchi|esu|esua|egna|enanet|enante)\b',  # pronouns
-            r'\b(selam|tena yistilign|dehna|betam|ameseginalehu)\b',  # common phrases
-            r'\b(new|nesh|nat|nachew|nen)\b',  # forms of "to be"
-            r'\b(yihe|yih|ya|yehe|esu)\b',  # demonstratives
-            r'\b(min|man|yet|meche|sint)\b',  # question words
-            r'\b(alegn|alesh|ale|alat|alen|alachihu|alachew)\b',  # have forms
-            r'\b(ewedihalehu|ewedishalehu|ewedihalew|ewediyatalew)\b',  # love forms
-        ]
+        return self.detector.has_markers(text, "amharic")
+    
+    def detect_language(self, text):
+        """Detect script and transliteration of a message in a single pass."""
+        return self.detector.detect(text)
+    
+    def _language_instruction(self, detection):
+        if detection.mode == "amharic":
+            return "Respond in Amharic using Amharic script (Fidel)."
+        if detection.mode == "transliterated":
+            language = detection.language.capitalize()
+            script = "Amharic script" if detection.language == "amharic" else "Ge'ez script"
+            return (f"Respond in {language} but write it using Latin alphabet "
+                    f"(transliterated {language}). Do not use {script}.")
+        return "Respond in English."
+    
+    def _build_prompt(self, girlfriend_message, user_data, detection=None, user_id=None):
+        """Build the Gemini prompt for a message and the user's preferences."""
+        # Detect language format
+        if detection is None:
+            detection = self.detect_language(girlfriend_message)
+        
+        # Static instructions are reused; details and history are trimmed to the token budget
+        language_instruction = self._language_instruction(detection)
+        return self.prompt_builder.build(girlfriend_message, user_data, language_instruction, user_id)
+    
+    def _build_request(self, girlfriend_message, user_data, detection=None, stream=False, user_id=None, route=None):
+        """Return the (url, payload) pair for a generateContent (or streaming) call.
+        
+        route (a RouteChoice) sets the model and generation settings; by
+        default the message route's primary settings are used.
+        """
+        if route is None:
+            route = self.router.choose("message")
+        with stage("prompt_build"):
+            combined_prompt = self._build_prompt(girlfriend_message, user_data, detection, user_id)
         
-        # Check for multiple Amharic markers
-        matches = 0
-        for pattern in amharic_markers:
-            if re.search(pattern, text.lower()):
-                matches += 1
-                if matches >= 1:  # If at least one marker is found
-                    return True
+        if stream:
+            url = f"{self.base_url}/models/{route.model}:streamGenerateContent?alt=sse&key={self.api_key}"
+        else:
+            url = f"{self.base_url}/models/{route.model}:generateContent?key={self.api_key}"
         
-        return False
+        payload = {
+            "contents": [
+                {"parts": [{"text": combined_prompt}]}
+            ],
+            "generationConfig": {
+                "temperature": route.temperature,
+                "topK": 40,
+                "topP": 0.95,
+                "maxOutputTokens": route.max_output_tokens
+            }
+        }
+        return url, payload
+    
+    def _extract_text(self, response_json):
+        """Return the raw text of the first candidate, or None if there isn't one."""
+        if "candidates" in response_json and len(response_json["candidates"]) > 0:
+            if "content" in response_json["candidates"][0] and "parts" in response_json["candidates"][0]["content"]:
+                return response_json["candidates"][0]["content"]["parts"][0]["text"]
+        return None
+    
+    def _clean_response(self, ai_response):
+        """Strip formatting, option markers and role prefixes from a reply."""
+        return self.postprocessor.clean(ai_response)
+    
+    def _candidate_texts(self, response_json):
+        """Cleaned text of every candidate in a Gemini response."""
+        texts = []
+        for candidate in response_json.get("candidates", []):
+            parts = candidate.get("content", {}).get("parts")
+            if parts and parts[0].get("text"):
+                texts.append(self._clean_response(parts[0]["text"]))
+        return texts
     
-    def generate_response(self, girlfriend_message, user_data):
+    def _extract_response(self, response_json):
+        """Pull the reply text out of a Gemini response and clean it up."""
+        if LOG_PAYLOADS:
+            logger.info(f"Received response from Gemini API: {response_json}")
+        
+        # Extract the response text from the Gemini API response
+        with stage("postprocess"):
+            ai_response = self._extract_text(response_json)
+            if ai_response is not None:
+                return self._clean_response(ai_response)
+        
+        # If we couldn't extract the response properly
+        return FALLBACK_RESPONSE
+    
+    def _cache_key(self, girlfriend_message, user_data, detection, route):
+        # Replies from a fallback model are kept apart from the primary's
+        style = user_data.get("style", self.default_style)
+        return make_cache_key(girlfriend_message, style, detection, user_data) + (route.model,)
+    
+    def _cache_lookup(self, key, use_cache):
+        if self.cache is None or not use_cache:
+            return None
+        return self.cache.get(key)
+    
+    def _cache_store(self, key, ai_response):
+        # Never cache the apology string, the next try should hit the API again
+        if self.cache is not None and ai_response != FALLBACK_RESPONSE:
+            self.cache.put(key, ai_response)
+    
+    def generate_response(self, girlfriend_message, user_data, use_cache=True):
+        """Generate a reply. use_cache=False skips the cache lookup to force a fresh answer."""
         try:
-            # Get user preferences
-            style = user_data.get("style", self.default_style)
-            girlfriend_name = user_data.get("girlfriend_name", "your girlfriend")
-            personal_details = user_data.get("personal_details", {})
-            history = user_data.get("history", [])
-            
-            # Detect language format
-            is_amharic_message = self.is_amharic(girlfriend_message)
-            is_transliterated = self.is_transliterated_amharic(girlfriend_message)
-            
-            # Create system prompt based on style
-            style_description = RESPONSE_STYLES.get(style, RESPONSE_STYLES[self.default_style])
-            
-            # Build context from personal details
-            context = ""
-            if personal_details:
-                context = "Important personal details to remember:\n"
-                for key, value in personal_details.items():
-                    context += f"- {key}: {value}\n"
+            route = self.router.choose("message")
+            detection = self.detect_language(girlfriend_message)
+            key = self._cache_key(girlfriend_message, user_data, detection, route)
+            cached = self._cache_lookup(key, use_cache)
+            if cached is not None:
+                return cached
             
-            # Format conversation history
-            history_text = ""
-            if history:
-                history_text = "Recent conversation:\n"
-                for i, (gf_msg, bf_resp) in enumerate(history[-3:]):  # Only use last 3 exchanges
-                    history_text += f"Girlfriend: {gf_msg}\n"
-                    history_text += f"Boyfriend: {bf_resp}\n\n"
-            
-            # Determine language instruction based on detection
-            language_instruction = "Respond in English."
-            if is_amharic_message:
-                language_instruction = "Respond in Amharic using Amharic script (Fidel)."
-            elif is_transliterated:
-                language_instruction = "Respond in Amharic but write it using Latin alphabet (transliterated Amharic). Do not use Amharic script."
-            
-            combined_prompt = (
-                f"You are helping a boyfriend respond to his girlfriend named {girlfriend_name}. "
-                f"Generate a {style_description} response to her message.\n\n"
-                f"{context}\n"
-                f"{history_text}\n"
-                f"IMPORTANT INSTRUCTIONS:\n"
-                f"1. Keep your response short and direct (1-3 sentences only)\n"
-                f"2. Don't use markdown formatting, asterisks, or bullet points\n"
-                f"3. Don't provide multiple options - just give ONE perfect response\n"
-                f"4. Write as if you ARE the boyfriend (first person)\n"
-                f"5. Don't include explanations or notes\n"
-                f"6. Don't use phrases like 'you could say' or 'here's a response'\n"
-                f"7. Use appropriate emojis naturally (1-2 emojis max) if it fits the tone\n"
-                f"8. Make the response sound natural, like a real text from a boyfriend\n"
-                f"9. Never start with 'As your boyfriend' or similar phrases\n"
-                f"10. {language_instruction}\n\n"
-                f"Her message: \"{girlfriend_message}\"\n\n"
-                f"My response:"
-            )
-            
-            # Call Gemini API
-            url = f"{self.base_url}/models/{self.model}:generateContent?key={self.api_key}"
-            
-            payload = {
-                "contents": [
-                    {"parts": [{"text": combined_prompt}]}
-                ],
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 150
-                }
-            }
+            url, payload = self._build_request(girlfriend_message, user_data, detection, route=route)
             
             headers = {
                 "Content-Type": "application/json"
             }
             
-            logger.info(f"Sending request to Gemini API")
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response_json = response.json()
+            logger.debug(f"Sending request to Gemini API")
+            with stage("gemini"):
+                call = self.router.begin(route)
+                record = False
+                try:
+                    response = requests.post(url, headers=headers, data=json.dumps(payload),
+                                             timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT))
+                    record = response.status_code == 200
+                finally:
+                    self.router.end(route, call, record)
+            ai_response = self._extract_response(response.json())
+            self._cache_store(key, ai_response)
+            return ai_response
             
-            logger.info(f"Received response from Gemini API: {response_json}")
+        except Exception as e:
+            logger.error(f"Error generating AI response: {str(e)}")
+            return FALLBACK_RESPONSE
+    
+    def _get_async_client(self):
+        """Return the shared async HTTP client, creating it on first use."""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=GEMINI_MAX_KEEPALIVE_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(GEMINI_READ_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._async_client
+    
+    async def _post(self, client, url, payload, route):
+        """POST to Gemini, timing the call for routing (successes and timeouts count)."""
+        call = self.router.begin(route)
+        record = False
+        try:
+            response = await client.post(url, json=payload)
+            record = response.status_code == 200
+            return response
+        except httpx.TimeoutException:
+            record = True
+            raise
+        finally:
+            self.router.end(route, call, record)
+    
+    async def agenerate_response(self, girlfriend_message, user_data, use_cache=None, user_id=None,
+                                 entry_point="message"):
+        """Async version of generate_response that doesn't block the event loop.
+        
+        Each attempt goes through the scheduler (user_id is used for fair
+        queuing) and the resilience layer retries, hedges or fails fast.
+        entry_point ("inline", "message", ...) picks the model route.
+        By default only inline replies use the cache: its key leaves out
+        the history a chat reply follows on from. use_cache=False still
+        stores the fresh reply.
+        """
+        try:
+            store = True
+            if use_cache is None:
+                use_cache = store = entry_point == "inline"
+            route = self.router.choose(entry_point)
+            detection = self.detect_language(girlfriend_message)
+            key = self._cache_key(girlfriend_message, user_data, detection, route)
+            cached = self._cache_lookup(key, use_cache)
+            if cached is not None:
+                return cached
             
-            # Extract the response text from the Gemini API response
-            if "candidates" in response_json and len(response_json["candidates"]) > 0:
-                if "content" in response_json["candidates"][0] and "parts" in response_json["candidates"][0]["content"]:
-                    ai_response = response_json["candidates"][0]["content"]["parts"][0]["text"].strip()
-                    
-                    # Clean up the response to remove any remaining formatting or options
-                    ai_response = ai_response.replace("**", "").replace("Option 1:", "").replace("Option 2:", "")
-                    ai_response = ai_response.replace("Option 3:", "").replace("*", "")
-                    
-                    # Remove any lines that start with numbers followed by a period (like "1. ")
-                    ai_response = "\n".join([line for line in ai_response.split("\n") 
-                                            if not (line.strip().startswith(("1.", "2.", "3.")) and len(line.strip()) > 3)])
-                    
-                    # Remove any "My response:" or similar prefixes
-                    prefixes_to_remove = ["My response:", "Response:", "Boyfriend:", "Me:"]
-                    for prefix in prefixes_to_remove:
-                        if ai_response.startswith(prefix):
-                            ai_response = ai_response[len(prefix):].strip()
-                    
-                    return ai_response
+            url, payload = self._build_request(girlfriend_message, user_data, detection, user_id=user_id,
+                                               route=route)
             
-            # If we couldn't extract the response properly
-            return "I couldn't generate a good response. Please try again."
+            logger.debug(f"Sending async request to Gemini API")
+            client = self._get_async_client()
+            with stage("gemini"):
+                response = await self.resilience.call(
+                    lambda: self.scheduler.run(user_id, lambda: self._post(client, url, payload, route))
+                )
+            ai_response = self._extract_response(response.json())
+            if store:
+                self._cache_store(key, ai_response)
+            return ai_response
             
+        except SchedulerOverloaded as e:
+            logger.warning(f"Rejecting Gemini request, scheduler overloaded: {e}")
+            return BUSY_RESPONSE
+        except GeminiUnavailable as e:
+            logger.error(f"Gemini API unavailable: {e}")
+            return FALLBACK_RESPONSE
         except Exception as e:
             logger.error(f"Error generating AI response: {str(e)}")
-            return "I couldn't generate a good response. Please try again."
+            return FALLBACK_RESPONSE
+    
+    async def agenerate_candidates(self, girlfriend_message, user_data, count, user_id=None,
+                                   entry_point="regenerate"):
+        """Return up to count distinct replies from a single Gemini request (candidateCount).
+        
+        If the model rejects candidateCount, count single requests run in
+        parallel instead. Never empty: on failure the list holds the
+        fallback (or busy) message.
+        """
+        candidates = []
+        if count > 1 and self.multi_candidate:
+            try:
+                route = self.router.choose(entry_point)
+                url, payload = self._build_request(girlfriend_message, user_data, user_id=user_id, route=route)
+                payload["generationConfig"]["candidateCount"] = count
+                
+                logger.debug(f"Requesting {count} candidates from Gemini API")
+                client = self._get_async_client()
+                with stage("gemini"):
+                    response = await self.resilience.call(
+                        lambda: self.scheduler.run(user_id, lambda: self._post(client, url, payload, route))
+                    )
+                if response.status_code == 400 and CANDIDATE_COUNT_ERROR.search(response.text):
+                    logger.warning(f"Model rejected candidateCount, using parallel requests: {response.text}")
+                    self.multi_candidate = False
+                elif response.status_code == 400:
+                    logger.error(f"Gemini rejected the request: {response.text}")
+                    return [FALLBACK_RESPONSE]
+                else:
+                    with stage("postprocess"):
+                        candidates = self._candidate_texts(response.json())
+            except SchedulerOverloaded as e:
+                logger.warning(f"Rejecting Gemini request, scheduler overloaded: {e}")
+                return [BUSY_RESPONSE]
+            except GeminiUnavailable as e:
+                logger.error(f"Gemini API unavailable: {e}")
+                return [FALLBACK_RESPONSE]
+            except Exception as e:
+                logger.error(f"Error generating AI candidates: {str(e)}")
+                return [FALLBACK_RESPONSE]
+        
+        if not self.multi_candidate or count <= 1:
+            candidates = await asyncio.gather(*(
+                self.agenerate_response(girlfriend_message, user_data, use_cache=False, user_id=user_id,
+                                        entry_point=entry_point)
+                for _ in range(max(count, 1))
+            ))
+        
+        unique = list(dict.fromkeys(
+            text for text in candidates if text and text not in (FALLBACK_RESPONSE, BUSY_RESPONSE)
+        ))
+        return unique or list(candidates[:1]) or [FALLBACK_RESPONSE]
+    
+    async def aregenerate_response(self, message_id, girlfriend_message, user_data, user_id=None):
+        """Reply for a regenerate press on message_id.
+        
+        Serves a stored candidate when one is left; otherwise generates a
+        batch of REGEN_CANDIDATE_COUNT, returns the first and stores the rest.
+        """
+        # Candidates made for another style don't fit anymore
+        key = (message_id, user_data.get("style", self.default_style))
+        stored = self.candidates.pop(key)
+        if stored is not None:
+            return stored
+        
+        candidates = await self.agenerate_candidates(girlfriend_message, user_data, REGEN_CANDIDATE_COUNT, user_id)
+        self.candidates.put(key, candidates[1:])
+        return candidates[0]
+    
+    async def astream_response(self, girlfriend_message, user_data, user_id=None, entry_point="message"):
+        """Yield the reply while Gemini streams it (streamGenerateContent over SSE).
+        
+        Each item is the cleaned-up text so far. The last item is the final
+        reply, post-processed like generate_response; on errors the stream ends
+        with the fallback (or busy) message instead of raising. As in
+        agenerate_response, only inline replies use the cache.
+        """
+        text = ""
+        cleaner = self.postprocessor.stream()
+        use_cache = entry_point == "inline"
+        try:
+            route = self.router.choose(entry_point)
+            detection = self.detect_language(girlfriend_message)
+            key = self._cache_key(girlfriend_message, user_data, detection, route)
+            cached = self._cache_lookup(key, use_cache)
+            if cached is not None:
+                yield cached
+                return
+            
+            url, payload = self._build_request(girlfriend_message, user_data, detection, stream=True,
+                                               user_id=user_id, route=route)
+            if not self.resilience.breaker.allow():
+                raise GeminiUnavailable("circuit breaker is open")
+            
+            logger.debug(f"Sending streaming request to Gemini API")
+            client = self._get_async_client()
+            start = time.perf_counter()
+            async with self.scheduler.slot(user_id):
+                call = self.router.begin(route)
+                streamed = False
+                try:
+                    async with client.stream("POST", url, json=payload) as response:
+                        if response.status_code != 200:
+                            if response.status_code in RETRYABLE_STATUS:
+                                self.resilience.breaker.record_failure()
+                            raise GeminiUnavailable(f"HTTP {response.status_code}")
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            chunk = self._extract_text(json.loads(line[len("data:"):]))
+                            if chunk:
+                                if not text:
+                                    record_stage("gemini_first_chunk", time.perf_counter() - start)
+                                text += chunk
+                                partial = cleaner.feed(chunk)
+                                if partial:
+                                    yield partial
+                    streamed = True
+                finally:
+                    self.router.end(route, call, streamed)
+            self.resilience.breaker.record_success()
+            record_stage("gemini_stream", time.perf_counter() - start)
+            
+        except SchedulerOverloaded as e:
+            logger.warning(f"Rejecting Gemini request, scheduler overloaded: {e}")
+            yield BUSY_RESPONSE
+            return
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            self.resilience.breaker.record_failure()
+            logger.error(f"Error streaming AI response: {str(e)}")
+            yield FALLBACK_RESPONSE
+            return
+        except Exception as e:
+            logger.error(f"Error streaming AI response: {str(e)}")
+            yield FALLBACK_RESPONSE
+            return
+        
+        ai_response = self._clean_response(text) if text.strip() else FALLBACK_RESPONSE
+        if use_cache:
+            self._cache_store(key, ai_response)
+        yield ai_response
+    
+    async def aclose(self):
+        """Close the shared async HTTP client."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self.voice is not None:
+            self.voice.close()
     
-    def generate_voice_message(self, text):
-        """Generate a voice message from text (placeholder for future implementation)"""
-        # This would integrate with a text-to-speech API
-        # For now, we'll return None to indicate this feature isn't implemented
-        return None
\ No newline at end of file
+    async def generate_voice_message(self, text, style=None):
+        """Speak text as an OGG/Opus voice clip.
+        
+        Returns a VoiceClip to send with send_voice(clip.voice), or None if
+        voice replies are off or synthesis failed.
+        """
+        if self.voice is None or not text.strip():
+            return None
+        text = text[:VOICE_MAX_CHARS]
+        voice = TTS_AMHARIC_VOICE if self.is_amharic(text) else TTS_VOICE
+        try:
+            return await self.voice.synthesize(text, voice, style or self.default_style)
+        except Exception as e:
+            logger.error(f"Voice synthesis failed: {e}")
+            return None
@@ -1,134 +1,142 @@
 import logging
 import os
 import asyncio
-from telegram import Update, Bot
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, InlineQueryHandler
-import time
 import traceback
 from quart import Quart, request, Response
-import nest_asyncio
+from telegram import Bot
 
-from config import TELEGRAM_TOKEN, RESPONSE_STYLES
-from user_manager import UserManager
-from ai_handler import AIHandler
-from main import start, help_command, style_command, button_callback, set_name_command, add_detail_command, handle_message, inline_query
+from config import TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL, LOG_PAYLOADS, WEB_WORKERS, STORAGE_BACKEND
+from main import create_application, close_services, register_metrics
+from update_queue import UpdateQueue, ACCEPTED, DUPLICATE, INVALID
+from shard_router import ShardRouter
+from update_processor import PerUserUpdateProcessor
+from metrics import REGISTRY
+from log_setup import configure_logging
 
 # Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
-# Use Quart for async support
-app = Quart(__name__)
-
-# Initialize user manager and AI handler
-user_manager = UserManager()
-ai_handler = AIHandler()
-
 # Get environment variables
 PORT = int(os.environ.get('PORT', 8080))
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL', 'https://lovewhisper-5vbu.onrender.com')
 
-# Initialize bot application
-application = Application.builder().token(TELEGRAM_TOKEN).build()
-
-# Error handler
-async def error_handler(update, context):
-    """Log the error and send a message to the user."""
-    logger.error(f"Exception while handling an update: {context.error}")
-    logger.error(traceback.format_exc())
-
-# Add handlers
-application.add_handler(CommandHandler("start", start))
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("style", style_command))
-application.add_handler(CommandHandler("setname", set_name_command))
-application.add_handler(CommandHandler("adddetail", add_detail_command))
-application.add_handler(CallbackQueryHandler(button_callback))
-application.add_handler(InlineQueryHandler(inline_query))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-application.add_error_handler(error_handler)
-
-# Initialize the application
-async def initialize_application():
-    await application.initialize()
-    logger.info("Application initialized successfully")
-
-# Run the initialization in the main thread
-try:
-    asyncio.run(initialize_application())
-    logger.info("Application initialization completed")
-except Exception as e:
-    logger.error(f"Error initializing application: {e}")
-    logger.error(traceback.format_exc())
-
-# Webhook route - fully async
-@app.route(f'/{TELEGRAM_TOKEN}', methods=['POST'])
-async def webhook():
-    """Handle incoming webhook updates from Telegram."""
-    try:
-        logger.info("Received webhook request")
-        update_json = await request.get_json()
-        logger.info(f"Update JSON: {update_json}")
-        
-        update = Update.de_json(update_json, application.bot)
-        await application.process_update(update)
-        logger.info("Update processed successfully")
-        
-        return Response('ok', status=200)
-    except Exception as e:
-        logger.error(f"Error in webhook handler: {e}")
-        logger.error(traceback.format_exc())
-        return Response('error', status=500)
-
-# Health check route
-@app.route('/')
-async def index():
-    return 'Bot is running!'
-
-# Set up the webhook using the Telegram Bot API directly
-def set_webhook_sync():
-    """Set up webhook using requests (synchronous)."""
-    try:
-        import requests
-        url = f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}"
-        api_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/setWebhook?url={url}"
-        response = requests.get(api_url)
-        logger.info(f"Webhook set to {url}. Response: {response.text}")
-        
-        # Also check if the bot can connect to Telegram API
-        me_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getMe"
-        me_response = requests.get(me_url)
-        logger.info(f"Bot info: {me_response.text}")
-    except Exception as e:
-        logger.error(f"Error setting webhook: {e}")
-        logger.error(traceback.format_exc())
-
-# Test Telegram connection
-def test_telegram_connection():
-    try:
-        import requests
-        response = requests.get(f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getMe")
-        logger.info(f"Telegram connection test: {response.status_code} - {response.text}")
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Telegram connection test failed: {e}")
-        return False
-
-# Call the synchronous version at startup
-set_webhook_sync()
-
-# Test connection
-if test_telegram_connection():
-    logger.info("Successfully connected to Telegram API")
-else:
-    logger.error("Failed to connect to Telegram API - check your network and token")
+def create_app(application=None, workers=WEB_WORKERS):
+    """Build the Quart app around a single bot Application.
+
+    Importing and building do no network I/O. Once the server is serving,
+    the bot is initialized, the webhook registered and the Telegram
+    connection checked in a background task, so the port binds and the
+    health check answers right away.
+
+    With workers > 1 this process builds no bot services: it routes each
+    update by user to one of that many worker processes (see ShardRouter).
+    A given application should be built with a PerUserUpdateProcessor
+    (create_application(update_processor=...)); it runs the webhook's updates.
+    """
+    app = Quart(__name__)
+    if workers > 1:
+        if STORAGE_BACKEND != "sqlite":
+            raise ValueError("WEB_WORKERS > 1 needs STORAGE_BACKEND=sqlite; the JSON file has a single writer")
+        application = None
+        bot = Bot(TELEGRAM_TOKEN, base_url=TELEGRAM_API_BASE_URL)
+        update_queue = ShardRouter(workers)
+        REGISTRY.add_collector("shards", update_queue.stats)
+    else:
+        application = application or create_application(update_processor=PerUserUpdateProcessor())
+        bot = application.bot
+        # Webhook updates are queued and handed to the application's update processor
+        update_queue = UpdateQueue(application)
+
+        # Component counters exposed as gauges on /metrics
+        REGISTRY.add_collector("updates", update_queue.stats)
+        register_metrics(application)
+
+    app.config["BOT_APPLICATION"] = application
+    app.config["UPDATE_QUEUE"] = update_queue
+    state = {"task": None, "initialized": False}
+
+    async def initialize_bot():
+        """Initialize the bot, then register the webhook and check the connection."""
+        try:
+            if application is not None:
+                await application.initialize()
+                logger.info("Application initialized successfully")
+            else:
+                await bot.initialize()
+            state["initialized"] = True
+            update_queue.start()
+            await update_queue.ready()
+
+            url = f"{WEBHOOK_URL}/{TELEGRAM_TOKEN}"
+            await bot.set_webhook(url=url)
+            logger.info(f"Webhook set to {WEBHOOK_URL}/<token>")
+
+            me = await bot.get_me()
+            logger.info(f"Successfully connected to Telegram API as @{me.username}")
+        except Exception as e:
+            logger.error(f"Error starting bot: {e}")
+            logger.error(traceback.format_exc())
+
+    # Webhook route - fully async
+    @app.route(f'/{TELEGRAM_TOKEN}', methods=['POST'])
+    async def webhook():
+        """Handle incoming webhook updates from Telegram."""
+        try:
+            update_json = await request.get_json(silent=True)
+            if LOG_PAYLOADS:
+                logger.info(f"Update JSON: {update_json}")
+
+            # Acknowledge at once; the update is processed in the background
+            status = update_queue.submit(update_json)
+            if status in (ACCEPTED, DUPLICATE):
+                return Response('ok', status=200)
+            if status == INVALID:
+                return Response('invalid update', status=400)
+            # Queue is full (or the bot is still starting): let Telegram retry later
+            logger.warning("Update queue full, asking Telegram to retry")
+            return Response('busy', status=503)
+        except Exception as e:
+            logger.error(f"Error in webhook handler: {e}")
+            logger.error(traceback.format_exc())
+            return Response('error', status=500)
+
+    # Start the bot on the serving event loop without holding up the server,
+    # so the bot's HTTP connections aren't bound to a loop that has already closed
+    @app.before_serving
+    async def startup():
+        state["task"] = asyncio.create_task(initialize_bot())
+
+    # Drain queued updates, flush user data and release pooled connections when the server stops
+    @app.after_serving
+    async def shutdown():
+        task = state["task"]
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await update_queue.stop()
+        if application is None:
+            if state["initialized"]:
+                await bot.shutdown()
+            return
+        await close_services(application)
+        if state["initialized"]:
+            await application.shutdown()
+
+    # Health check route
+    @app.route('/')
+    async def index():
+        return 'Bot is running!'
+
+    # Prometheus scrape endpoint; with shard workers it includes the metrics they last sent
+    @app.route('/metrics')
+    async def metrics():
+        return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     # Run the Quart app
-    app.run(host='0.0.0.0', port=PORT) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=PORT)
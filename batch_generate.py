@@ -0,0 +1,320 @@
+"""Generate replies for a JSONL file of messages, outside the bot.
+
+Each input line is a JSON object; only "message" is required:
+
+    {"id": "a1", "message": "Hey, how was your day?", "user_id": 42,
+     "user": {"style": "playful", "girlfriend_name": "Emma",
+              "personal_details": {"anniversary": "June 15th"}, "history": [["Hi", "Hello love"]]}}
+
+Replies go through the same prompt building, scheduler, resilience and
+clean-up as the bot's, and are appended to the output JSONL as they finish
+(not in input order), one object per reply with the input line number.
+--styles runs every message once per style, e.g. to compare prompt changes
+across RESPONSE_STYLES. Progress is checkpointed next to the output, so an
+interrupted run continues where it stopped with --resume. Resuming also
+retries replies that failed (fallback/busy text or an error); the retry is
+appended, so the last record for a line and style is the one that counts.
+
+    python batch_generate.py messages.jsonl replies.jsonl --concurrency 32 --styles all
+    python batch_generate.py messages.jsonl replies.jsonl --resume
+
+Point GOOGLE_API_BASE_URL (or --base-url) at benchmarks/stub_gemini.py to
+run without the real API.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from array import array
+
+from config import (
+    GOOGLE_API_BASE_URL, DEFAULT_MODEL, GEMINI_REQUESTS_PER_MINUTE, RESPONSE_STYLES,
+    BATCH_CONCURRENCY, BATCH_CHECKPOINT_INTERVAL
+)
+from ai_handler import AIHandler, FALLBACK_RESPONSE, BUSY_RESPONSE
+from scheduler import GeminiScheduler
+from user_record import UserRecord
+from log_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Replies the handler gives instead of raising
+FAILURE_STATUS = {FALLBACK_RESPONSE: "fallback", BUSY_RESPONSE: "busy"}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+class BatchGenerator:
+    """Streams input lines through a fixed number of concurrent workers.
+
+    Only `concurrency` items are read ahead, so memory doesn't grow with
+    the input. The checkpoint records the first input line not yet fully
+    answered; replies past it that were already written when a run stopped
+    are found in the output on resume and not generated again. Replies
+    whose last record isn't "ok" are generated again on resume, also for
+    lines before the checkpoint.
+    """
+
+    def __init__(self, ai_handler, input_path, output_path, concurrency=BATCH_CONCURRENCY, styles=None,
+                 use_cache=False, checkpoint_interval=BATCH_CHECKPOINT_INTERVAL):
+        self.ai_handler = ai_handler
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = f"{output_path}.checkpoint"
+        self.concurrency = concurrency
+        self.styles = styles
+        self.use_cache = use_cache
+        self.checkpoint_interval = checkpoint_interval
+
+        self.next_line = 1  # First input line with replies still missing
+        self._finished = set()  # Finished lines past next_line
+        self._remaining = {}  # line -> replies still being generated
+        self._output = None
+
+        # Metrics
+        self.generated = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retried = 0
+        self.invalid = 0
+        self.latencies = array("d")
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 1
+        if checkpoint["input"] != os.path.abspath(self.input_path):
+            raise ValueError(f"{self.checkpoint_path} belongs to a run over {checkpoint['input']}")
+        return checkpoint["next_line"]
+
+    def _save_checkpoint(self):
+        """Make the output durable, then record how far it is complete."""
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"input": os.path.abspath(self.input_path), "next_line": self.next_line}, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _read_output(self, line):
+        """Return (line, style) of replies done from `line` on, and of failed ones anywhere.
+
+        A reply counts as done once its last record is "ok" (or the line is
+        invalid). Drops a torn last record.
+        """
+        done, failed = set(), set()
+        if not os.path.exists(self.output_path):
+            return done, failed
+        with open(self.output_path, "rb+") as f:
+            complete = 0
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                complete += len(raw)
+                record = json.loads(raw)
+                key = (record["line"], record.get("style"))
+                if record["status"] in ("ok", "invalid"):
+                    failed.discard(key)
+                    if record["line"] >= line:
+                        done.add(key)
+                else:
+                    done.discard(key)
+                    failed.add(key)
+            f.truncate(complete)
+        return done, failed
+
+    def _write(self, record):
+        self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _finish_line(self, line):
+        if line < self.next_line:
+            return  # A retried line the checkpoint is already past
+        self._finished.add(line)
+        while self.next_line in self._finished:
+            self._finished.remove(self.next_line)
+            self.next_line += 1
+
+    def _items(self, start_line, done, failed):
+        """Yield (line, item, styles still to generate), recording bad lines.
+
+        Covers start_line on, and the lines before it with failed replies.
+        """
+        retry_lines = {line for line, _ in failed if line < start_line}
+        with open(self.input_path, encoding="utf-8") as f:
+            for line, raw in enumerate(f, 1):
+                if line < start_line and line not in retry_lines:
+                    continue
+                if not raw.strip():
+                    self._finish_line(line)
+                    continue
+                try:
+                    item = json.loads(raw)
+                    if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+                        raise ValueError('expected an object with a "message" string')
+                except ValueError as e:
+                    if (line, None) not in done and line >= start_line:
+                        self.invalid += 1
+                        self._write({"line": line, "status": "invalid", "error": str(e)})
+                    self._finish_line(line)
+                    continue
+                profile = item.get("user") or {}
+                styles = self.styles or [item.get("style") or profile.get("style")]
+                if line < start_line:
+                    styles = [style for style in styles if (line, style) in failed]
+                todo = [style for style in styles if (line, style) not in done]
+                self.skipped += len(styles) - len(todo)
+                self.retried += sum(1 for style in todo if (line, style) in failed)
+                if todo:
+                    yield line, item, todo
+                else:
+                    self._finish_line(line)
+
+    async def _work(self, queue):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            line, item, style = job
+            profile = dict(item.get("user") or {})
+            if style is not None:
+                profile["style"] = style
+            start = time.perf_counter()
+            try:
+                response = await self.ai_handler.agenerate_response(
+                    item["message"], UserRecord.from_dict(profile), use_cache=self.use_cache,
+                    user_id=item.get("user_id"), entry_point="batch"
+                )
+                status = FAILURE_STATUS.get(response, "ok")
+            except Exception as e:
+                logger.error(f"Line {line} failed: {e}")
+                response, status = None, "error"
+            latency = time.perf_counter() - start
+
+            self.latencies.append(latency)
+            self.generated += 1
+            self.failed += status != "ok"
+            self._write({"line": line, "id": item.get("id"), "style": style, "message": item["message"],
+                         "response": response, "status": status, "latency": round(latency, 4)})
+            self._remaining[line] -= 1
+            if not self._remaining[line]:
+                del self._remaining[line]
+                self._finish_line(line)
+
+    async def _checkpoint_periodically(self, started):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            self._save_checkpoint()
+            elapsed = time.perf_counter() - started
+            logger.info(f"{self.generated} replies in {elapsed:.0f}s ({self.generated / elapsed:.1f}/s), "
+                        f"complete up to line {self.next_line - 1}")
+
+    async def run(self, resume=False):
+        """Process the input and return a summary of this run."""
+        if resume:
+            self.next_line = self._load_checkpoint()
+            done, failed = self._read_output(self.next_line)
+            mode = "a"
+            logger.info(f"Resuming at line {self.next_line} ({len(done)} later replies already written, "
+                        f"{len(failed)} failed replies to retry)")
+        else:
+            done, failed = set(), set()
+            mode = "w"
+
+        started = time.perf_counter()
+        queue = asyncio.Queue(self.concurrency)
+        with open(self.output_path, mode, encoding="utf-8") as self._output:
+            workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+            checkpointer = asyncio.create_task(self._checkpoint_periodically(started))
+            try:
+                for line, item, styles in self._items(self.next_line, done, failed):
+                    self._remaining[line] = len(styles)
+                    for style in styles:
+                        await queue.put((line, item, style))
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                checkpointer.cancel()
+                for worker in workers:
+                    worker.cancel()
+                # Also on interruption: everything written so far is kept
+                self._save_checkpoint()
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            "generated": self.generated,
+            "failed": self.failed,
+            "invalid": self.invalid,
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "elapsed": elapsed,
+            "throughput": self.generated / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+            "complete_up_to_line": self.next_line - 1
+        }
+
+
+async def run_batch(args):
+    styles = None
+    if args.styles == "all":
+        styles = list(RESPONSE_STYLES)
+    elif args.styles:
+        styles = args.styles.split(",")
+        unknown = [style for style in styles if style not in RESPONSE_STYLES]
+        if unknown:
+            raise SystemExit(f"Unknown styles: {', '.join(unknown)}")
+
+    # Same quota as the bot; the queue only has to hold what the workers have in flight
+    scheduler = GeminiScheduler(max_concurrency=args.concurrency, requests_per_minute=args.requests_per_minute,
+                                max_queue=args.concurrency * 2)
+    ai_handler = AIHandler(model=args.model, base_url=args.base_url, scheduler=scheduler)
+    generator = BatchGenerator(ai_handler, args.input, args.output, concurrency=args.concurrency, styles=styles,
+                               use_cache=args.use_cache, checkpoint_interval=args.checkpoint_interval)
+    try:
+        return await generator.run(resume=args.resume)
+    finally:
+        await ai_handler.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate replies for a JSONL file of messages")
+    parser.add_argument("input", help="JSONL file of messages and user profiles")
+    parser.add_argument("output", help="JSONL file the replies are appended to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="requests in flight")
+    parser.add_argument("--styles", help='comma-separated styles to generate each message in, or "all"')
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the output's checkpoint and retry failed replies")
+    parser.add_argument("--use-cache", action="store_true", help="reuse replies for repeated inputs")
+    parser.add_argument("--base-url", default=GOOGLE_API_BASE_URL)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--requests-per-minute", type=float, default=GEMINI_REQUESTS_PER_MINUTE)
+    parser.add_argument("--checkpoint-interval", type=float, default=BATCH_CHECKPOINT_INTERVAL, help="seconds")
+    args = parser.parse_args()
+
+    configure_logging()
+    try:
+        summary = asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        raise SystemExit("Interrupted; run again with --resume to continue")
+    print(f"{summary['generated']} replies ({summary['failed']} failed, {summary['invalid']} invalid lines, "
+          f"{summary['skipped']} already done, {summary['retried']} retried) in {summary['elapsed']:.2f}s, "
+          f"{summary['throughput']:.1f} replies/s")
+    print(f"latency p50 {summary['latency_p50'] * 1000:.0f} ms  p95 {summary['latency_p95'] * 1000:.0f} ms  "
+          f"p99 {summary['latency_p99'] * 1000:.0f} ms  max {summary['latency_max'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Offline batch generation: throughput by concurrency, and interrupt/resume.
+
+Writes a JSONL file of messages and profiles, then runs batch_generate.py
+on it against the stub Gemini server at each --concurrency. Then runs
+it once more, interrupts it with SIGINT part-way, resumes it, and checks
+that every message got exactly one reply per style. Finally runs it with
+Gemini failing part of the time, resumes it with Gemini healthy, and
+checks that every failed reply was generated again.
+
+    python benchmarks/bench_batch.py --items 2000 --concurrency 1 8 32 64 --latency 0.1
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+from stub_gemini import StubGeminiServer
+
+MESSAGES = ("Hey, how was your day?", "I miss you", "Are you coming tonight?", "Good morning love",
+            "Why didn't you call me?", "Dehna neh?", "I had the worst day at work", "Guess what happened!")
+NAMES = ("Emma", "Sara", "Hana", "Liya", "")
+
+
+def write_input(path, count):
+    rng = random.Random(42)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            user = {"style": rng.choice(("romantic", "playful", "supportive", "passionate", "casual")),
+                    "girlfriend_name": rng.choice(NAMES),
+                    "personal_details": {"favorite_food": "injera"} if i % 3 == 0 else {},
+                    "history": [["Hi", "Hello love"]] * (i % 4)}
+            f.write(json.dumps({"id": f"m{i}", "message": f"{rng.choice(MESSAGES)} ({i})", "user_id": i % 500,
+                                "user": user}) + "\n")
+
+
+def batch_command(input_path, output_path, concurrency, extra=()):
+    return [sys.executable, os.path.join(ROOT_DIR, "batch_generate.py"), input_path, output_path,
+            "--concurrency", str(concurrency), "--requests-per-minute", "1000000", *extra]
+
+
+def run(command, env):
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, capture_output=True, text=True, cwd=ROOT_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return time.perf_counter() - start, result.stdout.strip()
+
+
+def check_output(path, items, styles):
+    """Return (missing, duplicated, failed) replies; failed ones are those whose last record isn't "ok"."""
+    counts = Counter()
+    last = {}
+    with open(path, encoding="utf-8") as f:
+        for raw in f:
+            record = json.loads(raw)
+            key = (record["line"], record["style"])
+            counts[key] += record["status"] == "ok"
+            last[key] = record["status"]
+    missing = sum(1 for line in range(1, items + 1) for style in styles if (line, style) not in last)
+    duplicates = sum(count - 1 for count in counts.values() if count > 1)
+    failed = sum(1 for status in last.values() if status != "ok")
+    return missing, duplicates, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch generation benchmark")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--latency", type=float, default=0.1, help="stub Gemini round-trip in seconds")
+    parser.add_argument("--interrupt-after", type=float, default=3.0, help="seconds before SIGINT")
+    parser.add_argument("--outage-error-rate", type=float, default=0.3, help="Gemini failures in the outage run")
+    args = parser.parse_args()
+
+    with StubGeminiServer(latency=args.latency) as gemini, tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, GOOGLE_API_KEY="stub", GOOGLE_API_BASE_URL=gemini.base_url, LOG_LEVEL="WARNING")
+        input_path = os.path.join(data_dir, "messages.jsonl")
+        write_input(input_path, args.items)
+        print(f"{args.items} messages, Gemini {args.latency * 1000:.0f} ms")
+
+        for concurrency in args.concurrency:
+            output_path = os.path.join(data_dir, f"replies-{concurrency}.jsonl")
+            elapsed, report = run(batch_command(input_path, output_path, concurrency), env)
+            print(f"concurrency {concurrency:>3}  wall {elapsed:6.2f}s  | {' | '.join(report.splitlines())}")
+
+        # Interrupt part-way, then resume; every (message, style) must appear exactly once
+        styles = ["romantic", "playful"]
+        extra = ["--styles", ",".join(styles), "--checkpoint-interval", "0.5"]
+        concurrency = max(args.concurrency)
+        output_path = os.path.join(data_dir, "replies-resumed.jsonl")
+        process = subprocess.Popen(batch_command(input_path, output_path, concurrency, extra), env=env,
+                                   cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(args.interrupt_after)
+        process.send_signal(signal.SIGINT)
+        process.wait()
+        with open(f"{output_path}.checkpoint", encoding="utf-8") as f:
+            stopped_at = json.load(f)["next_line"]
+        with open(output_path, encoding="utf-8") as f:
+            written = sum(1 for _ in f)
+        elapsed, report = run(batch_command(input_path, output_path, concurrency, [*extra, "--resume"]), env)
+        missing, duplicates, failed = check_output(output_path, args.items, styles)
+        print(f"interrupted at line {stopped_at} with {written} replies written; resumed in {elapsed:.2f}s: "
+              f"{report.splitlines()[0]}")
+        print(f"after resume: {missing} missing, {duplicates} duplicated, {failed} failed replies")
+
+        # A Gemini outage, then a resume with Gemini healthy again retries the failed replies
+        output_path = os.path.join(data_dir, "replies-outage.jsonl")
+        gemini.configure(error_rate=args.outage_error_rate)
+        extra = ["--styles", styles[0]]
+        run(batch_command(input_path, output_path, concurrency, extra), env)
+        _, _, failed_before = check_output(output_path, args.items, styles[:1])
+        gemini.configure(error_rate=0.0)
+        _, retry_report = run(batch_command(input_path, output_path, concurrency, [*extra, "--resume"]), env)
+        missing, duplicates, failed = check_output(output_path, args.items, styles[:1])
+        print(f"outage at error rate {args.outage_error_rate}: {failed_before} failed replies; "
+              f"resumed: {retry_report.splitlines()[0]}")
+        print(f"after resume: {missing} missing, {duplicates} duplicated, {failed} failed replies")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Cold-start time of app.py.
+
+Runs app.py in a subprocess against the stub Telegram and Gemini servers and
+measures, from process launch, how long until the health check answers and
+until setWebhook reaches Telegram. The stub Telegram API answers slowly
+(--telegram-latency), so any network call on the import path shows up in
+the time to first health check.
+
+    python benchmarks/bench_cold_start.py --runs 5 --telegram-latency 1.0
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from load_webhook import TOKEN
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+
+def import_time():
+    """Seconds to import app.py without serving (interpreter start-up included)."""
+    env = dict(os.environ, TELEGRAM_TOKEN=TOKEN, GOOGLE_API_KEY="stub",
+               TELEGRAM_API_BASE_URL="http://127.0.0.1:9/bot")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import app"], cwd=REPO_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def cold_start(port, telegram, gemini, timeout):
+    """Return (seconds to first 200 on /, seconds to setWebhook) for one launch."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ,
+                   TELEGRAM_TOKEN=TOKEN,
+                   TELEGRAM_API_BASE_URL=telegram.base_url,
+                   GOOGLE_API_BASE_URL=gemini.base_url,
+                   GOOGLE_API_KEY="stub",
+                   WEBHOOK_URL=f"http://127.0.0.1:{port}",
+                   PORT=str(port),
+                   USER_DATA_FILE=os.path.join(data_dir, "user_data.json"),
+                   SQLITE_DB_FILE=os.path.join(data_dir, "user_data.db"))
+        webhooks_before = telegram.calls["setWebhook"]
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, "app.py"], cwd=REPO_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        healthy = webhook = None
+        try:
+            deadline = start + timeout
+            while time.monotonic() < deadline and (healthy is None or webhook is None):
+                if process.poll() is not None:
+                    raise RuntimeError("app.py exited during start-up")
+                if healthy is None:
+                    try:
+                        if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                            healthy = time.monotonic() - start
+                    except httpx.HTTPError:
+                        pass
+                if webhook is None and telegram.calls["setWebhook"] > webhooks_before:
+                    webhook = max(t for t, m in telegram.call_times if m == "setWebhook") - start
+                time.sleep(0.01)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return healthy, webhook
+
+
+def describe(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return "n/a"
+    return f"median {statistics.median(values) * 1000:7.0f} ms  max {max(values) * 1000:7.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--telegram-latency", type=float, default=1.0, help="seconds per Bot API call")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    imports, healthy, webhook = [], [], []
+    with StubTelegramServer(latency=args.telegram_latency) as telegram, StubGeminiServer() as gemini:
+        for _ in range(args.runs):
+            imports.append(import_time())
+            h, w = cold_start(args.port, telegram, gemini, args.timeout)
+            healthy.append(h)
+            webhook.append(w)
+
+    print(f"runs                : {args.runs} (Telegram latency {args.telegram_latency:.2f}s)")
+    print(f"import app          : {describe(imports)}")
+    print(f"first health check  : {describe(healthy)}")
+    print(f"webhook registered  : {describe(webhook)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Check that concurrent Gemini calls overlap instead of queueing.
+
+Sends N messages through AIHandler.agenerate_response at once against the
+stub Gemini server and compares the wall time with one round-trip. Exits
+non-zero if the batch takes longer than --max-ratio round-trips.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_handler import AIHandler
+from scheduler import GeminiScheduler
+from stub_gemini import StubGeminiServer
+
+USER_DATA = {"style": "romantic", "history": [], "girlfriend_name": "Emma", "personal_details": {}}
+
+
+async def run_batch(handler, n):
+    messages = [f"I miss you ({i})" for i in range(n)]
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(handler.agenerate_response(m, USER_DATA) for m in messages))
+    elapsed = time.perf_counter() - start
+    await handler.aclose()
+    return responses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent agenerate_response benchmark")
+    parser.add_argument("-n", type=int, default=50, help="concurrent messages")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub round-trip in seconds")
+    parser.add_argument("--max-ratio", type=float, default=2.0,
+                        help="fail if wall time exceeds this many round-trips")
+    args = parser.parse_args()
+
+    with StubGeminiServer(latency=args.latency) as server:
+        # Size the scheduler to the burst so only the HTTP path is measured
+        scheduler = GeminiScheduler(max_concurrency=args.n, requests_per_minute=args.n * 60,
+                                    burst=args.n, max_queue=args.n)
+        handler = AIHandler(base_url=server.base_url, scheduler=scheduler)
+
+        start = time.perf_counter()
+        handler.generate_response("I miss you", USER_DATA)
+        sync_elapsed = time.perf_counter() - start
+
+        responses, elapsed = asyncio.run(run_batch(handler, args.n))
+
+    failed = sum(1 for r in responses if r.startswith("I couldn't generate"))
+    ratio = elapsed / args.latency
+    print(f"single sync round-trip : {sync_elapsed:.3f}s")
+    print(f"{args.n} concurrent async : {elapsed:.3f}s ({ratio:.2f} round-trips)")
+    print(f"throughput             : {args.n / elapsed:.1f} req/s")
+    print(f"failed responses       : {failed}")
+
+    if failed or ratio > args.max_ratio:
+        print("FAIL: concurrent requests did not overlap")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Micro-benchmark of LanguageDetector against the original detection functions.
+
+The original is_amharic / is_transliterated_amharic are copied here as the
+baseline. Both are run over a corpus of Fidel, transliterated and English
+messages, results are checked for agreement and the per-message cost printed.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from language_detector import LanguageDetector
+
+CORPUS = [
+    "ሰላም ውዴ እንዴት አደርሽ?",
+    "በጣም ናፍቄሻለሁ ❤️",
+    "ዛሬ ምን ትሰራለህ",
+    "selam wude, dehna aderk?",
+    "betam ewedihalehu",
+    "ene betam nafkehalehu",
+    "meche tmetaleh?",
+    "Good morning babe, did you sleep well?",
+    "I miss you so much, when are you coming home?",
+    "Can we talk tonight? Something happened at work today and I really need you",
+    "Happy anniversary! I can't believe it's been two years already 🥰",
+    "lol you're so silly",
+    "What are you doing this weekend?",
+    "I had a dream about us last night",
+]
+
+
+def legacy_is_amharic(text):
+    amharic_pattern = re.compile(r'[\u1200-\u137F]')
+    return bool(amharic_pattern.search(text))
+
+
+def legacy_is_transliterated_amharic(text):
+    amharic_markers = [
+        r'\b(ene|ante|anchi|esu|esua|egna|enanet|enante)\b',
+        r'\b(selam|tena yistilign|dehna|betam|ameseginalehu)\b',
+        r'\b(new|nesh|nat|nachew|nen)\b',
+        r'\b(yihe|yih|ya|yehe|esu)\b',
+        r'\b(min|man|yet|meche|sint)\b',
+        r'\b(alegn|alesh|ale|alat|alen|alachihu|alachew)\b',
+        r'\b(ewedihalehu|ewedishalehu|ewedihalew|ewediyatalew)\b',
+    ]
+    matches = 0
+    for pattern in amharic_markers:
+        if re.search(pattern, text.lower()):
+            matches += 1
+            if matches >= 1:
+                return True
+    return False
+
+
+def legacy_mode(text):
+    # The same two calls generate_response used to make for every message
+    is_amharic_message = legacy_is_amharic(text)
+    is_transliterated = legacy_is_transliterated_amharic(text)
+    if is_amharic_message:
+        return "amharic"
+    if is_transliterated:
+        return "transliterated"
+    return "english"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Language detection micro-benchmark")
+    parser.add_argument("-n", type=int, default=20000, help="messages per run")
+    parser.add_argument("--extra-markers", type=int, default=500,
+                        help="size of a synthetic extra vocabulary for the loaded-detector run")
+    args = parser.parse_args()
+
+    random.seed(1)
+    messages = [random.choice(CORPUS) for _ in range(args.n)]
+
+    detector = LanguageDetector(marker_files=[])
+    mismatches = [m for m in CORPUS if detector.detect(m).mode != legacy_mode(m)]
+    if mismatches:
+        print(f"FAIL: detector disagrees with the original on {mismatches}")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        marker_file = os.path.join(tmp, "synthetic.txt")
+        with open(marker_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(f"zq{i}x" for i in range(args.extra_markers)))
+        loaded = LanguageDetector(marker_files=[marker_file])
+
+    runs = [
+        ("original functions", lambda: [legacy_mode(m) for m in messages]),
+        ("LanguageDetector", lambda: [detector.detect(m) for m in messages]),
+        (f"LanguageDetector +{args.extra_markers} markers", lambda: [loaded.detect(m) for m in messages]),
+    ]
+    baseline = None
+    for name, run in runs:
+        elapsed = min(timeit.repeat(run, number=1, repeat=5))
+        per_message = elapsed / args.n * 1e6
+        baseline = baseline or per_message
+        print(f"{name:<36} {per_message:7.2f} us/message  ({baseline / per_message:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
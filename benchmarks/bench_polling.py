@@ -0,0 +1,113 @@
+"""Polling-mode update processing: throughput and per-user ordering.
+
+Feeds private messages into application.update_queue (where polling puts
+fetched updates) against the stub Telegram and Gemini servers, with some
+Gemini replies slow so concurrent replies can finish out of order. Each
+user's messages are checked to land in their history in the order sent.
+
+  sequential - python-telegram-bot's default, one update at a time
+  concurrent - plain concurrent processing (SimpleUpdateProcessor)
+  per-user   - PerUserUpdateProcessor, concurrent across users only
+
+    python benchmarks/bench_polling.py --users 50 --messages 4 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_webhook import TOKEN
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+MODES = ("sequential", "concurrent", "per-user")
+
+
+def message_json(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    }}
+
+
+async def run_mode(mode, args, telegram, gemini, data_dir):
+    from telegram import Update
+    from telegram.ext import SimpleUpdateProcessor
+    from ai_handler import AIHandler
+    from main import create_application
+    from scheduler import GeminiScheduler
+    from storage import JSONStorage
+    from update_processor import PerUserUpdateProcessor
+    from user_manager import UserManager
+
+    processor = {
+        "sequential": None,
+        "concurrent": SimpleUpdateProcessor(args.concurrency) if args.concurrency > 1 else None,
+        "per-user": PerUserUpdateProcessor(concurrency=args.concurrency)
+    }[mode]
+    total = args.users * args.messages
+    scheduler = GeminiScheduler(max_concurrency=total, requests_per_minute=total * 600, burst=total, max_queue=total)
+    user_manager = UserManager(storage=JSONStorage(os.path.join(data_dir, f"{mode}.json")))
+    application = create_application(user_manager=user_manager,
+                                     ai_handler=AIHandler(base_url=gemini.base_url, scheduler=scheduler),
+                                     update_processor=processor)
+
+    sent_before = telegram.calls["sendMessage"]
+    async with application:
+        await application.start()
+        start = time.perf_counter()
+        update_id = 0
+        for k in range(args.messages):
+            for u in range(args.users):
+                update_id += 1
+                update = message_json(update_id, 7000 + u, f"message {k} from user {u}")
+                await application.update_queue.put(Update.de_json(update, application.bot))
+        while telegram.calls["sendMessage"] - sent_before < total and time.perf_counter() - start < args.timeout:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await application.stop()
+
+    out_of_order = 0
+    for u in range(args.users):
+        sent = [f"message {k} from user {u}" for k in range(args.messages)]
+        history = [message for message, _ in user_manager.get_user(7000 + u)["history"]]
+        out_of_order += history != sent[-len(history):]
+    replies = telegram.calls["sendMessage"] - sent_before
+    return elapsed, replies, out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Polling update processing benchmark")
+    parser.add_argument("modes", nargs="*", default=list(MODES), help=f"any of {', '.join(MODES)}")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4, help="messages per user (at most 10)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub Gemini round-trip in seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.3, help="fraction of Gemini calls 3x slower")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    with StubTelegramServer() as telegram, \
+            StubGeminiServer(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.latency * 3) as gemini, \
+            tempfile.TemporaryDirectory() as data_dir:
+        # config is read at import, so point it at the stubs before main is imported
+        os.environ.update(TELEGRAM_TOKEN=TOKEN, TELEGRAM_API_BASE_URL=telegram.base_url,
+                          GOOGLE_API_KEY="stub", LOG_LEVEL="WARNING",
+                          MESSAGE_STORE_DB_FILE=os.path.join(data_dir, "message_context.db"))
+        total = args.users * args.messages
+        print(f"{total} messages from {args.users} users, Gemini {args.latency * 1000:.0f} ms "
+              f"({args.slow_rate:.0%} at 3x)")
+        for mode in args.modes:
+            elapsed, replies, out_of_order = asyncio.run(run_mode(mode, args, telegram, gemini, data_dir))
+            print(f"{mode:<11} {replies:>5}/{total} replies in {elapsed:6.2f}s  {replies / elapsed:7.1f} updates/s  "
+                  f"users with out-of-order history: {out_of_order}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Golden-corpus check and micro-benchmark for reply post-processing.
+
+Checks that ResponsePostprocessor.clean() reproduces the pinned output in
+postprocess_golden.json (generated from the original str.replace chain),
+then times it against that chain, for whole replies and for streams cleaned
+chunk by chunk. Exits non-zero if any golden case differs.
+
+    python benchmarks/bench_postprocess.py --runs 20000 --chunk 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from postprocess import ResponsePostprocessor
+
+GOLDEN_FILE = os.path.join(BENCH_DIR, "postprocess_golden.json")
+PLAIN_REPLY = ("Good morning, beautiful! I hope you slept well. I was thinking about you all night "
+               "and I can't wait to see you later. Let's get dinner at that little place you love. ") * 3
+
+
+def legacy_clean(ai_response):
+    """The clean-up chain generate_response used before the pipeline."""
+    ai_response = ai_response.strip()
+    ai_response = ai_response.replace("**", "").replace("Option 1:", "").replace("Option 2:", "")
+    ai_response = ai_response.replace("Option 3:", "").replace("*", "")
+    ai_response = "\n".join([line for line in ai_response.split("\n")
+                             if not (line.strip().startswith(("1.", "2.", "3.")) and len(line.strip()) > 3)])
+    for prefix in ["My response:", "Response:", "Boyfriend:", "Me:"]:
+        if ai_response.startswith(prefix):
+            ai_response = ai_response[len(prefix):].strip()
+    return ai_response
+
+
+def check_golden(postprocessor, chunk_size):
+    with open(GOLDEN_FILE, encoding="utf-8") as f:
+        corpus = json.load(f)
+    failures = 0
+    for case in corpus:
+        got = postprocessor.clean(case["input"])
+        if got != case["expected"]:
+            failures += 1
+            print(f"MISMATCH {case['input']!r}\n  expected {case['expected']!r}\n  got      {got!r}")
+    # Streaming previews are approximate; count how many end on the exact final text
+    exact_previews = 0
+    for case in corpus:
+        cleaner = postprocessor.stream()
+        partial = ""
+        for start in range(0, len(case["input"]), chunk_size):
+            partial = cleaner.feed(case["input"][start:start + chunk_size])
+        exact_previews += partial == case["expected"]
+    print(f"golden corpus: {len(corpus) - failures}/{len(corpus)} match, "
+          f"{exact_previews}/{len(corpus)} stream previews end on the final text")
+    return failures
+
+
+def time_calls(func, texts, runs):
+    start = time.perf_counter()
+    for i in range(runs):
+        func(texts[i % len(texts)])
+    return (time.perf_counter() - start) / runs
+
+
+def time_stream(feed_factory, text, chunk_size, runs):
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    start = time.perf_counter()
+    for _ in range(runs):
+        feed = feed_factory()
+        for chunk in chunks:
+            feed(chunk)
+    return (time.perf_counter() - start) / runs
+
+
+def legacy_stream():
+    text = ""
+
+    def feed(chunk):
+        nonlocal text
+        text += chunk
+        return legacy_clean(text)
+    return feed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-processing benchmark")
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--stream-runs", type=int, default=500)
+    parser.add_argument("--chunk", type=int, default=8, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    postprocessor = ResponsePostprocessor()
+    failures = check_golden(postprocessor, args.chunk)
+
+    with open(GOLDEN_FILE, encoding="utf-8") as f:
+        texts = [case["input"] for case in json.load(f)]
+    long_reply = "**Option 1:** " + " ".join(texts) * 3 + "\n1. a numbered line\nThe end."
+
+    print(f"\n{'':24} {'legacy':>12} {'pipeline':>12}")
+    legacy = time_calls(legacy_clean, texts, args.runs)
+    pipeline = time_calls(postprocessor.clean, texts, args.runs)
+    print(f"{'clean (corpus)':24} {legacy * 1e6:9.2f} µs {pipeline * 1e6:9.2f} µs")
+    legacy = time_calls(legacy_clean, [PLAIN_REPLY], args.runs)
+    pipeline = time_calls(postprocessor.clean, [PLAIN_REPLY], args.runs)
+    print(f"{f'clean (plain, {len(PLAIN_REPLY)} chars)':24} {legacy * 1e6:9.2f} µs {pipeline * 1e6:9.2f} µs")
+    legacy = time_calls(legacy_clean, [long_reply], args.runs // 10)
+    pipeline = time_calls(postprocessor.clean, [long_reply], args.runs // 10)
+    print(f"{f'clean ({len(long_reply)} chars)':24} {legacy * 1e6:9.2f} µs {pipeline * 1e6:9.2f} µs")
+    legacy = time_stream(legacy_stream, long_reply, args.chunk, args.stream_runs)
+    pipeline = time_stream(lambda: postprocessor.stream().feed, long_reply, args.chunk, args.stream_runs)
+    print(f"{'stream (per reply)':24} {legacy * 1e3:9.2f} ms {pipeline * 1e3:9.2f} ms")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Prompt size and build time for users with many personal details.
+
+Compares the budgeted PromptBuilder with an unbounded builder that renders
+every detail on every call, as the bot used to.
+
+    python benchmarks/bench_prompt_builder.py --details 0 20 200 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+LANGUAGE_INSTRUCTION = "Respond in English."
+BIG_BUDGET = 10 ** 9
+
+
+def user_data(details):
+    return {
+        "style": "romantic",
+        "girlfriend_name": "Emma",
+        "personal_details": {f"detail {i}": f"something she told me about week {i} of us" for i in range(details)},
+        "history": [[f"message {i}", f"reply {i}"] for i in range(10)]
+    }
+
+
+def time_build(builder, data, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        prompt = builder.build("I miss you so much today", data, LANGUAGE_INSTRUCTION, user_id=1)
+    return (time.perf_counter() - start) / runs, prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt builder benchmark")
+    parser.add_argument("--details", type=int, nargs="+", default=[0, 20, 200, 1000])
+    parser.add_argument("--budget", type=int, default=1024, help="token budget for the budgeted builder")
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'details':>8} {'unbounded':>22} {'budgeted':>22}")
+    for count in args.details:
+        data = user_data(count)
+        # Unbounded: no budget and no details cache (user_id is ignored when details change every call)
+        unbounded = PromptBuilder(token_budget=BIG_BUDGET, details_cache_size=0)
+        budgeted = PromptBuilder(token_budget=args.budget)
+        row = []
+        for builder in (unbounded, budgeted):
+            seconds, prompt = time_build(builder, data, args.runs)
+            row.append(f"{estimate_tokens(prompt):6d} tok {seconds * 1e6:7.1f} µs")
+        print(f"{count:8d} {row[0]:>22} {row[1]:>22}")
+
+
+if __name__ == "__main__":
+    main()
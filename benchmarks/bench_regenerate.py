@@ -0,0 +1,69 @@
+"""Regenerate presses: one Gemini call per press vs batched candidates.
+
+Simulates users pressing "Regenerate" several times on the same message
+against the stub Gemini API. It reports the latency per press and how
+many requests reached the API, for:
+  per-press  - agenerate_response on every press (the old behaviour)
+  batched    - aregenerate_response with candidateCount
+  fallback   - aregenerate_response on a model that rejects candidateCount
+
+    python benchmarks/bench_regenerate.py --users 20 --presses 4 --latency 0.5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_handler import AIHandler
+from response_cache import ResponseCache
+from scheduler import GeminiScheduler
+from stub_gemini import StubGeminiServer
+
+USER_DATA = {"style": "romantic", "history": [], "girlfriend_name": "Emma", "personal_details": {}}
+
+
+async def run(handler, users, presses, batched):
+    latencies = []
+
+    async def user(i):
+        message_id = f"msg_{i}"
+        for _ in range(presses):
+            start = time.perf_counter()
+            if batched:
+                await handler.aregenerate_response(message_id, f"message {i}", USER_DATA, user_id=i)
+            else:
+                await handler.agenerate_response(f"message {i}", USER_DATA, use_cache=False, user_id=i)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+    await handler.aclose()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate latency benchmark")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--presses", type=int, default=4, help="regenerate presses per user")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub Gemini latency")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    for label, batched, multi in (("per-press", False, True), ("batched", True, True),
+                                  ("fallback", True, False)):
+        with StubGeminiServer(latency=args.latency, multi_candidate=multi,
+                              vary_replies=True) as server:
+            scheduler = GeminiScheduler(max_concurrency=1000, requests_per_minute=10 ** 6, burst=1000)
+            handler = AIHandler(base_url=server.base_url, cache=ResponseCache(max_entries=0), scheduler=scheduler)
+            latencies = asyncio.run(run(handler, args.users, args.presses, batched))
+            print(f"{label:<10} mean {statistics.mean(latencies) * 1000:7.1f} ms/press"
+                  f"  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+                  f"  API requests {server.request_count:>4} for {len(latencies)} presses")
+
+
+if __name__ == "__main__":
+    main()
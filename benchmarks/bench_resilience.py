@@ -0,0 +1,111 @@
+"""Exercise the Gemini resilience layer against the fault-injecting stub.
+
+Scenarios:
+  errors  - a share of requests fail with 503; success rate without and with retries
+  tail    - a share of requests are slow; p50/p99 without and with hedging
+  outage  - every request fails; the circuit breaker should open and fail fast
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_handler import AIHandler, FALLBACK_RESPONSE
+from resilience import ResilientCaller, CircuitBreaker
+from response_cache import ResponseCache
+from scheduler import GeminiScheduler
+from stub_gemini import StubGeminiServer
+
+USER_DATA = {"style": "romantic", "history": [], "girlfriend_name": "Emma", "personal_details": {}}
+
+
+def make_handler(server, resilience):
+    scheduler = GeminiScheduler(max_concurrency=1000, requests_per_minute=10 ** 6, burst=1000,
+                                max_queue=10000)
+    # A zero-size cache keeps every call on the network path
+    return AIHandler(base_url=server.base_url, cache=ResponseCache(max_entries=0),
+                     scheduler=scheduler, resilience=resilience)
+
+
+async def run(handler, n, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await handler.agenerate_response(f"message {i}", USER_DATA)
+            latencies.append(time.perf_counter() - start)
+            return response != FALLBACK_RESPONSE
+
+    results = await asyncio.gather(*(one(i) for i in range(n)))
+    await handler.aclose()
+    return sum(results) / n, sorted(latencies)
+
+
+def pct(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+
+def scenario_errors(args):
+    print(f"errors: {args.error_rate:.0%} of requests fail with 503")
+    with StubGeminiServer(latency=0.02, error_rate=args.error_rate) as server:
+        for label, retries in (("no retries", 0), ("3 retries", 3)):
+            caller = ResilientCaller(max_retries=retries, backoff_base=0.05,
+                                     breaker=CircuitBreaker(failure_threshold=10 ** 6))
+            success, _ = asyncio.run(run(make_handler(server, caller), args.n, 20))
+            print(f"  {label:<12} success {success:6.1%}  retries {caller.retries}")
+
+
+def scenario_tail(args):
+    print(f"tail: {args.slow_rate:.0%} of requests take 1s instead of 50ms")
+    with StubGeminiServer(latency=0.05, slow_rate=args.slow_rate, slow_latency=1.0) as server:
+        for label, hedge in (("no hedging", False), ("hedging", True)):
+            caller = ResilientCaller(hedge=hedge, hedge_min_delay=0.1)
+            handler = make_handler(server, caller)
+            # Warm up the latency window the hedge threshold is taken from
+            server.configure(slow_rate=0.0)
+            asyncio.run(run(handler, 50, 10))
+            server.configure(slow_rate=args.slow_rate)
+            _, latencies = asyncio.run(run(handler, args.n, 10))
+            print(f"  {label:<12} p50 {statistics.median(latencies) * 1000:7.1f} ms"
+                  f"  p99 {pct(latencies, 99) * 1000:7.1f} ms  hedges {caller.hedges}"
+                  f"  hedge wins {caller.hedge_wins}")
+
+
+def scenario_outage(args):
+    print("outage: every request fails with 503")
+    with StubGeminiServer(latency=0.05, error_rate=1.0) as server:
+        caller = ResilientCaller(max_retries=1, backoff_base=0.05,
+                                 breaker=CircuitBreaker(failure_threshold=5, reset_timeout=60))
+        success, latencies = asyncio.run(run(make_handler(server, caller), args.n, 1))
+        print(f"  success {success:.0%}  requests reaching the API {server.request_count}/{args.n}"
+              f"  breaker {caller.breaker.state}  p50 {statistics.median(latencies) * 1000:.2f} ms")
+
+
+SCENARIOS = {"errors": scenario_errors, "tail": scenario_tail, "outage": scenario_outage}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini resilience benchmark")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS),
+                        help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("-n", type=int, default=200, help="requests per run")
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)  # injected faults are expected here
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+        SCENARIOS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Latency-aware model routing for inline queries.
+
+Sends a steady stream of inline-route requests through AIHandler against
+the stub Gemini server, which answers the primary and the fallback model
+with their own latencies. Three phases: both models healthy, the primary
+slowed down, the primary healthy again. Each phase runs with routing (the
+inline route's fallback model) and without (primary only), and reports
+the latency percentiles and which models answered.
+
+    python benchmarks/bench_routing.py --rate 20 --phase-seconds 10 --slow-latency 2.5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from stub_gemini import StubGeminiServer
+
+PRIMARY = "gemini-1.5-flash"
+FALLBACK = "gemini-1.5-flash-8b"
+USER_DATA = {"style": "romantic", "girlfriend_name": "Emma", "personal_details": {}, "history": []}
+
+
+async def run_phase(handler, args):
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await handler.agenerate_response(f"query {i}", USER_DATA, use_cache=False, user_id=i % 50,
+                                         entry_point="inline")
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    count = int(args.rate * args.phase_seconds)
+    start = time.perf_counter()
+    for i in range(count):
+        await asyncio.sleep(max(0.0, start + i / args.rate - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "max": latencies[-1]
+    }
+
+
+async def run_mode(routing, args, gemini):
+    from ai_handler import AIHandler
+    from config import MODEL_ROUTES
+    from model_router import ModelRouter
+    from scheduler import GeminiScheduler
+
+    routes = {name: dict(route) for name, route in MODEL_ROUTES.items()}
+    routes["inline"].update(model=f"models/{PRIMARY}", fallback_model=f"models/{FALLBACK}" if routing else "",
+                            latency_target=args.target)
+    router = ModelRouter(routes=routes, window=args.window)
+    scheduler = GeminiScheduler(max_concurrency=1000, requests_per_minute=1e6, burst=1000, max_queue=1000)
+    handler = AIHandler(base_url=gemini.base_url, scheduler=scheduler, router=router)
+
+    phases = (("healthy", args.latency), ("primary slow", args.slow_latency), ("recovered", args.latency))
+    results = []
+    try:
+        for name, primary_latency in phases:
+            gemini.configure(model_latency={PRIMARY: primary_latency, FALLBACK: args.fallback_latency})
+            before = gemini.model_counts.copy()
+            result = await run_phase(handler, args)
+            counts = gemini.model_counts - before
+            result["models"] = {model: counts[model] for model in (PRIMARY, FALLBACK) if counts[model]}
+            results.append((name, result))
+    finally:
+        await handler.aclose()
+    return results, router.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model routing benchmark")
+    parser.add_argument("--rate", type=float, default=20, help="inline requests per second")
+    parser.add_argument("--phase-seconds", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="primary latency when healthy")
+    parser.add_argument("--slow-latency", type=float, default=2.5, help="primary latency when degraded")
+    parser.add_argument("--fallback-latency", type=float, default=0.15)
+    parser.add_argument("--target", type=float, default=1.0, help="inline latency target in seconds")
+    parser.add_argument("--window", type=float, default=5, help="routing latency window in seconds")
+    args = parser.parse_args()
+
+    with StubGeminiServer(latency=args.latency) as gemini:
+        # config is read at import, so point it at the stub before ai_handler is imported
+        os.environ.update(GOOGLE_API_KEY="stub", LOG_LEVEL="WARNING")
+        print(f"inline at {args.rate:.0f}/s, target {args.target}s, primary {args.latency}s "
+              f"(slow {args.slow_latency}s), fallback {args.fallback_latency}s")
+        for routing in (False, True):
+            results, stats = asyncio.run(run_mode(routing, args, gemini))
+            for name, result in results:
+                print(f"{'routing' if routing else 'primary only':<13} {name:<13} p50 {result['p50'] * 1000:6.0f} ms  "
+                      f"p95 {result['p95'] * 1000:6.0f} ms  max {result['max'] * 1000:6.0f} ms  "
+                      f"answered by {result['models']}")
+            decisions = {key: value for key, value in stats.items() if key.startswith("decisions_")}
+            print(f"{'':<13} decisions {decisions}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Webhook throughput with 1, 2, 4 and 8 worker processes (WEB_WORKERS).
+
+Runs app.py with the SQLite store against the stub Telegram and Gemini
+servers for each worker count and posts private messages from many users;
+each user's messages are posted one after another, users concurrently.
+Reports replies per second and checks that every user's history in the
+shared database is in the order the messages were sent.
+
+WEB_WORKERS=1 is the single-process mode; above that app.py routes updates
+by user to that many worker processes. Gains are bounded by the CPU count.
+
+    python benchmarks/bench_scaling.py --workers 1 2 4 8 --users 200 --messages 5
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_webhook import TOKEN, start_app
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+FIRST_USER = 9000
+
+
+def message_json(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    }}
+
+
+async def post_all(port, args):
+    url = f"http://127.0.0.1:{port}/{TOKEN}"
+    statuses = {}
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency), timeout=60) as client:
+        async def user_session(u):
+            for k in range(args.messages):
+                update_id = k * args.users + u + 1
+                update = message_json(update_id, FIRST_USER + u, f"message {k} from user {u}")
+                while True:
+                    response = await client.post(url, json=update)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code != 503:
+                        break
+                    await asyncio.sleep(0.1)  # Like Telegram, retry when the bot is busy
+
+        await asyncio.gather(*(user_session(u) for u in range(args.users)))
+    return statuses
+
+
+def out_of_order_users(db_file, args):
+    conn = sqlite3.connect(db_file)
+    try:
+        bad = 0
+        for u in range(args.users):
+            history = [row[0] for row in conn.execute(
+                "SELECT message FROM history WHERE user_id = ? ORDER BY id", (str(FIRST_USER + u),))]
+            sent = [f"message {k} from user {u}" for k in range(args.messages)]
+            bad += history != sent[-len(history):] or not history
+        return bad
+    finally:
+        conn.close()
+
+
+def run(workers, args, telegram, gemini):
+    total = args.users * args.messages
+    with tempfile.TemporaryDirectory() as data_dir:
+        process = start_app(args.port, telegram, gemini, data_dir, WEB_WORKERS=str(workers),
+                            STORAGE_BACKEND="sqlite", LOG_LEVEL="WARNING",
+                            GEMINI_MAX_CONCURRENCY=str(total), GEMINI_MAX_QUEUE=str(total),
+                            GEMINI_REQUESTS_PER_MINUTE=str(total * 600), GEMINI_RATE_BURST=str(total))
+        try:
+            sent_before = telegram.calls["sendMessage"]
+            start = time.perf_counter()
+            statuses = asyncio.run(post_all(args.port, args))
+            while telegram.calls["sendMessage"] - sent_before < total and time.perf_counter() - start < args.timeout:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            replies = telegram.calls["sendMessage"] - sent_before
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        return replies, elapsed, statuses, out_of_order_users(os.path.join(data_dir, "user_data.db"), args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker scaling benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="messages per user (at most 10)")
+    parser.add_argument("--concurrency", type=int, default=100, help="concurrent webhook posts")
+    parser.add_argument("--gemini-latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=18083)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    total = args.users * args.messages
+    print(f"{total} messages from {args.users} users on {os.cpu_count()} CPUs, "
+          f"Gemini {args.gemini_latency * 1000:.0f} ms")
+    with StubTelegramServer() as telegram, StubGeminiServer(latency=args.gemini_latency) as gemini:
+        for workers in args.workers:
+            replies, elapsed, statuses, bad = run(workers, args, telegram, gemini)
+            print(f"{workers} worker{'s' if workers > 1 else ' '}  {replies:>5}/{total} replies in {elapsed:6.2f}s  "
+                  f"{replies / elapsed:7.1f} updates/s  webhook {statuses}  out-of-order users: {bad}")
+
+
+if __name__ == "__main__":
+    main()
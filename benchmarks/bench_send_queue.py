@@ -0,0 +1,119 @@
+"""Outbound Telegram sends with and without the send queue.
+
+Sends a burst of replies to many chats plus a stream of edits to one
+message per chat through the bot, against the stub Telegram server with
+flood limits like Telegram's (about 30 messages/s per bot, 1/s per chat
+with short bursts). Replies go out at reply priority, edits in the
+background like streaming edits do.
+
+  direct - plain bot calls; flood control answers with 429s, python-telegram-bot raises RetryAfter
+  queued - through TelegramSendQueue (the app's rate limiter)
+
+Reports calls that failed, 429s received, Bot API calls made, edits
+dropped as superseded, total time and how long replies waited.
+
+    python benchmarks/bench_send_queue.py --chats 40 --replies 2 --edits 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_webhook import TOKEN
+from stub_telegram import StubTelegramServer
+
+MODES = ("direct", "queued")
+FIRST_CHAT = 5000
+
+
+async def run_mode(mode, args, telegram):
+    from telegram.error import TelegramError
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+    from send_queue import TelegramSendQueue
+
+    send_queue = TelegramSendQueue() if mode == "queued" else None
+    bot = ExtBot(TOKEN, base_url=telegram.base_url, rate_limiter=send_queue,
+                 request=HTTPXRequest(connection_pool_size=256))
+    failed = 0
+    reply_latencies = []
+
+    async def reply(chat_id, k):
+        nonlocal failed
+        start = time.perf_counter()
+        try:
+            message = await bot.send_message(chat_id, f"reply {k}")
+        except TelegramError:
+            failed += 1
+            return None
+        reply_latencies.append(time.perf_counter() - start)
+        return message
+
+    async def edit(chat_id, message_id, k):
+        nonlocal failed
+        try:
+            await bot.edit_message_text(f"partial {k}", chat_id=chat_id, message_id=message_id)
+        except TelegramError:
+            failed += 1
+
+    async def chat_session(chat_id):
+        first = await reply(chat_id, 0)
+        edits = []
+        if first is not None:
+            for k in range(args.edits):
+                edits.append(asyncio.create_task(edit(chat_id, first.message_id, k)))
+                await asyncio.sleep(args.edit_interval)
+        await asyncio.gather(*(reply(chat_id, k) for k in range(1, args.replies)), *edits)
+
+    async with bot:
+        before = telegram.calls.copy()
+        start = time.perf_counter()
+        await asyncio.gather(*(chat_session(FIRST_CHAT + c) for c in range(args.chats)))
+        elapsed = time.perf_counter() - start
+    calls = telegram.calls - before
+    flooded = sum(count for method, count in calls.items() if method.endswith(":429"))
+    made = sum(count for method, count in calls.items() if ":" not in method and method != "getMe")
+    stats = send_queue.stats() if send_queue is not None else {}
+    return {
+        "failed": failed,
+        "flooded": flooded,
+        "api_calls": made,
+        "superseded": stats.get("superseded_edits", 0),
+        "elapsed": elapsed,
+        "reply_p50": statistics.median(reply_latencies) if reply_latencies else 0.0,
+        "reply_max": max(reply_latencies, default=0.0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram send queue benchmark")
+    parser.add_argument("modes", nargs="*", default=list(MODES), help=f"any of {', '.join(MODES)}")
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--replies", type=int, default=2, help="replies per chat")
+    parser.add_argument("--edits", type=int, default=10, help="edits of each chat's first reply")
+    parser.add_argument("--edit-interval", type=float, default=0.1, help="seconds between a chat's edits")
+    parser.add_argument("--global-limit", type=int, default=30, help="stub flood limit per second for the bot")
+    parser.add_argument("--chat-limit", type=int, default=3, help="stub flood limit per second per chat")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    sends = args.chats * (args.replies + args.edits)
+    print(f"{args.chats} chats, {args.replies} replies and {args.edits} edits each ({sends} sends), "
+          f"stub limits {args.global_limit}/s per bot and {args.chat_limit}/s per chat")
+    with StubTelegramServer(global_limit=args.global_limit, chat_limit=args.chat_limit) as telegram:
+        for mode in args.modes:
+            result = asyncio.run(run_mode(mode, args, telegram))
+            print(f"{mode:<7} failed {result['failed']:>4}  429s {result['flooded']:>4}  "
+                  f"api calls {result['api_calls']:>4}  superseded edits {result['superseded']:>4}  "
+                  f"in {result['elapsed']:6.2f}s  reply wait p50 {result['reply_p50'] * 1000:6.0f} ms  "
+                  f"max {result['reply_max'] * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
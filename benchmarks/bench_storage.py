@@ -0,0 +1,93 @@
+"""Write latency of the UserManager storage backends as the user count grows.
+
+For each size the store is pre-populated with that many users (each with a
+full history), then --ops random history appends are timed. SQLite latency
+should stay flat; JSON latency grows with the number of users.
+
+    python benchmarks/bench_storage.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MAX_HISTORY_LENGTH
+from storage import JSONStorage, SQLiteStorage
+
+PAIR = ["Good morning, did you sleep well?", "I did, dreaming of you all night ☀️"]
+
+
+def populate_sqlite(storage, n):
+    with storage.conn:
+        storage.conn.executemany(
+            "INSERT INTO users (user_id, style, girlfriend_name) VALUES (?, 'romantic', 'Emma')",
+            ((str(i),) for i in range(n))
+        )
+        storage.conn.executemany(
+            "INSERT INTO history (user_id, message, response) VALUES (?, ?, ?)",
+            ((str(i), PAIR[0], PAIR[1]) for i in range(n) for _ in range(MAX_HISTORY_LENGTH))
+        )
+
+
+def populate_json(path, n):
+    users = {
+        str(i): {
+            "style": "romantic",
+            "history": [PAIR] * MAX_HISTORY_LENGTH,
+            "girlfriend_name": "Emma",
+            "personal_details": {}
+        }
+        for i in range(n)
+    }
+    with open(path, 'w') as f:
+        json.dump(users, f)
+
+
+def time_appends(storage, n, ops):
+    latencies = []
+    for _ in range(ops):
+        user_id = str(random.randrange(n))
+        start = time.perf_counter()
+        storage.append_history(user_id, PAIR, MAX_HISTORY_LENGTH)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(backend, n, latencies):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{backend:<7} {n:>9} users  mean {statistics.mean(latencies) * 1000:8.3f} ms"
+          f"  p50 {statistics.median(latencies) * 1000:8.3f} ms  p95 {p95 * 1000:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage backend write latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--ops", type=int, default=500, help="timed writes per size")
+    parser.add_argument("--json-max", type=int, default=10000,
+                        help="skip the JSON backend above this many users")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            storage = SQLiteStorage(os.path.join(tmp, f"users_{n}.db"))
+            populate_sqlite(storage, n)
+            report("sqlite", n, time_appends(storage, n, args.ops))
+            storage.close()
+
+            if n <= args.json_max:
+                path = os.path.join(tmp, f"users_{n}.json")
+                populate_json(path, n)
+                storage = JSONStorage(path)
+                storage.load_all()
+                report("json", n, time_appends(storage, n, min(args.ops, 50)))
+
+
+if __name__ == "__main__":
+    main()
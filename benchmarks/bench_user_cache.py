@@ -0,0 +1,64 @@
+"""Startup time and working-set behaviour of UserManager on SQLite.
+
+For each store size, compares loading every user up front (what startup
+used to do) with constructing a lazy UserManager. It then replays a
+skewed access pattern (a few users are very active, most are rare) and
+reports the hit rate, load latency and resident count.
+
+    python benchmarks/bench_user_cache.py --sizes 10000 100000 1000000 --resident 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_storage import PAIR, populate_sqlite
+from storage import SQLiteStorage
+from user_manager import UserManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UserManager lazy loading and LRU benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--resident", type=int, default=10000, help="max resident users")
+    parser.add_argument("--ops", type=int, default=50000, help="message appends to replay")
+    parser.add_argument("--skew", type=float, default=4.0,
+                        help="higher concentrates activity on fewer users (1 = uniform)")
+    args = parser.parse_args()
+
+    random.seed(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            path = os.path.join(tmp, f"users_{n}.db")
+            storage = SQLiteStorage(path)
+            populate_sqlite(storage, n)
+
+            start = time.perf_counter()
+            storage.load_all()
+            eager = time.perf_counter() - start
+            storage.close()
+
+            start = time.perf_counter()
+            manager = UserManager(storage=SQLiteStorage(path), max_resident=args.resident)
+            lazy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.ops):
+                user_id = int(n * random.random() ** args.skew)
+                manager.add_to_history(user_id, PAIR)
+            replay = time.perf_counter() - start
+            stats = manager.stats()
+            manager.close()
+
+            print(f"{n:>9} users  startup eager {eager * 1000:9.1f} ms  lazy {lazy * 1000:6.1f} ms"
+                  f"  | hit rate {stats['hit_rate']:6.1%}  resident {stats['resident_users']:>6}"
+                  f"  evictions {stats['evictions']:>6}  avg load {stats['avg_load_time'] * 1e6:6.1f} µs"
+                  f"  per op {replay / args.ops * 1e6:6.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Memory per resident user: plain dicts (as loaded from JSON) vs UserRecord.
+
+Generates a user_data.json-shaped document, loads it with json.loads the
+way the bot used to keep it, then converts the same document to
+UserRecords, and reports traced bytes per user for each. Message strings
+are shared by both layouts, so the difference is container overhead.
+
+    python benchmarks/bench_user_memory.py --users 100000 --history 10
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RESPONSE_STYLES
+from user_record import UserRecord
+
+
+def make_document(users, history, details):
+    random.seed(3)
+    styles = list(RESPONSE_STYLES)
+    return json.dumps({
+        str(1000 + i): {
+            "style": random.choice(styles),
+            "history": [[f"message {i}-{j}", f"reply {i}-{j}"] for j in range(history)],
+            "girlfriend_name": f"Name{i % 500}",
+            "personal_details": {f"detail {k}": f"value {i}-{k}" for k in range(details)}
+        }
+        for i in range(users)
+    })
+
+
+def measure(document, convert):
+    gc.collect()
+    tracemalloc.start()
+    users = json.loads(document)
+    if convert:
+        for user_id, data in users.items():
+            users[user_id] = UserRecord.from_dict(data)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del users
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per resident user")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--history", type=int, default=10, help="history pairs per user")
+    parser.add_argument("--details", type=int, default=2, help="personal details per user")
+    args = parser.parse_args()
+
+    document = make_document(args.users, args.history, args.details)
+    before = measure(document, convert=False)
+    after = measure(document, convert=True)
+
+    print(f"users               : {args.users} ({args.history} history pairs, {args.details} details)")
+    print(f"dict records        : {before / args.users:8.0f} bytes/user")
+    print(f"UserRecord          : {after / args.users:8.0f} bytes/user ({1 - after / before:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Voice clip generation: event-loop stalls, synthesis throughput and cache hits.
+
+Generates voice clips for a set of replies and measures, alongside, how
+late a 10 ms ticker on the event loop runs (loop lag):
+
+  inline   - synthesize and encode on the event loop (what to avoid)
+  pool     - VoiceSynthesizer, worker processes, cold cache
+  disk     - same clips again from the disk cache (fresh synthesizer)
+  file_id  - same clips again once Telegram file_ids are known
+
+The default engine is a tone generator defined here, so no TTS binary or
+ffmpeg is needed; clips are then WAV. --engine espeak --format ogg runs the
+real pipeline (espeak-ng and ffmpeg installed).
+
+    python benchmarks/bench_voice.py --clips 40 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from voice import TTSEngine, EspeakEngine, VoiceCache, VoiceSynthesizer, render_clip
+
+WORDS = ("my love", "good morning", "I miss you", "you make me smile", "see you tonight", "sweet dreams")
+
+
+class ToneEngine(TTSEngine):
+    """Stand-in TTS: a short tone per word, enough audio work to load a CPU."""
+
+    name = "tone"
+
+    def synthesize(self, text, voice, style):
+        from pydub import AudioSegment
+        from pydub.generators import Sine
+
+        clip = AudioSegment.silent(duration=0, frame_rate=48000)
+        for word in text.split():
+            tone = Sine(220 + 40 * (len(word) % 8), sample_rate=48000).to_audio_segment(duration=180)
+            clip += tone.fade_in(20).fade_out(20) + AudioSegment.silent(duration=60, frame_rate=48000)
+        return clip
+
+
+def reply_texts(count):
+    return [f"{WORDS[i % len(WORDS)]} {i}, " * 4 + "always" for i in range(count)]
+
+
+async def measure(run):
+    """Run the coroutine while a ticker records how late the loop wakes it."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    result = await run()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    return elapsed, max(lags, default=0.0), statistics.median(lags) if lags else 0.0, result
+
+
+async def bench(args, engine, cache_dir):
+    texts = reply_texts(args.clips)
+
+    async def inline():
+        for text in texts:
+            render_clip(engine, text, "en", "romantic", args.format, "32k")
+            await asyncio.sleep(0)  # Let the ticker see the stall
+
+    def synthesizer():
+        cache = VoiceCache(cache_dir, extension=args.format)
+        return VoiceSynthesizer(engine, cache, workers=args.workers, audio_format=args.format)
+
+    async def generate_all(synth):
+        return await asyncio.gather(*(synth.synthesize(text, "en", "romantic") for text in texts))
+
+    results = {}
+    if not args.no_inline:
+        results["inline"] = await measure(inline)
+
+    cold = synthesizer()
+    # Pool start-up is paid once per process; keep it out of the timings
+    await asyncio.get_running_loop().run_in_executor(cold._get_pool(), len, "")
+    results["pool"] = await measure(lambda: generate_all(cold))
+    cold.close()
+
+    warm = synthesizer()
+    results["disk"] = await measure(lambda: generate_all(warm))
+    clips = results["disk"][3]
+    for i, clip in enumerate(clips):
+        warm.remember_file_id(clip, f"file-{i}")
+    results["file_id"] = await measure(lambda: generate_all(warm))
+    stats = warm.stats()
+    warm.close()
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice generation benchmark")
+    parser.add_argument("--no-inline", action="store_true", help="skip the on-loop baseline")
+    parser.add_argument("--clips", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--engine", choices=("tone", "espeak"), default="tone")
+    parser.add_argument("--format", choices=("wav", "ogg"), default="wav", help="ogg needs ffmpeg")
+    args = parser.parse_args()
+
+    engine = ToneEngine() if args.engine == "tone" else EspeakEngine()
+    print(f"{args.clips} clips, {args.engine} engine, {args.format}, {args.workers} workers on {os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results, stats = asyncio.run(bench(args, engine, cache_dir))
+    for mode, (elapsed, max_lag, median_lag, _) in results.items():
+        print(f"{mode:<8} {elapsed:7.3f}s  {args.clips / elapsed:8.1f} clips/s  "
+              f"loop lag max {max_lag * 1000:7.1f} ms  median {median_lag * 1000:5.1f} ms")
+    print(f"cache: {stats['clips']} clips, {stats['bytes'] / 1024:.0f} KiB, {stats['hits']} disk hits, "
+          f"{stats['file_id_hits']} file_id hits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Streamed replies must end with the buttons on the message.
+
+Runs app.py with STREAM_RESPONSES against the stub Telegram and Gemini
+servers and sends private messages from several users. With Gemini slow
+and failing, the last streamed text (the fallback reply) is due for a
+partial edit at the same time as the final edit that carries the
+Copy/Regenerate buttons. For every chat, the last editMessageText the
+stub receives must carry reply_markup; exits non-zero otherwise.
+
+    python benchmarks/check_stream_markup.py --users 10 --gemini-latency 1.2 --gemini-error-rate 1.0
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from e2e_suite import message_update, FIRST_USER
+from load_webhook import TOKEN, start_app
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def last_edits(telegram, chats):
+    """The last editMessageText params per chat, in the order the stub received them."""
+    last = {}
+    for _, method, params in telegram.requests:
+        if method == "editMessageText" and int(params.get("chat_id", 0)) in chats:
+            last[int(params["chat_id"])] = params
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that streamed replies keep their buttons")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--gemini-latency", type=float, default=1.2)
+    parser.add_argument("--gemini-error-rate", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    chats = set(range(FIRST_USER, FIRST_USER + args.users))
+    port = free_port()
+    with StubTelegramServer() as telegram, \
+            StubGeminiServer(latency=args.gemini_latency, error_rate=args.gemini_error_rate) as gemini, \
+            tempfile.TemporaryDirectory() as data_dir:
+        process = start_app(port, telegram, gemini, data_dir, STREAM_RESPONSES="true", LOG_LEVEL="WARNING")
+        try:
+            for update_id, chat_id in enumerate(sorted(chats), 1):
+                httpx.post(f"http://127.0.0.1:{port}/{TOKEN}", json=message_update(update_id, chat_id, "I miss you"))
+
+            # Done once every chat's final edit is in and nothing arrived for a while
+            deadline = time.monotonic() + args.timeout
+            settled_at, seen = time.monotonic(), 0
+            while time.monotonic() < deadline:
+                time.sleep(0.2)
+                if len(telegram.requests) != seen:
+                    settled_at, seen = time.monotonic(), len(telegram.requests)
+                last = last_edits(telegram, chats)
+                done = len(last) == len(chats) and all(params.get("reply_markup") for params in last.values())
+                if done and time.monotonic() - settled_at > 3:
+                    break
+        finally:
+            process.terminate()
+            process.wait()
+
+        last = last_edits(telegram, chats)
+        missing = sorted(chats - set(last))
+        stripped = sorted(chat_id for chat_id, params in last.items() if not params.get("reply_markup"))
+        edits = telegram.calls["editMessageText"]
+        print(f"{len(chats)} chats, {edits} edits: {len(stripped)} ended without buttons, "
+              f"{len(missing)} without any edit")
+        if stripped or missing:
+            raise SystemExit(f"last edit without reply_markup: {stripped}, no edit: {missing}")
+
+
+if __name__ == "__main__":
+    main()
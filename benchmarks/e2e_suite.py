@@ -0,0 +1,455 @@
+"""End-to-end benchmark suite: the real app.py against stub Telegram and Gemini.
+
+Scenarios (each runs against a freshly started app.py):
+  dm_burst      - a burst of private messages from many users
+  inline_storm  - users typing inline queries one keystroke at a time
+  regen_spam    - users pressing "Regenerate" again and again on one reply
+  big_details   - private messages from users with hundreds of personal details
+  chatty_chat   - one user sends a run of messages back to back, then every
+                  other user sends one; only the other users' replies are
+                  timed, since one chat's per-chat send limit must not hold
+                  them up
+
+Latency is measured from posting an update to the webhook until the bot's
+reply (sendMessage, answerInlineQuery, editMessageText) reaches the stub
+Telegram API. The suite reports throughput, p50/p95/p99 latency, RSS, and
+bytes written per update, plus mean stage timings scraped from /metrics.
+Results are written as JSON so runs on different commits can be compared:
+
+    python benchmarks/e2e_suite.py --output before.json
+    python benchmarks/e2e_suite.py --output after.json --compare before.json
+    python benchmarks/e2e_suite.py dm_burst --env STORAGE_BACKEND=sqlite --gemini-error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from load_webhook import MESSAGES, TOKEN, start_app
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+FIRST_USER = 5000
+INLINE_PHRASES = ["good morning my love", "are you free tonight", "I miss you so much",
+                  "sorry I was late", "what should we eat"]
+_STAGE_LINE = re.compile(r'lovewhisper_stage_seconds_(sum|count)\{handler="([^"]*)",stage="([^"]*)"\} (\S+)')
+
+
+# Update payloads
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def message_update(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+        "from": _user(user_id)
+    }}
+
+
+def inline_update(update_id, user_id, query_id, query):
+    return {"update_id": update_id, "inline_query": {
+        "id": query_id, "from": _user(user_id), "query": query, "offset": ""
+    }}
+
+
+def callback_update(update_id, user_id, query_id, message_id, data):
+    return {"update_id": update_id, "callback_query": {
+        "id": query_id, "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": message_id, "date": int(time.time()), "text": "Here's your response:",
+                    "chat": {"id": user_id, "type": "private"}, "from": _user(user_id)}
+    }}
+
+
+# Harness
+
+class Replies:
+    """Incremental index of the stub's calls by (method, chat or query id)."""
+
+    KEYS = {"sendMessage": "chat_id", "editMessageText": "chat_id",
+            "answerInlineQuery": "inline_query_id", "answerCallbackQuery": "callback_query_id"}
+
+    def __init__(self, telegram):
+        self.telegram = telegram
+        self.position = len(telegram.requests)
+        self.calls = defaultdict(list)  # (method, key) -> [(time, params)]
+
+    def get(self, method, key):
+        new = self.telegram.requests[self.position:]
+        self.position += len(new)
+        for called_at, name, params in new:
+            if name in self.KEYS:
+                self.calls[(name, str(params.get(self.KEYS[name])))].append((called_at, params))
+        return self.calls[(method, str(key))]
+
+    async def wait(self, method, key, count, timeout):
+        deadline = time.monotonic() + timeout
+        while len(self.get(method, key)) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+        return self.get(method, key)
+
+
+class Driver:
+    """Posts updates to the app's webhook and records webhook statuses."""
+
+    def __init__(self, port, client):
+        self.url = f"http://127.0.0.1:{port}/{TOKEN}"
+        self.client = client
+        self.statuses = defaultdict(int)
+        self.posted = 0
+        self._next_id = 1
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    async def post(self, update):
+        sent_at = time.monotonic()
+        response = await self.client.post(self.url, json=update)
+        self.statuses[response.status_code] += 1
+        self.posted += 1
+        return sent_at
+
+
+def pair_latencies(sent, received):
+    """Match the i-th reply for a key with the i-th update sent for it."""
+    latencies = []
+    for key, times in sent.items():
+        for sent_at, (received_at, _) in zip(sorted(times), received.get(key, [])):
+            latencies.append(received_at - sent_at)
+    return latencies
+
+
+# Scenarios
+
+async def run_dm_burst(args, driver, replies, users):
+    sent = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(user_id, text):
+        async with semaphore:
+            sent[user_id].append(await driver.post(message_update(driver.next_id(), user_id, text)))
+
+    await asyncio.gather(*(
+        send(random.choice(users), f"{random.choice(MESSAGES)} #{i}") for i in range(args.messages)
+    ))
+    received = {}
+    for user_id, times in sent.items():
+        received[user_id] = await replies.wait("sendMessage", user_id, len(times), args.timeout)
+    return sent, received
+
+
+async def scenario_dm_burst(args, driver, replies):
+    users = list(range(FIRST_USER, FIRST_USER + args.users))
+    return await run_dm_burst(args, driver, replies, users)
+
+
+async def scenario_inline_storm(args, driver, replies):
+    sent, received = {}, {}
+
+    async def type_query(user_id):
+        phrase = random.choice(INLINE_PHRASES)
+        query_id = None
+        for i in range(1, len(phrase) + 1):
+            query_id = f"{user_id}-{i}"
+            sent_at = await driver.post(inline_update(driver.next_id(), user_id, query_id, phrase[:i]))
+            await asyncio.sleep(args.keystroke_interval)
+        # Only the final query should get an answer
+        sent[query_id] = [sent_at]
+        received[query_id] = await replies.wait("answerInlineQuery", query_id, 1, args.timeout)
+
+    await asyncio.gather(*(type_query(FIRST_USER + u) for u in range(args.users)))
+    return sent, received
+
+
+async def scenario_regen_spam(args, driver, replies):
+    sent, received = defaultdict(list), {}
+
+    async def spam(user_id):
+        await driver.post(message_update(driver.next_id(), user_id, random.choice(MESSAGES)))
+        reply = await replies.wait("sendMessage", user_id, 1, args.timeout)
+        if not reply:
+            return
+        markup = reply[0][1].get("reply_markup", "{}")
+        markup = json.loads(markup) if isinstance(markup, str) else markup
+        regen = next(button["callback_data"] for row in markup["inline_keyboard"] for button in row
+                     if button["callback_data"].startswith("regen_"))
+        for press in range(args.presses):
+            update_id = driver.next_id()
+            sent[user_id].append(await driver.post(
+                callback_update(update_id, user_id, f"cb-{update_id}", update_id, regen)))
+            await replies.wait("editMessageText", user_id, press + 1, args.timeout)
+            await asyncio.sleep(args.press_interval)
+        received[user_id] = replies.get("editMessageText", user_id)
+
+    await asyncio.gather(*(spam(FIRST_USER + u) for u in range(args.users)))
+    return sent, received
+
+
+def prepare_big_details(args, data_dir, settings):
+    """Store users with many personal details and a full history before the app starts."""
+    from storage import SQLiteStorage
+    users = {
+        str(FIRST_USER + u): {
+            "style": "romantic",
+            "girlfriend_name": f"Name{u}",
+            "history": [[f"earlier message {i}", f"earlier reply {i}"] for i in range(10)],
+            "personal_details": {f"detail {d}": f"something she told me in week {d}" for d in range(args.details)}
+        }
+        for u in range(args.users)
+    }
+    if settings.get("STORAGE_BACKEND") == "sqlite":
+        storage = SQLiteStorage(os.path.join(data_dir, "user_data.db"))
+        storage.write_users(users)
+        storage.close()
+    else:
+        with open(os.path.join(data_dir, "user_data.json"), 'w') as f:
+            json.dump(users, f)
+
+
+async def scenario_big_details(args, driver, replies):
+    return await scenario_dm_burst(args, driver, replies)
+
+
+async def scenario_chatty_chat(args, driver, replies):
+    chatty, others = FIRST_USER, range(FIRST_USER + 1, FIRST_USER + args.users)
+    for i in range(args.chatty_messages):
+        await driver.post(message_update(driver.next_id(), chatty, f"{random.choice(MESSAGES)} #{i}"))
+    # Let the chatty user's replies reach the send queue first
+    await asyncio.sleep(0.2)
+    sent = defaultdict(list)
+
+    async def send(user_id):
+        sent[user_id].append(await driver.post(message_update(driver.next_id(), user_id, random.choice(MESSAGES))))
+
+    await asyncio.gather(*(send(user_id) for user_id in others))
+    received = {user_id: await replies.wait("sendMessage", user_id, 1, args.timeout) for user_id in others}
+    await replies.wait("sendMessage", chatty, args.chatty_messages, args.timeout)
+    return sent, received
+
+
+SCENARIOS = {
+    "dm_burst": (None, scenario_dm_burst),
+    "inline_storm": (None, scenario_inline_storm),
+    "regen_spam": (None, scenario_regen_spam),
+    "big_details": (prepare_big_details, scenario_big_details),
+    "chatty_chat": (None, scenario_chatty_chat),
+}
+
+
+# Measurements
+
+def process_stats(pid):
+    """RSS, peak RSS and bytes written by a process (Linux /proc; empty elsewhere)."""
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    stats[line.split(":")[0]] = int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("wchar", "write_bytes"):
+                    stats[key] = int(value)
+    except OSError:
+        pass
+    return stats
+
+
+def stage_means(metrics_text):
+    sums, counts = {}, {}
+    for kind, handler, stage, value in _STAGE_LINE.findall(metrics_text):
+        (sums if kind == "sum" else counts)[f"{handler}/{stage}"] = float(value)
+    return {key: sums[key] / counts[key] for key in sums if counts.get(key)}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+
+def summarize(sent, received, started, before, after, driver, gemini_requests, stages):
+    latencies = sorted(pair_latencies(sent, received))
+    updates = driver.posted
+    last_reply = max((t for calls in received.values() for t, _ in calls), default=started)
+    duration = max(last_reply - started, 1e-9)
+
+    def per_update(key):
+        if key not in after or key not in before:
+            return None
+        return (after[key] - before[key]) / updates if updates else None
+
+    return {
+        "updates": updates,
+        "replies": len(latencies),
+        "expected_replies": sum(len(times) for times in sent.values()),
+        "duration": duration,
+        "throughput": len(latencies) / duration,
+        "latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None
+        },
+        "webhook_statuses": {str(k): v for k, v in sorted(driver.statuses.items())},
+        "gemini_requests": gemini_requests,
+        "rss_bytes": after.get("VmRSS"),
+        "peak_rss_bytes": after.get("VmHWM"),
+        "write_bytes_per_update": per_update("write_bytes"),
+        "wchar_per_update": per_update("wchar"),
+        "stage_means": stages
+    }
+
+
+def run_scenario(name, args, settings, telegram, gemini):
+    prepare, scenario = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as data_dir:
+        if prepare is not None:
+            prepare(args, data_dir, settings)
+        process = start_app(args.port, telegram, gemini, data_dir, **settings)
+        try:
+            async def drive():
+                limits = httpx.Limits(max_connections=args.concurrency)
+                async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+                    driver = Driver(args.port, client)
+                    replies = Replies(telegram)
+                    before = process_stats(process.pid)
+                    gemini_before = gemini.request_count
+                    started = time.monotonic()
+                    sent, received = await scenario(args, driver, replies)
+                    # Let queued writes land before reading the counters
+                    await asyncio.sleep(args.settle)
+                    after = process_stats(process.pid)
+                    metrics = (await client.get(f"http://127.0.0.1:{args.port}/metrics")).text
+                    return summarize(sent, received, started, before, after, driver,
+                                     gemini.request_count - gemini_before, stage_means(metrics))
+            return asyncio.run(drive())
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+# Reporting
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "     n/a"
+
+
+def print_result(name, result):
+    latency = result["latency"]
+    rss = result["rss_bytes"]
+    written = result["write_bytes_per_update"]
+    print(f"{name:<13} {result['replies']:>5}/{result['expected_replies']:<5} replies"
+          f"  {result['throughput']:7.1f} /s  p50 {_ms(latency['p50'])}  p95 {_ms(latency['p95'])}"
+          f"  p99 {_ms(latency['p99'])} ms  gemini {result['gemini_requests']:>5}"
+          f"  rss {rss / 2 ** 20 if rss else 0:6.1f} MiB"
+          f"  disk {written if written is not None else 0:8.0f} B/update")
+
+
+COMPARED = [("throughput", lambda r: r["throughput"], "/s"),
+            ("p50", lambda r: r["latency"]["p50"], "s"),
+            ("p95", lambda r: r["latency"]["p95"], "s"),
+            ("p99", lambda r: r["latency"]["p99"], "s"),
+            ("rss", lambda r: r["rss_bytes"], "B"),
+            ("disk/update", lambda r: r["write_bytes_per_update"], "B"),
+            ("gemini requests", lambda r: r["gemini_requests"], "")]
+
+
+def print_comparison(baseline, results):
+    print(f"\nvs {baseline.get('revision', '?')}:")
+    for name, result in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        changes = []
+        for label, value, unit in COMPARED:
+            before, after = value(old), value(result)
+            if before and after is not None:
+                changes.append(f"{label} {(after - before) / before:+.0%}")
+        print(f"  {name:<13} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark suite")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS),
+                        help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=500, help="messages per DM burst")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent webhook posts")
+    parser.add_argument("--keystroke-interval", type=float, default=0.08, help="seconds between inline keystrokes")
+    parser.add_argument("--presses", type=int, default=5, help="regenerate presses per user")
+    parser.add_argument("--press-interval", type=float, default=0.2)
+    parser.add_argument("--details", type=int, default=300, help="personal details per user (big_details)")
+    parser.add_argument("--chatty-messages", type=int, default=16, help="messages from the chatty user (chatty_chat)")
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for app.py, e.g. STORAGE_BACKEND=sqlite")
+    parser.add_argument("--port", type=int, default=18082)
+    parser.add_argument("--timeout", type=float, default=60, help="max seconds to wait for a reply")
+    parser.add_argument("--settle", type=float, default=2.5, help="seconds to wait before reading counters")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+    settings = dict(item.split("=", 1) for item in args.env)
+    random.seed(args.seed)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": {}
+    }
+    with StubTelegramServer(latency=args.telegram_latency, error_rate=args.telegram_error_rate) as telegram, \
+            StubGeminiServer(latency=args.gemini_latency, error_rate=args.gemini_error_rate,
+                             vary_replies=True) as gemini:
+        for name in args.scenarios:
+            result = run_scenario(name, args, settings, telegram, gemini)
+            results["scenarios"][name] = result
+            print_result(name, result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
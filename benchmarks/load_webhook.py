@@ -0,0 +1,161 @@
+"""Load test for the webhook route of app.py.
+
+Starts the stub Telegram and Gemini servers, runs the real app.py in a
+subprocess pointed at them, and replays updates against its webhook. The
+updates come from a JSONL file of recorded Telegram updates (--updates) or
+are generated as private text messages. Reports webhook ack latency and
+end-to-end throughput, measured as bot replies reaching the stub Telegram API.
+
+    python benchmarks/load_webhook.py -n 2000 --concurrency 100 --gemini-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from stub_gemini import StubGeminiServer
+from stub_telegram import StubTelegramServer
+
+TOKEN = "123456:stub-token"
+MESSAGES = ["Good morning ☀️", "I miss you", "How was your day?", "Are you coming tonight?",
+            "selam wude", "I had a dream about us", "Why didn't you call me?"]
+
+
+def generate_updates(n, users, duplicate_rate):
+    updates = []
+    now = int(time.time())
+    for i in range(1, n + 1):
+        user_id = 1000 + random.randrange(users)
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": now,
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "text": f"{random.choice(MESSAGES)} #{i}"
+            }
+        })
+        if random.random() < duplicate_rate:
+            updates.append(updates[-1])  # Telegram redelivery
+    return updates
+
+
+def load_updates(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def start_app(port, telegram, gemini, data_dir, **settings):
+    """Run app.py against the stubs; settings are extra environment variables."""
+    env = dict(os.environ, **settings)
+    env.update(TELEGRAM_TOKEN=TOKEN,
+               TELEGRAM_API_BASE_URL=telegram.base_url,
+               GOOGLE_API_BASE_URL=gemini.base_url,
+               GOOGLE_API_KEY="stub",
+               WEBHOOK_URL=f"http://127.0.0.1:{port}",
+               PORT=str(port),
+               USER_DATA_FILE=os.path.join(data_dir, "user_data.json"),
+               SQLITE_DB_FILE=os.path.join(data_dir, "user_data.db"),
+               MESSAGE_STORE_DB_FILE=os.path.join(data_dir, "message_context.db"))
+    log = open(os.path.join(data_dir, "app.log"), 'w')
+    webhooks_before = telegram.calls["setWebhook"]
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=REPO_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            # The bot starts in the background; setWebhook comes after the update workers
+            if (httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200
+                    and telegram.calls["setWebhook"] > webhooks_before):
+                return process
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"app.py did not start, see {log.name}")
+
+
+async def replay(port, updates, concurrency):
+    url = f"http://127.0.0.1:{port}/{TOKEN}"
+    semaphore = asyncio.Semaphore(concurrency)
+    acks = []
+    statuses = {}
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency), timeout=60) as client:
+        async def post(update):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, json=update)
+                acks.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(post(u) for u in updates))
+    return sorted(acks), statuses
+
+
+def pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook ack latency and throughput load test")
+    parser.add_argument("--updates", help="JSONL file of recorded Telegram updates to replay")
+    parser.add_argument("-n", type=int, default=1000, help="updates to generate")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of redelivered updates")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent webhook posts")
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--timeout", type=float, default=120, help="max seconds to wait for replies")
+    args = parser.parse_args()
+
+    random.seed(7)
+    updates = load_updates(args.updates) if args.updates else generate_updates(
+        args.n, args.users, args.duplicate_rate)
+    unique = len({u["update_id"] for u in updates})
+
+    with StubTelegramServer() as telegram, StubGeminiServer(latency=args.gemini_latency) as gemini, \
+            tempfile.TemporaryDirectory() as data_dir:
+        process = start_app(args.port, telegram, gemini, data_dir)
+        try:
+            sends_before = telegram.calls["sendMessage"]
+            start = time.monotonic()
+            acks, statuses = asyncio.run(replay(args.port, updates, args.concurrency))
+            ack_elapsed = time.monotonic() - start
+
+            deadline = time.monotonic() + args.timeout
+            while telegram.calls["sendMessage"] - sends_before < unique and time.monotonic() < deadline:
+                time.sleep(0.05)
+            replies = telegram.calls["sendMessage"] - sends_before
+            last_reply = max((t for t, m in telegram.call_times if m == "sendMessage"), default=start)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    e2e_elapsed = max(last_reply - start, 1e-9)
+    print(f"updates posted      : {len(updates)} ({unique} unique)")
+    print(f"webhook statuses    : {dict(sorted(statuses.items()))}")
+    print(f"ack latency         : p50 {pct(acks, 50) * 1000:.1f} ms  p95 {pct(acks, 95) * 1000:.1f} ms"
+          f"  p99 {pct(acks, 99) * 1000:.1f} ms")
+    print(f"ack throughput      : {len(updates) / ack_elapsed:.1f} updates/s")
+    print(f"replies sent        : {replies}/{unique}")
+    print(f"end-to-end          : {replies / e2e_elapsed:.1f} updates/s over {e2e_elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
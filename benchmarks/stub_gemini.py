@@ -0,0 +1,204 @@
+"""Local stub of the Gemini generateContent API for benchmarks.
+
+Run standalone with `python benchmarks/stub_gemini.py --port 8081 --latency 0.5`
+and point the bot at it with GOOGLE_API_BASE_URL=http://127.0.0.1:8081/v1.
+
+streamGenerateContent answers as server-sent events: the first chunk after
+--latency, then one word every --chunk-delay seconds.
+
+generationConfig.candidateCount is honored with numbered variants of the
+reply, unless the stub is started with multi_candidate=False, in which case
+it is rejected with a 400 like models without multi-candidate support.
+With vary_replies=True every request gets a differently numbered reply,
+like a sampling model would give.
+
+model_latency maps model names (without "models/") to their own latency,
+for routing benchmarks; model_counts counts requests per model.
+
+Faults can be injected: a fraction of requests can fail with an HTTP error
+(--error-rate/--error-status) or answer slowly (--slow-rate/--slow-latency).
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "I miss you too, can't wait to see you tonight ❤️"
+
+
+def _candidate(text, count=1):
+    texts = [text] + [f"{text} ({i + 1})" for i in range(1, count)]
+    return {"candidates": [{"content": {"parts": [{"text": t}], "role": "model"}} for t in texts]}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        server = self.server
+        try:
+            count = int(json.loads(raw).get("generationConfig", {}).get("candidateCount", 1))
+        except (ValueError, AttributeError):
+            count = 1
+        model = self.path.split("?", 1)[0].rsplit("/", 1)[-1].split(":", 1)[0]
+        with server.lock:
+            server.model_counts[model] += 1
+            server.request_count += 1
+            number = server.request_count
+            fail = server.fail_next > 0 or random.random() < server.error_rate
+            if server.fail_next > 0:
+                server.fail_next -= 1
+        slow = random.random() < server.slow_rate
+
+        time.sleep(server.slow_latency if slow else server.model_latency.get(model, server.latency))
+
+        if fail:
+            body = json.dumps({"error": {"code": server.error_status, "message": "injected fault"}}).encode("utf-8")
+            self.send_response(server.error_status)
+            if server.error_status == 429:
+                self.send_header("Retry-After", "0.1")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if ":streamGenerateContent" in self.path:
+            self._stream_reply()
+            return
+
+        if count > 1 and not server.multi_candidate:
+            body = json.dumps({"error": {"code": 400, "message": "Multiple candidates is not enabled"}}).encode("utf-8")
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        reply = f"{server.reply} #{number}" if server.vary_replies else server.reply
+        body = json.dumps(_candidate(reply, count)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_reply(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = self.server.reply.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.server.chunk_delay)
+            text = word if i == 0 else " " + word
+            event = f"data: {json.dumps(_candidate(text))}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # don't let the listen backlog serialize bursts
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose (cancelled hedges, timeouts); only report real bugs
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubGeminiServer:
+    """Threaded HTTP server answering every POST with a canned Gemini reply.
+
+    error_rate/slow_rate can be changed while it runs, and fail_next forces
+    the next N requests to fail with error_status.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, reply=DEFAULT_REPLY,
+                 error_rate=0.0, error_status=503, slow_rate=0.0, slow_latency=5.0, chunk_delay=0.05,
+                 multi_candidate=True, vary_replies=False, model_latency=None):
+        self.httpd = _StubHTTPServer((host, port), _StubHandler)
+        self.httpd.latency = latency
+        self.httpd.reply = reply
+        self.httpd.error_rate = error_rate
+        self.httpd.error_status = error_status
+        self.httpd.slow_rate = slow_rate
+        self.httpd.slow_latency = slow_latency
+        self.httpd.chunk_delay = chunk_delay
+        self.httpd.multi_candidate = multi_candidate
+        self.httpd.vary_replies = vary_replies
+        self.httpd.model_latency = dict(model_latency or {})
+        self.httpd.model_counts = Counter()
+        self.httpd.fail_next = 0
+        self.httpd.request_count = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    def configure(self, **settings):
+        """Change fault settings (latency, error_rate, slow_rate, fail_next, ...) on the fly."""
+        for name, value in settings.items():
+            setattr(self.httpd, name, value)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    @property
+    def model_counts(self):
+        return self.httpd.model_counts
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of slow requests")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="seconds between streamed words")
+    parser.add_argument("--no-multi-candidate", action="store_true", help="reject candidateCount > 1")
+    args = parser.parse_args()
+
+    server = StubGeminiServer(args.host, args.port, args.latency, error_rate=args.error_rate,
+                              error_status=args.error_status, slow_rate=args.slow_rate,
+                              slow_latency=args.slow_latency, chunk_delay=args.chunk_delay,
+                              multi_candidate=not args.no_multi_candidate)
+    print(f"Stub Gemini listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,214 @@
+"""Local stub of the Telegram Bot API for benchmarks.
+
+Answers the methods the bot uses (getMe, sendMessage, editMessageText,
+answerInlineQuery, answerCallbackQuery, setWebhook, ...) with minimal valid
+results and counts every call. Every call is also kept in `requests` as
+(time, method, params) so benchmarks can match replies to updates. Point
+the bot at it with TELEGRAM_API_BASE_URL=http://127.0.0.1:<port>/bot.
+
+A fraction of calls can fail with HTTP 500 (error_rate); those are
+counted as "<method>:failed" and not recorded in `requests`.
+
+Like Telegram's flood control, global_limit and chat_limit (0 = off) cap the
+messages, edits and answers per second for the bot and per chat; calls over
+the limit get a 429 with retry_after and are counted as "<method>:429".
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LIMITED_METHODS = ("sendMessage", "editMessageText", "answerInlineQuery", "answerCallbackQuery")
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "LoveWhisper",
+    "username": "lovewhisper_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True
+}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _params(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        content_type = self.headers.get("Content-Type", "")
+        if raw and "json" in content_type:
+            query.update(json.loads(raw))
+        elif raw:
+            query.update({k: v[0] for k, v in parse_qs(raw.decode("utf-8")).items()})
+        return query
+
+    def _handle(self):
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        params = self._params()
+        server = self.server
+        time.sleep(server.latency)
+
+        if method not in ("getMe", "setWebhook") and random.random() < server.error_rate:
+            with server.lock:
+                server.calls[f"{method}:failed"] += 1
+            self._reply(500, {"ok": False, "error_code": 500, "description": "Internal Server Error: injected fault"})
+            return
+
+        now = time.monotonic()
+        if method in LIMITED_METHODS and (server.global_limit or server.chat_limit):
+            with server.lock:
+                flooded = server.over_limit(now, params.get("chat_id"))
+                if flooded:
+                    server.calls[f"{method}:429"] += 1
+            if flooded:
+                self._reply(429, {"ok": False, "error_code": 429,
+                                  "description": "Too Many Requests: retry after 1",
+                                  "parameters": {"retry_after": 1}})
+                return
+
+        with server.lock:
+            server.calls[method] += 1
+            server.call_times.append((now, method))
+            server.requests.append((now, method, params))
+            server.message_id += 1
+            message_id = server.message_id
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": int(params.get("message_id", message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", "")
+            }
+        elif method == "getUpdates":
+            result = []
+        else:
+            result = True
+
+        self._reply(200, {"ok": True, "result": result})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    global_limit = 0
+    chat_limit = 0
+
+    def over_limit(self, now, chat_id):
+        """Count a call in the last-second windows; True if it goes over a limit."""
+        windows = [(self.global_limit, self.sent_times[None])]
+        if chat_id is not None:
+            windows.append((self.chat_limit, self.sent_times[str(chat_id)]))
+        for limit, times in windows:
+            while times and now - times[0] >= 1.0:
+                times.popleft()
+            if limit and len(times) >= limit:
+                return True
+        for _, times in windows:
+            times.append(now)
+        return False
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubTelegramServer:
+    """Threaded Bot API stub; `calls` counts requests per method."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, global_limit=0, chat_limit=0):
+        self.httpd = _StubHTTPServer((host, port), _StubHandler)
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.global_limit = global_limit
+        self.httpd.chat_limit = chat_limit
+        self.httpd.sent_times = defaultdict(deque)
+        self.httpd.calls = Counter()
+        self.httpd.call_times = []
+        self.httpd.requests = []
+        self.httpd.message_id = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def call_times(self):
+        return self.httpd.call_times
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def configure(self, **settings):
+        """Change latency, error_rate or the flood limits on the fly."""
+        for name, value in settings.items():
+            setattr(self.httpd, name, value)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--global-limit", type=int, default=0, help="messages per second for the bot (0 = off)")
+    parser.add_argument("--chat-limit", type=int, default=0, help="messages per second per chat (0 = off)")
+    args = parser.parse_args()
+
+    server = StubTelegramServer(args.host, args.port, args.latency, args.error_rate,
+                                args.global_limit, args.chat_limit)
+    print(f"Stub Telegram Bot API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
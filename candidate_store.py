@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import CANDIDATE_STORE_MAX_ENTRIES, CANDIDATE_STORE_MAX_BYTES, CANDIDATE_STORE_TTL
+
+
+class CandidateStore:
+    """Spare reply candidates per message, handed out one per regenerate press.
+
+    Entries expire after ttl seconds; when the entry or byte limit is hit the
+    least recently used messages lose their candidates first.
+    """
+
+    def __init__(self, max_entries=CANDIDATE_STORE_MAX_ENTRIES, max_bytes=CANDIDATE_STORE_MAX_BYTES,
+                 ttl=CANDIDATE_STORE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, deque of candidates, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.stored = 0
+        self.served = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _size(candidates):
+        # Approximate payload size; good enough to bound memory
+        return sum(len(text.encode("utf-8")) for text in candidates) + 64 * len(candidates) + 128
+
+    def put(self, key, candidates):
+        """Store candidates for key, replacing any left over from an earlier batch."""
+        candidates = deque(candidates)
+        if not candidates:
+            return
+        size = self._size(candidates)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, candidates, size)
+            self.current_bytes += size
+            self.stored += len(candidates)
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key):
+        """Take the next stored candidate for key, or None if there isn't one."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, candidates, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            candidate = candidates.popleft()
+            if candidates:
+                freed = self._size([candidate]) - 128
+                self._entries[key] = (expires_at, candidates, size - freed)
+                self.current_bytes -= freed
+                self._entries.move_to_end(key)
+            else:
+                self._remove(key)
+            self.served += 1
+            return candidate
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "stored": self.stored,
+            "served": self.served,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
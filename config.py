@@ -6,14 +6,192 @@ load_dotenv()
 
 # Bot configuration
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+# Webhook ingestion: updates are queued and acknowledged at once, then processed as below
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 1000))
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", 10000))  # recent update_ids remembered
+
+# Webhook, polling and shard workers: updates from different users are processed concurrently (a
+# user's own updates stay in order); pending counts updates admitted, running or waiting for their user
+POLLING_CONCURRENT_UPDATES = int(os.getenv("POLLING_CONCURRENT_UPDATES", 32))
+POLLING_MAX_PENDING_UPDATES = int(os.getenv("POLLING_MAX_PENDING_UPDATES", 1024))
+
+# Webhook worker processes. Above 1, app.py only routes updates, by user, to this many worker
+# processes that each run the bot for their share of users; needs STORAGE_BACKEND=sqlite
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# How often each worker process sends its metrics to the router's /metrics (seconds)
+WORKER_METRICS_INTERVAL = float(os.getenv("WORKER_METRICS_INTERVAL", 5))
+
+# Outbound Telegram send queue (messages per second; Telegram allows about 30/s per bot,
+# 1/s per private chat with short bursts and 20/min per group). Rate + burst is the most
+# sent in any one second. Each worker process has its own queue, so with WEB_WORKERS > 1
+# divide the global rate between them.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", 5))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 2))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", 20))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 2))  # resends after a RetryAfter
 
 # AI configuration
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 MAX_HISTORY_LENGTH = 10  # Number of messages to keep for context
 
-GOOGLE_API_BASE_URL = "https://generativelanguage.googleapis.com/v1"
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "https://generativelanguage.googleapis.com/v1")
 DEFAULT_MODEL = "models/gemini-1.5-flash"
 
+# Model routing per entry point (inline, message, regenerate, batch; others use the message route).
+# Each route has a model (empty = the AIHandler's model: DEFAULT_MODEL, or batch_generate.py --model),
+# generation settings and a latency target; while the ROUTING_LATENCY_PERCENTILE latency of the
+# model's recent calls (the last ROUTING_SAMPLES within ROUTING_WINDOW seconds) is over the target,
+# requests go to the route's fallback model (empty = none), except a ROUTING_PROBE_RATE share that
+# keeps measuring it
+MODEL_ROUTES = {
+    "inline": {
+        "model": os.getenv("INLINE_MODEL", ""),
+        "fallback_model": os.getenv("INLINE_FALLBACK_MODEL", "models/gemini-1.5-flash-8b"),
+        "latency_target": float(os.getenv("INLINE_LATENCY_TARGET", 1.5)),  # seconds
+        "max_output_tokens": int(os.getenv("INLINE_MAX_OUTPUT_TOKENS", 150)),
+        "temperature": float(os.getenv("INLINE_TEMPERATURE", 0.7))
+    },
+    "message": {
+        "model": os.getenv("MESSAGE_MODEL", ""),
+        "fallback_model": os.getenv("MESSAGE_FALLBACK_MODEL", ""),
+        "latency_target": float(os.getenv("MESSAGE_LATENCY_TARGET", 6.0)),
+        "max_output_tokens": int(os.getenv("MESSAGE_MAX_OUTPUT_TOKENS", 150)),
+        "temperature": float(os.getenv("MESSAGE_TEMPERATURE", 0.7))
+    },
+    "regenerate": {
+        "model": os.getenv("REGENERATE_MODEL", ""),
+        "fallback_model": os.getenv("REGENERATE_FALLBACK_MODEL", ""),
+        "latency_target": float(os.getenv("REGENERATE_LATENCY_TARGET", 6.0)),
+        "max_output_tokens": int(os.getenv("REGENERATE_MAX_OUTPUT_TOKENS", 150)),
+        "temperature": float(os.getenv("REGENERATE_TEMPERATURE", 0.7))
+    },
+    "batch": {
+        "model": "",  # batch_generate.py --model
+        "fallback_model": "",
+        "latency_target": 0.0,
+        "max_output_tokens": int(os.getenv("BATCH_MAX_OUTPUT_TOKENS", 150)),
+        "temperature": float(os.getenv("BATCH_TEMPERATURE", 0.7))
+    }
+}
+ROUTING_LATENCY_PERCENTILE = float(os.getenv("ROUTING_LATENCY_PERCENTILE", 90))
+ROUTING_WINDOW = float(os.getenv("ROUTING_WINDOW", 60))  # seconds
+ROUTING_SAMPLES = int(os.getenv("ROUTING_SAMPLES", 50))  # most recent calls per model considered
+ROUTING_MIN_SAMPLES = int(os.getenv("ROUTING_MIN_SAMPLES", 20))  # latencies in the window needed to reroute
+ROUTING_PROBE_RATE = float(os.getenv("ROUTING_PROBE_RATE", 0.05))
+
+# Gemini HTTP connection pool (shared by all async requests)
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", 100))
+GEMINI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", 20))
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", 5.0))  # seconds
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", 30.0))  # seconds
+
+# Gemini resilience: retries with jittered exponential backoff on 429/5xx and timeouts,
+# optional hedged requests past the recent latency percentile, and a circuit breaker
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 2))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", 0.5))  # seconds
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", 8.0))  # seconds
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", 95))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", 1.0))  # never hedge sooner than this
+GEMINI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("GEMINI_CIRCUIT_FAILURE_THRESHOLD", 5))
+GEMINI_CIRCUIT_RESET_TIMEOUT = float(os.getenv("GEMINI_CIRCUIT_RESET_TIMEOUT", 30.0))  # seconds
+
+# Outbound Gemini scheduling: concurrency cap, API quota and fail-fast queue limit. These are
+# for the whole bot: with WEB_WORKERS > 1 each worker process gets its share of the
+# concurrency, rate and burst
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 20))
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 1000))
+GEMINI_RATE_BURST = int(os.getenv("GEMINI_RATE_BURST", 20))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", 200))
+
+# Response cache for repeated inputs (popular inline queries etc.)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 10000))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))  # seconds
+
+# Regenerate: one Gemini call returns several candidates; the spares answer later presses
+REGEN_CANDIDATE_COUNT = int(os.getenv("REGEN_CANDIDATE_COUNT", 3))
+CANDIDATE_STORE_MAX_ENTRIES = int(os.getenv("CANDIDATE_STORE_MAX_ENTRIES", 10000))
+CANDIDATE_STORE_MAX_BYTES = int(os.getenv("CANDIDATE_STORE_MAX_BYTES", 4 * 1024 * 1024))
+CANDIDATE_STORE_TTL = float(os.getenv("CANDIDATE_STORE_TTL", 900))  # seconds
+
+# Voice replies: text-to-speech engine ("espeak" runs espeak-ng locally, no network), voices
+# for Latin-script and Ethiopic-script replies, and worker processes for synthesis and OGG/Opus
+# encoding (needs ffmpeg). Clips are cached on disk by content, up to VOICE_CACHE_MAX_BYTES.
+VOICE_ENABLED = os.getenv("VOICE_ENABLED", "false").lower() == "true"
+TTS_ENGINE = os.getenv("TTS_ENGINE", "espeak")
+TTS_VOICE = os.getenv("TTS_VOICE", "en")
+TTS_AMHARIC_VOICE = os.getenv("TTS_AMHARIC_VOICE", "am")
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", 2))
+VOICE_BITRATE = os.getenv("VOICE_BITRATE", "32k")
+VOICE_MAX_CHARS = int(os.getenv("VOICE_MAX_CHARS", 1000))  # longer replies are cut before synthesis
+VOICE_CACHE_DIR = os.getenv("VOICE_CACHE_DIR", "voice_cache")
+VOICE_CACHE_MAX_BYTES = int(os.getenv("VOICE_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+VOICE_FILE_ID_MAX_ENTRIES = int(os.getenv("VOICE_FILE_ID_MAX_ENTRIES", 10000))  # Telegram file_ids remembered
+
+# Offline batch generation (batch_generate.py): requests in flight and how often progress is
+# checkpointed; the Gemini quota above still applies
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))
+BATCH_CHECKPOINT_INTERVAL = float(os.getenv("BATCH_CHECKPOINT_INTERVAL", 2.0))  # seconds
+
+# Reply post-processing (comma-separated lists): tokens removed anywhere, markers of numbered
+# lines to drop, role prefixes stripped from the start, and an optional JSON file of extra
+# {"pattern", "replacement"} regex rules applied last
+POSTPROCESS_REMOVE_TOKENS = [token for token in os.getenv(
+    "POSTPROCESS_REMOVE_TOKENS", "**,Option 1:,Option 2:,Option 3:,*").split(",") if token]
+POSTPROCESS_LINE_MARKERS = [marker for marker in os.getenv(
+    "POSTPROCESS_LINE_MARKERS", "1.,2.,3.").split(",") if marker]
+POSTPROCESS_PREFIXES = [prefix for prefix in os.getenv(
+    "POSTPROCESS_PREFIXES", "My response:,Response:,Boyfriend:,Me:").split(",") if prefix]
+POSTPROCESS_RULES_FILE = os.getenv("POSTPROCESS_RULES_FILE", "")
+
+# Streaming replies in private chats: a placeholder message is edited as the reply streams in
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))  # min seconds between edits of one message
+
+# Inline query debouncing
+INLINE_QUIET_PERIOD = float(os.getenv("INLINE_QUIET_PERIOD", 0.4))  # seconds without a newer keystroke
+INLINE_MIN_QUERY_LENGTH = int(os.getenv("INLINE_MIN_QUERY_LENGTH", 3))
+
+# Prompt assembly: history/details are trimmed (oldest first) to keep prompts under the budget
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1024))  # estimated input tokens
+PROMPT_HISTORY_TURNS = int(os.getenv("PROMPT_HISTORY_TURNS", 3))  # most recent exchanges to include
+PROMPT_DETAILS_CACHE_SIZE = int(os.getenv("PROMPT_DETAILS_CACHE_SIZE", 10000))  # users with cached details
+
+# User data storage: "json" (single file, default) or "sqlite" (WAL, per-user row writes)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+USER_DATA_FILE = os.getenv("USER_DATA_FILE", "user_data.json")
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "user_data.db")
+
+# Users kept in memory (least recently used are evicted and reloaded on demand).
+# The JSON backend still mirrors the whole file in memory; use sqlite to bound memory.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+# Original messages behind the Regenerate button: "memory" (lost on restart) or "sqlite" (persistent)
+MESSAGE_STORE_BACKEND = os.getenv("MESSAGE_STORE_BACKEND", "memory")
+MESSAGE_STORE_DB_FILE = os.getenv("MESSAGE_STORE_DB_FILE", "message_context.db")
+MESSAGE_STORE_PER_USER = int(os.getenv("MESSAGE_STORE_PER_USER", 50))  # most recent messages kept per user
+MESSAGE_STORE_TTL = float(os.getenv("MESSAGE_STORE_TTL", 2 * 24 * 3600))  # seconds
+MESSAGE_STORE_MAX_USERS = int(os.getenv("MESSAGE_STORE_MAX_USERS", 10000))  # memory backend only
+
+# Write-behind persistence: batch user writes and flush them in the background
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 2.0))  # seconds
+WRITE_BEHIND_MAX_DIRTY = int(os.getenv("WRITE_BEHIND_MAX_DIRTY", 500))  # flush early past this many dirty users
+
+# Extra transliteration marker vocabularies (comma-separated paths, one word per line,
+# language taken from the file name, e.g. data/tigrinya.txt)
+LANGUAGE_MARKER_FILES = [path for path in os.getenv("LANGUAGE_MARKER_FILES", "").split(",") if path]
+
+# Logging: LOG_PAYLOADS also logs message texts, update JSON and raw Gemini responses
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+
 # Response styles
 RESPONSE_STYLES = {
     "romantic": "warm, affectionate and romantic",
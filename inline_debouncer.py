@@ -0,0 +1,70 @@
+import asyncio
+import logging
+
+from config import INLINE_QUIET_PERIOD, INLINE_MIN_QUERY_LENGTH
+
+logger = logging.getLogger(__name__)
+
+
+class InlineDebouncer:
+    """Per-user debouncing of inline queries.
+
+    Each query waits for a quiet period before its work starts. A newer query
+    from the same user cancels the pending or in-flight one, so only the
+    latest query per user reaches the model.
+    """
+
+    def __init__(self, quiet_period=INLINE_QUIET_PERIOD, min_length=INLINE_MIN_QUERY_LENGTH):
+        self.quiet_period = quiet_period
+        self.min_length = min_length
+        self._pending = {}  # user_id -> asyncio.Task
+        self.submitted = 0
+        self.superseded = 0
+        self.too_short = 0
+        self.completed = 0
+
+    async def _delayed(self, work):
+        await asyncio.sleep(self.quiet_period)
+        return await work()
+
+    async def run(self, user_id, query, work):
+        """Run work() for this query unless a newer one supersedes it.
+
+        Returns work()'s result, or None if the query was too short or superseded.
+        """
+        if len(query.strip()) < self.min_length:
+            self.too_short += 1
+            return None
+
+        self.submitted += 1
+        previous = self._pending.get(user_id)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+
+        task = asyncio.ensure_future(self._delayed(work))
+        self._pending[user_id] = task
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # Our own handler is being cancelled, take the work with it
+            task.cancel()
+            raise
+        finally:
+            if self._pending.get(user_id) is task:
+                del self._pending[user_id]
+
+        if task.cancelled():
+            logger.debug(f"Inline query from {user_id} superseded by a newer one")
+            return None
+        self.completed += 1
+        return task.result()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "superseded": self.superseded,
+            "too_short": self.too_short,
+            "completed": self.completed,
+            "in_flight": len(self._pending)
+        }
@@ -0,0 +1,99 @@
+import logging
+import os
+import re
+from typing import NamedTuple
+
+from config import LANGUAGE_MARKER_FILES
+
+logger = logging.getLogger(__name__)
+
+# Ethiopic script block (Fidel): \u1200-\u137F
+ETHIOPIC_SCRIPT = r'[\u1200-\u137F]'
+ETHIOPIC_PATTERN = re.compile(ETHIOPIC_SCRIPT)
+
+# Common Amharic words when written in the Latin alphabet
+AMHARIC_MARKERS = [
+    "ene", "ante", "anchi", "esu", "esua", "egna", "enanet", "enante",  # pronouns
+    "selam", "tena yistilign", "dehna", "betam", "ameseginalehu",  # common phrases
+    "new", "nesh", "nat", "nachew", "nen",  # forms of "to be"
+    "yihe", "yih", "ya", "yehe",  # demonstratives
+    "min", "man", "yet", "meche", "sint",  # question words
+    "alegn", "alesh", "ale", "alat", "alen", "alachihu", "alachew",  # have forms
+    "ewedihalehu", "ewedishalehu", "ewedihalew", "ewediyatalew",  # love forms
+]
+
+
+class LanguageDetection(NamedTuple):
+    mode: str  # "amharic" (Fidel script), "transliterated" or "english"
+    language: str  # language of the matched markers, e.g. "amharic" or "tigrinya"
+
+
+ENGLISH = LanguageDetection("english", "english")
+AMHARIC_SCRIPT = LanguageDetection("amharic", "amharic")
+
+
+def load_marker_file(path):
+    """Read a marker vocabulary: one word or phrase per line, '#' starts a comment.
+
+    The language name is the file name without its extension.
+    """
+    language = os.path.splitext(os.path.basename(path))[0].lower()
+    markers = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip().lower()
+            if line:
+                markers.append(line)
+    return language, markers
+
+
+class LanguageDetector:
+    """Detects script and transliteration in one pass of a single precompiled regex.
+
+    The pattern is an alternation of the Ethiopic script range and one named
+    group of markers per language, so adding vocabularies doesn't add passes.
+    """
+
+    def __init__(self, marker_files=None):
+        self.vocabularies = {"amharic": list(AMHARIC_MARKERS)}  # markers are lowercase
+        for path in marker_files if marker_files is not None else LANGUAGE_MARKER_FILES:
+            try:
+                language, markers = load_marker_file(path)
+            except OSError as e:
+                logger.error(f"Could not load language markers from {path}: {e}")
+                continue
+            self.vocabularies.setdefault(language, []).extend(markers)
+        self._compile()
+
+    def _compile(self):
+        groups = [f"(?P<script>{ETHIOPIC_SCRIPT})"]
+        self._group_languages = {}
+        for i, (language, markers) in enumerate(self.vocabularies.items()):
+            # Longest first so phrases win over their leading word
+            words = sorted(set(markers), key=len, reverse=True)
+            group = f"lang{i}"
+            self._group_languages[group] = language
+            groups.append(rf"\b(?P<{group}>{'|'.join(re.escape(w) for w in words)})\b")
+        # Matching lowercased text case-sensitively is about twice as fast as re.IGNORECASE
+        self.pattern = re.compile("|".join(groups))
+
+    def detect(self, text):
+        """Return the LanguageDetection for text.
+
+        Fidel script anywhere wins over Latin markers, as before; otherwise the
+        first marker found decides the transliterated language.
+        """
+        transliterated = None
+        for match in self.pattern.finditer(text.lower()):
+            group = match.lastgroup
+            if group == "script":
+                return AMHARIC_SCRIPT
+            if transliterated is None:
+                transliterated = LanguageDetection("transliterated", self._group_languages[group])
+        return transliterated or ENGLISH
+
+    def has_markers(self, text, language="amharic"):
+        return any(
+            self._group_languages.get(match.lastgroup) == language
+            for match in self.pattern.finditer(text.lower())
+        )
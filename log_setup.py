@@ -0,0 +1,34 @@
+import logging
+
+from config import LOG_LEVEL, TELEGRAM_TOKEN, GOOGLE_API_KEY
+
+
+class RedactSecrets(logging.Filter):
+    """Replace the bot token and API key in log records (access logs carry the webhook path)."""
+
+    def __init__(self, secrets):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret]
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = message
+        for secret in self.secrets:
+            redacted = redacted.replace(secret, "<redacted>")
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Set up root logging once, at LOG_LEVEL, with secrets redacted."""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=level
+    )
+    # httpx logs every request URL at INFO, and Gemini URLs carry the API key
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RedactSecrets) for f in handler.filters):
+            handler.addFilter(RedactSecrets([TELEGRAM_TOKEN, GOOGLE_API_KEY]))
@@ -1,23 +1,30 @@
+import asyncio
 import logging
+import traceback
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, InlineQueryHandler
 import time
 
-from config import TELEGRAM_TOKEN, RESPONSE_STYLES
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE_URL, RESPONSE_STYLES, STREAM_RESPONSES, STREAM_EDIT_INTERVAL,
+    LOG_PAYLOADS, VOICE_ENABLED
+)
 from user_manager import UserManager
+from storage import create_storage
 from ai_handler import AIHandler
+from inline_debouncer import InlineDebouncer
+from message_store import create_message_store
+from update_processor import PerUserUpdateProcessor
+from send_queue import TelegramSendQueue
+from metrics import REGISTRY, instrumented, stage
+from log_setup import configure_logging
 
 # Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize user manager and AI handler
-user_manager = UserManager()
-ai_handler = AIHandler()
-
+@instrumented("command")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
@@ -28,6 +35,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         f"Use /help to see all available commands."
     )
 
+@instrumented("command")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     help_text = (
@@ -44,6 +52,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     await update.message.reply_text(help_text)
 
+@instrumented("command")
 async def style_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Change the response style."""
     keyboard = []
@@ -53,6 +62,7 @@ async def style_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Choose your preferred response style:", reply_markup=reply_markup)
 
+@instrumented("callback")
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button callbacks."""
     query = update.callback_query
@@ -60,6 +70,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     data = query.data
     user_id = update.effective_user.id
+    user_manager = context.bot_data["user_manager"]
     
     if data.startswith("style_"):
         style = data.replace("style_", "")
@@ -84,32 +95,62 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Extract the message ID
         message_id = data.replace("regen_", "")
         
-        # Get the original message from context
-        if context.user_data.get("messages") and message_id in context.user_data["messages"]:
-            original_message = context.user_data["messages"][message_id]
-            
-            # Generate a new response
-            user_data = user_manager.get_user(user_id)
-            new_response = ai_handler.generate_response(original_message, user_data)
+        # Get the original message from the message-context store
+        with stage("persistence"):
+            original_message = context.bot_data["message_store"].get(user_id, message_id)
+        if original_message is not None:
+            # Serve a spare candidate, or generate a fresh batch (skipping the cache) if none is left
+            with stage("user_lookup"):
+                user_data = user_manager.get_user(user_id)
+            new_response = await context.bot_data["ai_handler"].aregenerate_response(
+                message_id, original_message, user_data, user_id=user_id
+            )
             
             # Add to history
-            user_manager.add_to_history(user_id, (original_message, new_response))
+            with stage("persistence"):
+                user_manager.add_to_history(user_id, (original_message, new_response))
             
             # Update the message with the new response
-            keyboard = [
-                [InlineKeyboardButton("📋 Copy Response", callback_data=f"copy_{message_id}")],
-                [InlineKeyboardButton("🔄 Regenerate Response", callback_data=f"regen_{message_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = response_markup(message_id)
             
-            await query.edit_message_text(
-                f"Here's your response:\n\n<code>{new_response}</code>",
-                reply_markup=reply_markup,
-                parse_mode="HTML"
-            )
+            with stage("telegram_reply"):
+                await query.edit_message_text(
+                    f"Here's your response:\n\n<code>{new_response}</code>",
+                    reply_markup=reply_markup,
+                    parse_mode="HTML"
+                )
         else:
             await query.answer("Sorry, I couldn't find the original message.")
+    
+    elif data.startswith("voice_"):
+        # Speak the response shown in the message
+        if query.message and query.message.text:
+            response_text = query.message.text.split("\n\n", 1)[-1]
+            with stage("user_lookup"):
+                style = user_manager.get_user(user_id).get("style")
+            ai_handler = context.bot_data["ai_handler"]
+            clip = await ai_handler.generate_voice_message(response_text, style)
+            if clip is None:
+                await query.message.reply_text("Sorry, I couldn't create a voice message right now.")
+                return
+            
+            with stage("telegram_reply"):
+                sent = await query.message.reply_voice(clip.voice)
+            # Later requests for the same clip re-send it by file_id instead of uploading it again
+            if sent.voice is not None:
+                ai_handler.voice.remember_file_id(clip, sent.voice.file_id)
 
+def response_markup(message_id) -> InlineKeyboardMarkup:
+    """Buttons under a generated response."""
+    keyboard = [
+        [InlineKeyboardButton("📋 Copy Response", callback_data=f"copy_{message_id}")],
+        [InlineKeyboardButton("🔄 Regenerate Response", callback_data=f"regen_{message_id}")]
+    ]
+    if VOICE_ENABLED:
+        keyboard.append([InlineKeyboardButton("🔊 Listen", callback_data=f"voice_{message_id}")])
+    return InlineKeyboardMarkup(keyboard)
+
+@instrumented("command")
 async def set_name_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Set girlfriend's name."""
     if not context.args:
@@ -118,10 +159,11 @@ async def set_name_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     
     name = " ".join(context.args)
     user_id = update.effective_user.id
-    user_manager.update_girlfriend_name(user_id, name)
+    context.bot_data["user_manager"].update_girlfriend_name(user_id, name)
     
     await update.message.reply_text(f"Your girlfriend's name has been set to: {name}")
 
+@instrumented("command")
 async def add_detail_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Add a personal detail."""
     if len(context.args) < 2:
@@ -134,13 +176,15 @@ async def add_detail_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     value = " ".join(context.args[1:])
     user_id = update.effective_user.id
     
-    user_manager.add_personal_detail(user_id, key, value)
+    context.bot_data["user_manager"].add_personal_detail(user_id, key, value)
     await update.message.reply_text(f"Added personal detail: {key} = {value}")
 
+@instrumented("message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming messages."""
     message_text = update.message.text
-    logger.info(f"Received message: {message_text}")
+    if LOG_PAYLOADS:
+        logger.info(f"Received message: {message_text}")
     
     # Get the bot's username
     bot_username = context.bot.username
@@ -166,36 +210,86 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
         
         user_id = update.effective_user.id
-        user_data = user_manager.get_user(user_id)
+        user_manager = context.bot_data["user_manager"]
+        ai_handler = context.bot_data["ai_handler"]
+        with stage("user_lookup"):
+            user_data = user_manager.get_user(user_id)
         
-        # Store the original message in user context for regeneration
-        if not context.user_data.get("messages"):
-            context.user_data["messages"] = {}
+        # Store the original message for regeneration under a unique message ID
+        with stage("persistence"):
+            message_id = context.bot_data["message_store"].add(user_id, girlfriend_message)
         
-        # Generate a unique message ID
-        message_id = f"msg_{user_id}_{int(time.time())}"
-        context.user_data["messages"][message_id] = girlfriend_message
+        # Create a keyboard with copy and regenerate (and listen) buttons
+        reply_markup = response_markup(message_id)
         
-        # Generate AI response
-        ai_response = ai_handler.generate_response(girlfriend_message, user_data)
+        if STREAM_RESPONSES and is_direct_message:
+            # Show the response while it's being generated
+            ai_response = await stream_response(update, ai_handler, girlfriend_message, user_data, user_id, reply_markup)
+        else:
+            # Generate AI response
+            ai_response = await ai_handler.agenerate_response(girlfriend_message, user_data, user_id=user_id)
+            
+            # Send response with buttons
+            with stage("telegram_reply"):
+                await update.message.reply_text(
+                    f"Here's your response:\n\n<code>{ai_response}</code>",
+                    reply_markup=reply_markup,
+                    parse_mode="HTML"
+                )
         
         # Add to history
-        user_manager.add_to_history(user_id, (girlfriend_message, ai_response))
-        
-        # Create a keyboard with copy and regenerate buttons
-        keyboard = [
-            [InlineKeyboardButton("📋 Copy Response", callback_data=f"copy_{message_id}")],
-            [InlineKeyboardButton("🔄 Regenerate Response", callback_data=f"regen_{message_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Send response with buttons
-        await update.message.reply_text(
+        with stage("persistence"):
+            user_manager.add_to_history(user_id, (girlfriend_message, ai_response))
+
+async def stream_response(update: Update, ai_handler, girlfriend_message, user_data, user_id, reply_markup) -> str:
+    """Send a placeholder reply and edit it as the AI response streams in.
+    
+    Edits are spaced at least STREAM_EDIT_INTERVAL apart and don't hold up
+    the stream: the send queue sends them at background priority and drops
+    one still waiting when a newer edit arrives. The buttons are added with
+    the final edit, sent once no partial edit is left to land after it.
+    """
+    placeholder = await update.message.reply_text("Here's your response:\n\n✍️ ...")
+    last_edit = time.monotonic()
+    shown = None
+    ai_response = None
+    edits = []
+    
+    async for partial in ai_handler.astream_response(girlfriend_message, user_data, user_id=user_id):
+        ai_response = partial
+        now = time.monotonic()
+        if partial != shown and now - last_edit >= STREAM_EDIT_INTERVAL:
+            edit = asyncio.create_task(
+                placeholder.edit_text(f"Here's your response:\n\n<code>{partial}</code>", parse_mode="HTML")
+            )
+            _streaming_edits.add(edit)
+            edit.add_done_callback(_streaming_edit_done)
+            edits.append(edit)
+            shown = partial
+            last_edit = now
+    
+    # A partial edit not yet sent (or not even queued) would land after the final one and drop its buttons
+    for edit in edits:
+        edit.cancel()
+    await asyncio.gather(*edits, return_exceptions=True)
+    
+    with stage("telegram_reply"):
+        await placeholder.edit_text(
             f"Here's your response:\n\n<code>{ai_response}</code>",
             reply_markup=reply_markup,
             parse_mode="HTML"
         )
+    return ai_response
 
+# Partial edits sent in the background, referenced until done
+_streaming_edits = set()
+
+def _streaming_edit_done(edit):
+    _streaming_edits.discard(edit)
+    if not edit.cancelled() and isinstance(edit.exception(), TelegramError):
+        logger.warning(f"Skipping streaming edit: {edit.exception()}")
+
+@instrumented("inline")
 async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the inline queries."""
     query = update.inline_query.query
@@ -203,17 +297,25 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not query:
         return
     
-    logger.info(f"Received inline query: {query}")
+    if LOG_PAYLOADS:
+        logger.info(f"Received inline query: {query}")
     
     user_id = update.effective_user.id
-    user_data = user_manager.get_user(user_id)
+    with stage("user_lookup"):
+        user_data = context.bot_data["user_manager"].get_user(user_id)
+    ai_handler = context.bot_data["ai_handler"]
     
     try:
-        # Generate AI response
-        ai_response = ai_handler.generate_response(query, user_data)
+        # Generate AI response once the user stops typing; newer keystrokes supersede this one
+        ai_response = await context.bot_data["inline_debouncer"].run(
+            user_id, query, lambda: ai_handler.agenerate_response(query, user_data, user_id=user_id, entry_point="inline")
+        )
+        if ai_response is None:
+            return
         
         # Log the response for debugging
-        logger.info(f"Generated AI response: {ai_response}")
+        if LOG_PAYLOADS:
+            logger.info(f"Generated AI response: {ai_response}")
         
         if not ai_response or ai_response.strip() == "":
             ai_response = "I couldn't generate a response. Please try a different message."
@@ -228,7 +330,8 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             )
         ]
         
-        await update.inline_query.answer(results)
+        with stage("telegram_reply"):
+            await update.inline_query.answer(results)
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         # Return a fallback response
@@ -242,10 +345,41 @@ async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         ]
         await update.inline_query.answer(results)
 
-def run_polling():
-    """Start the bot with polling (for development)."""
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def error_handler(update, context):
+    """Log the error and send a message to the user."""
+    logger.error(f"Exception while handling an update: {context.error}")
+    logger.error("".join(traceback.format_exception(context.error)))
+
+async def close_services(application: Application) -> None:
+    """Flush pending user writes and release pooled Gemini connections on shutdown."""
+    application.bot_data["user_manager"].close()
+    application.bot_data["message_store"].close()
+    await application.bot_data["ai_handler"].aclose()
+
+def create_application(user_manager=None, ai_handler=None, update_processor=None) -> Application:
+    """Build the bot Application and register its handlers.
+    
+    The UserManager and AIHandler are created here (unless given) and shared
+    with every handler through bot_data, so a process holds exactly one of
+    each. Both app.py (webhook) and run_polling use this. update_processor
+    sets how updates from application.update_queue (polling) are processed;
+    by default one at a time. Nothing here touches the network.
+    """
+    builder = (
+        Application.builder().token(TELEGRAM_TOKEN).base_url(TELEGRAM_API_BASE_URL)
+        .post_shutdown(close_services)
+    )
+    if update_processor is not None:
+        builder = builder.concurrent_updates(update_processor)
+    send_queue = TelegramSendQueue()
+    application = builder.rate_limiter(send_queue).build()
+    
+    # Shared services
+    application.bot_data["user_manager"] = user_manager if user_manager is not None else UserManager(storage=create_storage())
+    application.bot_data["ai_handler"] = ai_handler if ai_handler is not None else AIHandler()
+    application.bot_data["inline_debouncer"] = InlineDebouncer()
+    application.bot_data["message_store"] = create_message_store()
+    application.bot_data["send_queue"] = send_queue
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -256,9 +390,38 @@ def run_polling():
     application.add_handler(CallbackQueryHandler(button_callback))
     application.add_handler(InlineQueryHandler(inline_query))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_error_handler(error_handler)
+    return application
+
+def register_metrics(application: Application) -> None:
+    """Expose the shared services' counters as gauges on /metrics."""
+    bot_data = application.bot_data
+    ai_handler = bot_data["ai_handler"]
+    if application.update_processor is not None and hasattr(application.update_processor, "stats"):
+        REGISTRY.add_collector("update_processor", application.update_processor.stats)
+    REGISTRY.add_collector("users", bot_data["user_manager"].stats)
+    REGISTRY.add_collector("telegram", bot_data["send_queue"].stats)
+    REGISTRY.add_collector("scheduler", ai_handler.scheduler.stats)
+    REGISTRY.add_collector("resilience", ai_handler.resilience.stats)
+    REGISTRY.add_collector("prompt", ai_handler.prompt_builder.stats)
+    REGISTRY.add_collector("candidates", ai_handler.candidates.stats)
+    REGISTRY.add_collector("routing", ai_handler.router.stats)
+    if ai_handler.cache is not None:
+        REGISTRY.add_collector("response_cache", ai_handler.cache.stats)
+    if ai_handler.voice is not None:
+        REGISTRY.add_collector("voice", ai_handler.voice.stats)
+    storage = bot_data["user_manager"].storage
+    if hasattr(storage, "stats"):
+        REGISTRY.add_collector("storage", storage.stats)
+
+def run_polling():
+    """Start the bot with polling (for development, or as a fallback when webhooks are down)."""
+    # Same handlers as the webhook app; updates from different users run concurrently
+    processor = PerUserUpdateProcessor()
+    application = create_application(update_processor=processor)
 
     # Log the bot's username when starting
-    logger.info(f"Starting bot in polling mode...")
+    logger.info(f"Starting bot in polling mode with up to {processor.concurrency} concurrent updates...")
     
     # Run the bot with polling
     application.run_polling()
@@ -0,0 +1,151 @@
+import itertools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    MESSAGE_STORE_BACKEND, MESSAGE_STORE_DB_FILE, MESSAGE_STORE_PER_USER, MESSAGE_STORE_TTL,
+    MESSAGE_STORE_MAX_USERS
+)
+
+
+class MessageContextStore:
+    """Keeps the original message behind each reply so Regenerate can find it.
+
+    add() returns a short message ID for the callback data; get() looks it
+    up for the same user. Each user keeps at most per_user messages and
+    entries expire after ttl seconds.
+    """
+
+    def add(self, user_id, message):
+        """Store a message and return its ID."""
+        raise NotImplementedError
+
+    def get(self, user_id, message_id):
+        """Return the stored message, or None if it's unknown or expired."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryMessageStore(MessageContextStore):
+    """In-process store, bounded per user and in total users; lost on restart."""
+
+    def __init__(self, per_user=MESSAGE_STORE_PER_USER, ttl=MESSAGE_STORE_TTL,
+                 max_users=MESSAGE_STORE_MAX_USERS):
+        self.per_user = per_user
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> OrderedDict(message_id -> (expires_at, message))
+        # Start from the clock so IDs issued before a restart aren't handed out again
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self.evicted_users = 0
+
+    def add(self, user_id, message):
+        user_id = str(user_id)
+        message_id = f"{next(self._ids):x}"
+        with self._lock:
+            messages = self._users.get(user_id)
+            if messages is None:
+                messages = self._users[user_id] = OrderedDict()
+            self._users.move_to_end(user_id)
+            messages[message_id] = (time.monotonic() + self.ttl, message)
+            while len(messages) > self.per_user:
+                messages.popitem(last=False)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evicted_users += 1
+        return message_id
+
+    def get(self, user_id, message_id):
+        with self._lock:
+            messages = self._users.get(str(user_id))
+            entry = messages.get(message_id) if messages is not None else None
+            if entry is None:
+                return None
+            expires_at, message = entry
+            if expires_at < time.monotonic():
+                del messages[message_id]
+                return None
+            return message
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._users.values())
+
+
+class SQLiteMessageStore(MessageContextStore):
+    """Persistent store, so Regenerate keeps working across restarts and deploys.
+
+    Message IDs come from an AUTOINCREMENT key and are never reused.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS message_context (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS message_context_user ON message_context (user_id, id);
+        CREATE INDEX IF NOT EXISTS message_context_created ON message_context (created_at);
+    """
+
+    PURGE_EVERY = 1000  # adds between sweeps for expired rows
+
+    def __init__(self, db_file=MESSAGE_STORE_DB_FILE, per_user=MESSAGE_STORE_PER_USER, ttl=MESSAGE_STORE_TTL):
+        self.db_file = db_file
+        self.per_user = per_user
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._adds = 0
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def add(self, user_id, message):
+        user_id = str(user_id)
+        with self._lock, self.conn:
+            row_id = self.conn.execute(
+                "INSERT INTO message_context (user_id, message, created_at) VALUES (?, ?, ?)",
+                (user_id, message, time.time())
+            ).lastrowid
+            self.conn.execute(
+                "DELETE FROM message_context WHERE user_id = ? AND id NOT IN "
+                "(SELECT id FROM message_context WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, self.per_user)
+            )
+            self._adds += 1
+            if self._adds % self.PURGE_EVERY == 0:
+                self.conn.execute("DELETE FROM message_context WHERE created_at < ?", (time.time() - self.ttl,))
+        return f"{row_id:x}"
+
+    def get(self, user_id, message_id):
+        try:
+            row_id = int(message_id, 16)
+        except ValueError:
+            return None  # e.g. a button from before this store existed
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT message, created_at FROM message_context WHERE id = ? AND user_id = ?",
+                (row_id, str(user_id))
+            ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def create_message_store(backend=MESSAGE_STORE_BACKEND):
+    """Create the message-context store selected in config."""
+    if backend == "sqlite":
+        return SQLiteMessageStore(MESSAGE_STORE_DB_FILE)
+    if backend == "memory":
+        return MemoryMessageStore()
+    raise ValueError(f"Unknown message store backend: {backend}")
@@ -0,0 +1,175 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Name of the bot handler the current task is running, used to label stage timings
+_current_handler = contextvars.ContextVar("current_handler", default="other")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, one series per label set."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """Copy of every series, keyed by label values."""
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self, remote=()):
+        """Render this process's series, then each (extra labels, snapshot) in remote."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        sources = [((), self.snapshot()), *remote]
+        for extra, snapshot in sources:
+            for labels, series in sorted(snapshot.items()):
+                names = self.labelnames + tuple(name for name, _ in extra)
+                values = labels + tuple(value for _, value in extra)
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _format_labels(names, values, [("le", repr(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(names, values, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                label_text = _format_labels(names, values)
+                lines.append(f"{self.name}_sum{label_text} {series[-2]}")
+                lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms plus gauges read from components' stats() dicts at scrape time.
+
+    Other processes (shard workers) can hand in their snapshot() with
+    set_remote(); render() includes it with a worker label.
+    """
+
+    def __init__(self, prefix="lovewhisper"):
+        self.prefix = prefix
+        self.histograms = []
+        self.collectors = {}  # component name -> callable returning a stats dict
+        self.remote = {}  # worker name -> its latest snapshot()
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def add_collector(self, component, stats):
+        """Expose every numeric value of stats() as a gauge named <prefix>_<component>_<key>."""
+        self.collectors[component] = stats
+
+    def _gauges(self):
+        gauges = {}
+        for component, stats in self.collectors.items():
+            for key, value in stats().items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    gauges[f"{self.prefix}_{component}_{key}"] = value
+        return gauges
+
+    def snapshot(self):
+        """This process's histogram series and gauge values, for set_remote() in another process."""
+        return {
+            "histograms": {histogram.name: histogram.snapshot() for histogram in self.histograms},
+            "gauges": self._gauges()
+        }
+
+    def set_remote(self, worker, snapshot):
+        self.remote[worker] = snapshot
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        remote = [((("worker", worker),), snapshot) for worker, snapshot in sorted(self.remote.items())]
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render(
+                [(extra, snapshot["histograms"].get(histogram.name, {})) for extra, snapshot in remote]
+            ))
+        gauges = {name: [("", value)] for name, value in self._gauges().items()}
+        for extra, snapshot in remote:
+            for name, value in snapshot["gauges"].items():
+                gauges.setdefault(name, []).append((_format_labels((), (), extra), value))
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{label_text} {value}" for label_text, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "handler_seconds", "Time to handle one update, per bot handler", ("handler",)
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_seconds", "Time spent in each hot-path stage, per bot handler", ("handler", "stage")
+)
+GEMINI_MODEL_SECONDS = REGISTRY.histogram(
+    "gemini_model_seconds", "Gemini call latency per model and entry point", ("model", "entry_point")
+)
+TELEGRAM_QUEUE_SECONDS = REGISTRY.histogram(
+    "telegram_queue_seconds", "Time Bot API calls wait in the send queue", ("endpoint", "priority")
+)
+
+
+def record_stage(name, seconds, handler=None):
+    """Record a stage timing measured by the caller."""
+    STAGE_SECONDS.observe(seconds, handler or _current_handler.get(), name)
+
+
+@contextmanager
+def stage(name, handler=None):
+    """Time the block as one stage of the handler currently running."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start, handler)
+
+
+def instrumented(handler_name):
+    """Decorator for bot handlers: times the whole call and labels stages inside it."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current_handler.set(handler_name)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, handler_name)
+                _current_handler.reset(token)
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+import itertools
+import logging
+import random
+import re
+import time
+from collections import Counter, deque
+
+from config import (
+    DEFAULT_MODEL, MODEL_ROUTES, ROUTING_LATENCY_PERCENTILE, ROUTING_WINDOW, ROUTING_SAMPLES, ROUTING_MIN_SAMPLES,
+    ROUTING_PROBE_RATE
+)
+from metrics import GEMINI_MODEL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Back to the primary only once it is comfortably under its target, so routing doesn't flap
+RECOVERY_FACTOR = 0.8
+
+
+class RouteChoice:
+    """The model and generation settings picked for one Gemini call."""
+
+    __slots__ = ("entry_point", "model", "max_output_tokens", "temperature", "reason")
+
+    def __init__(self, entry_point, model, max_output_tokens, temperature, reason):
+        self.entry_point = entry_point
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.reason = reason
+
+
+class ModelLatency:
+    """Latencies of a model's last max_samples calls within `window` seconds, and the calls still running."""
+
+    def __init__(self, window=ROUTING_WINDOW, max_samples=ROUTING_SAMPLES):
+        self.window = window
+        self.samples = deque(maxlen=max_samples)  # (monotonic time, seconds)
+        self.running = {}  # call id -> start time
+        self._ids = itertools.count()
+
+    def begin(self):
+        call = next(self._ids)
+        self.running[call] = time.monotonic()
+        return call
+
+    def end(self, call):
+        """Stop timing a call and return its duration."""
+        return time.monotonic() - self.running.pop(call)
+
+    def record(self, seconds):
+        self.samples.append((time.monotonic(), seconds))
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def percentile(self, pct, min_samples=1):
+        self._expire()
+        if len(self.samples) < max(min_samples, 1):
+            return None
+        ordered = sorted(seconds for _, seconds in self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def over(self, target, pct, min_samples=1):
+        """Whether the pct percentile is over target, or None without enough samples.
+
+        Running calls count with their age so far, so a model that just
+        slowed down is noticed before its slow calls finish.
+        """
+        self._expire()
+        now = time.monotonic()
+        values = [seconds for _, seconds in self.samples]
+        values.extend(now - start for start in self.running.values())
+        if len(values) < max(min_samples, 1):
+            return None
+        slow = sum(1 for seconds in values if seconds > target)
+        return slow > len(values) * (100 - pct) / 100
+
+
+def _metric_name(model):
+    return re.sub(r"[^A-Za-z0-9_]", "_", model.rsplit("/", 1)[-1])
+
+
+class ModelRouter:
+    """Picks the model and generation settings for each Gemini call by entry point.
+
+    Every route (MODEL_ROUTES) names a model, maxOutputTokens, temperature
+    and a latency target. While the model's recent latency percentile is
+    over the target (and the route's fallback model's isn't), calls go to
+    the fallback; a probe_rate share still goes to the primary so its
+    recovery is noticed. With too few recent samples the primary is used,
+    so an idle model is tried again once its old latencies age out.
+    """
+
+    def __init__(self, default_model=DEFAULT_MODEL, routes=MODEL_ROUTES, percentile=ROUTING_LATENCY_PERCENTILE,
+                 window=ROUTING_WINDOW, samples=ROUTING_SAMPLES, min_samples=ROUTING_MIN_SAMPLES,
+                 probe_rate=ROUTING_PROBE_RATE):
+        self.routes = {name: dict(route, model=route["model"] or default_model) for name, route in routes.items()}
+        self.percentile = percentile
+        self.window = window
+        self.samples = samples
+        self.min_samples = min_samples
+        self.probe_rate = probe_rate
+        self._latency = {}  # model -> ModelLatency
+        self._on_fallback = set()  # entry points currently routed to their fallback
+        self.decisions = Counter()  # (entry point, reason) -> calls
+
+    def _route(self, entry_point):
+        # Entry points without a route of their own get the message settings
+        return self.routes.get(entry_point) or self.routes["message"]
+
+    def _tracker(self, model):
+        tracker = self._latency.get(model)
+        if tracker is None:
+            tracker = self._latency[model] = ModelLatency(self.window, self.samples)
+        return tracker
+
+    def latency(self, model):
+        """The model's recent latency percentile, or None without enough samples."""
+        return self._tracker(model).percentile(self.percentile, self.min_samples)
+
+    def _primary_too_slow(self, entry_point, route):
+        target = route["latency_target"]
+        if entry_point in self._on_fallback:
+            target *= RECOVERY_FACTOR
+        if not self._tracker(route["model"]).over(target, self.percentile, self.min_samples):
+            return False
+        # Stay on the primary if the fallback is known to be over the target as well
+        return not self._tracker(route["fallback_model"]).over(route["latency_target"], self.percentile,
+                                                               self.min_samples)
+
+    def choose(self, entry_point):
+        """Return the RouteChoice for the next call from entry_point."""
+        route = self._route(entry_point)
+        model = route["model"]
+        reason = "primary"
+        fallback = route["fallback_model"]
+        if fallback and fallback != model:
+            slow = self._primary_too_slow(entry_point, route)
+            if slow and random.random() >= self.probe_rate:
+                model, reason = fallback, "fallback"
+            elif slow:
+                reason = "probe"
+            self._note_switch(entry_point, route, slow)
+        self.decisions[(entry_point, reason)] += 1
+        return RouteChoice(entry_point, model, route["max_output_tokens"], route["temperature"], reason)
+
+    def _note_switch(self, entry_point, route, slow):
+        if slow == (entry_point in self._on_fallback):
+            return
+        if slow:
+            self._on_fallback.add(entry_point)
+            logger.warning(f"Routing {entry_point} to {route['fallback_model']}: {route['model']} "
+                           f"p{self.percentile:.0f} is over the {route['latency_target']}s target")
+        else:
+            self._on_fallback.discard(entry_point)
+            logger.info(f"Routing {entry_point} back to {route['model']}")
+
+    def begin(self, choice):
+        """Start timing a call to the chosen model; pass the result to end()."""
+        return self._tracker(choice.model).begin()
+
+    def end(self, choice, call, record=True):
+        """Finish timing a call; record=False drops it (errors, cancelled hedges)."""
+        tracker = self._tracker(choice.model)
+        seconds = tracker.end(call)
+        if record:
+            tracker.record(seconds)
+            GEMINI_MODEL_SECONDS.observe(seconds, choice.model, choice.entry_point)
+
+    def stats(self):
+        stats = {f"decisions_{entry_point}_{reason}": count for (entry_point, reason), count in self.decisions.items()}
+        for entry_point in self.routes:
+            stats[f"{entry_point}_on_fallback"] = entry_point in self._on_fallback
+        for model, tracker in list(self._latency.items()):
+            stats[f"running_{_metric_name(model)}"] = len(tracker.running)
+            latency = self.latency(model)
+            stats[f"p{self.percentile:.0f}_seconds_{_metric_name(model)}"] = latency if latency is not None else 0.0
+        return stats
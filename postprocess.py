@@ -0,0 +1,123 @@
+import json
+import re
+
+from config import (
+    POSTPROCESS_REMOVE_TOKENS, POSTPROCESS_LINE_MARKERS, POSTPROCESS_PREFIXES, POSTPROCESS_RULES_FILE
+)
+
+
+def _alternation(literals):
+    # Longest first, so a longer literal wins over its own prefix
+    return "|".join(re.escape(text) for text in sorted(literals, key=len, reverse=True))
+
+
+def _first_chars(literals):
+    return sorted({text[0] for text in literals})
+
+
+def _contains_any(text, chars):
+    for char in chars:
+        if char in text:
+            return True
+    return False
+
+
+def load_rules(path):
+    """Read extra rules from a JSON list of {"pattern": ..., "replacement": ...} objects."""
+    with open(path, encoding="utf-8") as f:
+        return [(rule["pattern"], rule.get("replacement", "")) for rule in json.load(f)]
+
+
+class ResponsePostprocessor:
+    """Cleans up model replies with a few precompiled steps.
+
+    In order: strip surrounding whitespace; remove formatting tokens and
+    option markers; drop numbered lines (a marker such as "1." followed by
+    text); strip leading role prefixes like "Response:"; then apply any
+    extra (pattern, replacement) rules.
+    """
+
+    def __init__(self, remove_tokens=POSTPROCESS_REMOVE_TOKENS, line_markers=POSTPROCESS_LINE_MARKERS,
+                 prefixes=POSTPROCESS_PREFIXES, rules=None):
+        if rules is None:
+            rules = load_rules(POSTPROCESS_RULES_FILE) if POSTPROCESS_RULES_FILE else []
+        # A scan for a multi-character literal costs far more than a single-character
+        # "in" check, so each step only runs on text containing a first character of
+        # its literals. Tokens are plain replaces, in order: str.replace beats a regex
+        # alternation when there are many matches (e.g. "*" around every action).
+        self._tokens = list(remove_tokens)
+        self._token_chars = _first_chars(remove_tokens)
+        self._marker_chars = _first_chars(line_markers)
+        if line_markers:
+            line = rf"[^\S\n]*(?:{_alternation(line_markers)})[^\n]+\S[^\n]*"
+            # Applied to the text with a newline prepended, so every line (the first
+            # included) is removed together with the newline before it
+            self._numbered = re.compile(rf"\n{line}(?=\n|\Z)")
+            self._numbered_line = re.compile(line)
+        else:
+            self._numbered = self._numbered_line = None
+        # Each prefix is checked once, in order, like repeated startswith() checks
+        self._prefixes = re.compile("".join(rf"(?:{re.escape(prefix)}\s*)?" for prefix in prefixes))
+        self._rules = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+
+    def clean(self, text):
+        """Return the cleaned reply."""
+        text = text.strip()
+        if _contains_any(text, self._token_chars):
+            text = self._remove_tokens(text)
+        if self._numbered is not None and _contains_any(text, self._marker_chars):
+            text = self._numbered.sub("", "\n" + text)[1:]
+        return self._finish(text)
+
+    def _remove_tokens(self, text):
+        for token in self._tokens:
+            text = text.replace(token, "")
+        return text
+
+    def _finish(self, text):
+        end = self._prefixes.match(text).end()
+        if end:
+            text = text[end:].strip()
+        for pattern, replacement in self._rules:
+            text = pattern.sub(replacement, text)
+        return text
+
+    def _clean_line(self, line):
+        """Clean one complete line; None if it should be dropped."""
+        if _contains_any(line, self._token_chars):
+            line = self._remove_tokens(line)
+        if self._numbered_line is not None and self._numbered_line.fullmatch(line):
+            return None
+        return line
+
+    def stream(self):
+        return StreamCleaner(self)
+
+
+class StreamCleaner:
+    """Cleans a streamed reply incrementally.
+
+    Each complete line is cleaned once when its newline arrives; only the
+    unfinished last line is re-cleaned per chunk. Partial results may differ
+    from clean() in whitespace at the cut, so clean() the full text for the
+    final reply.
+    """
+
+    def __init__(self, postprocessor):
+        self.postprocessor = postprocessor
+        self._head = []  # cleaned complete lines that were kept
+        self._tail = ""
+
+    def feed(self, chunk):
+        """Add a chunk and return the cleaned text so far."""
+        text = self._tail + chunk
+        if not self._head:
+            text = text.lstrip()
+        *lines, self._tail = text.split("\n")
+        for line in lines:
+            line = self.postprocessor._clean_line(line)
+            if line is not None and (self._head or line.strip()):
+                self._head.append(line)
+        tail = self.postprocessor._clean_line(self._tail)
+        parts = self._head + [tail] if tail is not None else self._head
+        return self.postprocessor._finish("\n".join(parts).strip())
@@ -0,0 +1,150 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from config import (
+    RESPONSE_STYLES, DEFAULT_STYLE, PROMPT_TOKEN_BUDGET, PROMPT_HISTORY_TURNS,
+    PROMPT_DETAILS_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+DETAILS_HEADER = "Important personal details to remember:\n"
+HISTORY_HEADER = "Recent conversation:\n"
+
+
+def estimate_tokens(text):
+    """Rough token count: about four UTF-8 bytes per token.
+
+    Counting bytes rather than characters keeps Ge'ez script, which
+    tokenizes much more densely than Latin text, from being underestimated.
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+class PromptBuilder:
+    """Assembles Gemini prompts within a token budget.
+
+    The style sentence and the instruction block are rendered once per
+    (style, language instruction) and reused. Each user's personal-details
+    lines are cached until the details change. When a prompt would exceed
+    token_budget, the oldest history exchanges are dropped first, then the
+    oldest personal details; the instructions and the message are always kept.
+    """
+
+    def __init__(self, token_budget=PROMPT_TOKEN_BUDGET, history_turns=PROMPT_HISTORY_TURNS,
+                 details_cache_size=PROMPT_DETAILS_CACHE_SIZE):
+        self.token_budget = token_budget
+        self.history_turns = history_turns
+        self.details_cache_size = details_cache_size
+        self._static = {}  # (style, language_instruction) -> (intro, instructions, tokens)
+        self._details = OrderedDict()  # user_id -> (details snapshot, [(line, tokens), ...])
+        self._lock = threading.Lock()
+        self._section_tokens = estimate_tokens(DETAILS_HEADER) + estimate_tokens(HISTORY_HEADER)
+
+        self.details_hits = 0
+        self.details_misses = 0
+        self.trimmed_prompts = 0
+        self.dropped_exchanges = 0
+        self.dropped_details = 0
+
+    def _static_parts(self, style, language_instruction):
+        parts = self._static.get((style, language_instruction))
+        if parts is None:
+            style_description = RESPONSE_STYLES.get(style, RESPONSE_STYLES[DEFAULT_STYLE])
+            intro = f"Generate a {style_description} response to her message.\n\n"
+            instructions = (
+                f"IMPORTANT INSTRUCTIONS:\n"
+                f"1. Keep your response short and direct (1-3 sentences only)\n"
+                f"2. Don't use markdown formatting, asterisks, or bullet points\n"
+                f"3. Don't provide multiple options - just give ONE perfect response\n"
+                f"4. Write as if you ARE the boyfriend (first person)\n"
+                f"5. Don't include explanations or notes\n"
+                f"6. Don't use phrases like 'you could say' or 'here's a response'\n"
+                f"7. Use appropriate emojis naturally (1-2 emojis max) if it fits the tone\n"
+                f"8. Make the response sound natural, like a real text from a boyfriend\n"
+                f"9. Never start with 'As your boyfriend' or similar phrases\n"
+                f"10. {language_instruction}\n\n"
+            )
+            parts = (intro, instructions, estimate_tokens(intro) + estimate_tokens(instructions))
+            self._static[(style, language_instruction)] = parts
+        return parts
+
+    @staticmethod
+    def _render_details(personal_details):
+        lines = []
+        for key, value in personal_details.items():
+            line = f"- {key}: {value}\n"
+            lines.append((line, estimate_tokens(line)))
+        return lines
+
+    def _detail_lines(self, user_id, personal_details):
+        """Rendered detail lines, from the per-user cache while the details are unchanged."""
+        if user_id is None:
+            return self._render_details(personal_details)
+        snapshot = tuple(personal_details.items())
+        with self._lock:
+            cached = self._details.get(user_id)
+            if cached is not None and cached[0] == snapshot:
+                self._details.move_to_end(user_id)
+                self.details_hits += 1
+                return cached[1]
+        lines = self._render_details(personal_details)
+        with self._lock:
+            self.details_misses += 1
+            self._details[user_id] = (snapshot, lines)
+            self._details.move_to_end(user_id)
+            while len(self._details) > self.details_cache_size:
+                self._details.popitem(last=False)
+        return lines
+
+    def build(self, girlfriend_message, user_data, language_instruction, user_id=None):
+        """Return the prompt for a message, trimmed to the token budget."""
+        style = user_data.get("style", DEFAULT_STYLE)
+        girlfriend_name = user_data.get("girlfriend_name", "your girlfriend")
+        personal_details = user_data.get("personal_details", {})
+        history = user_data.get("history", [])
+
+        intro, instructions, static_tokens = self._static_parts(style, language_instruction)
+        head = f"You are helping a boyfriend respond to his girlfriend named {girlfriend_name}. "
+        tail = f"Her message: \"{girlfriend_message}\"\n\nMy response:"
+
+        details = self._detail_lines(user_id, personal_details) if personal_details else []
+        exchanges = []
+        for gf_msg, bf_resp in (history[-self.history_turns:] if self.history_turns > 0 else []):
+            text = f"Girlfriend: {gf_msg}\nBoyfriend: {bf_resp}\n\n"
+            exchanges.append((text, estimate_tokens(text)))
+
+        # Whatever the fixed parts leave over goes to details and history
+        available = (self.token_budget - static_tokens - self._section_tokens
+                     - estimate_tokens(head) - estimate_tokens(tail))
+        used = sum(tokens for _, tokens in details) + sum(tokens for _, tokens in exchanges)
+        drop_exchanges = drop_details = 0
+        while used > available and drop_exchanges < len(exchanges):
+            used -= exchanges[drop_exchanges][1]
+            drop_exchanges += 1
+        while used > available and drop_details < len(details):
+            used -= details[drop_details][1]
+            drop_details += 1
+        if drop_exchanges or drop_details:
+            self.trimmed_prompts += 1
+            self.dropped_exchanges += drop_exchanges
+            self.dropped_details += drop_details
+            logger.debug(f"Prompt over budget: dropped {drop_exchanges} exchanges and {drop_details} details")
+
+        details = details[drop_details:]
+        exchanges = exchanges[drop_exchanges:]
+        context = DETAILS_HEADER + "".join(line for line, _ in details) if details else ""
+        history_text = HISTORY_HEADER + "".join(text for text, _ in exchanges) if exchanges else ""
+
+        return f"{head}{intro}{context}\n{history_text}\n{instructions}{tail}"
+
+    def stats(self):
+        return {
+            "details_cache_size": len(self._details),
+            "details_hits": self.details_hits,
+            "details_misses": self.details_misses,
+            "trimmed_prompts": self.trimmed_prompts,
+            "dropped_exchanges": self.dropped_exchanges,
+            "dropped_details": self.dropped_details
+        }
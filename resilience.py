@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import httpx
+
+from config import (
+    GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX,
+    GEMINI_HEDGE_ENABLED, GEMINI_HEDGE_PERCENTILE, GEMINI_HEDGE_MIN_DELAY,
+    GEMINI_CIRCUIT_FAILURE_THRESHOLD, GEMINI_CIRCUIT_RESET_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GeminiUnavailable(Exception):
+    """The Gemini API failed after all retries, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=GEMINI_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=GEMINI_CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            # Open, or half-open with the trial call still out
+            self.rejected += 1
+            return False
+        # Let one trial call through; if it never reports back, another after reset_timeout
+        self.state = self.HALF_OPEN
+        self.opened_at = time.monotonic()
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Gemini circuit breaker opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+class ResilientCaller:
+    """Runs an HTTP call with timeouts handled as failures, jittered
+    exponential backoff on 429/5xx, optional hedging and a circuit breaker."""
+
+    def __init__(self, max_retries=GEMINI_MAX_RETRIES, backoff_base=GEMINI_BACKOFF_BASE,
+                 backoff_max=GEMINI_BACKOFF_MAX, hedge=GEMINI_HEDGE_ENABLED,
+                 hedge_percentile=GEMINI_HEDGE_PERCENTILE, hedge_min_delay=GEMINI_HEDGE_MIN_DELAY,
+                 breaker=None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.latency = LatencyTracker()
+
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def _backoff(self, attempt, response=None):
+        """Full-jitter exponential backoff, honoring Retry-After when the API sends it."""
+        if response is not None and response.headers.get("Retry-After"):
+            try:
+                return min(self.backoff_max, float(response.headers["Retry-After"]))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _hedge_delay(self):
+        if not self.hedge or len(self.latency.samples) < 20:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    async def _send_timed(self, send):
+        start = time.monotonic()
+        response = await send()
+        self.latency.record(time.monotonic() - start)
+        return response
+
+    async def _send(self, send):
+        """Send once, firing a hedged duplicate if the first is slower than the hedge delay."""
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._send_timed(send)
+
+        primary = asyncio.ensure_future(self._send_timed(send))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedged = asyncio.ensure_future(self._send_timed(send))
+        pending = {primary, hedged}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS:
+                        if task is hedged:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both finished badly, surface the primary's outcome
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, send):
+        """Await send() (a coroutine factory returning an httpx.Response) resiliently.
+
+        Raises GeminiUnavailable when the breaker is open or all attempts fail.
+        Non-retryable responses (e.g. 400) are returned to the caller as-is.
+        """
+        if not self.breaker.allow():
+            raise GeminiUnavailable("circuit breaker is open")
+
+        self.calls += 1
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self._send(send)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                last_error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+                last_error = f"HTTP {response.status_code}"
+
+            self.breaker.record_failure()
+            if attempt == self.max_retries or self.breaker.state == CircuitBreaker.OPEN:
+                break
+            self.retries += 1
+            delay = self._backoff(attempt, response)
+            logger.warning(f"Gemini call failed ({last_error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        self.failures += 1
+        raise GeminiUnavailable(last_error or "circuit breaker is open")
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "circuit_state": self.breaker.state,
+            "circuit_rejected": self.breaker.rejected,
+            "p95_latency": self.latency.percentile(95)
+        }
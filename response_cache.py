@@ -0,0 +1,102 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from config import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(text):
+    """Lowercase and collapse whitespace so trivially different inputs share a key."""
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+
+def personal_context_digest(user_data):
+    """Digest of everything personal that goes into the prompt besides history."""
+    details = user_data.get("personal_details", {})
+    parts = [user_data.get("girlfriend_name", "")]
+    parts.extend(f"{key}={value}" for key, value in sorted(details.items()))
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def make_cache_key(message, style, language_mode, user_data):
+    return (normalize_message(message), style, language_mode, personal_context_digest(user_data))
+
+
+class ResponseCache:
+    """LRU cache of generated responses with a TTL and entry/memory limits."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, response, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _entry_size(key, response):
+        # Approximate payload size; good enough to bound memory
+        return len(key[0].encode("utf-8")) + len(response.encode("utf-8")) + 128
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, response, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        size = self._entry_size(key, response)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, response, size)
+            self.current_bytes += size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
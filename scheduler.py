@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from config import (
+    GEMINI_MAX_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_RATE_BURST, GEMINI_MAX_QUEUE
+)
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerOverloaded(Exception):
+    """Raised instead of queueing when too many requests are already waiting."""
+
+
+class GeminiScheduler:
+    """Admission control for outbound Gemini calls.
+
+    Caps how many calls are in flight, spends tokens from a bucket sized to
+    the API quota, and serves waiting users round-robin so one chatty user
+    can't starve the others. When max_queue requests are already waiting,
+    new ones fail fast with SchedulerOverloaded.
+    """
+
+    def __init__(self, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_RATE_BURST,
+                 max_queue=GEMINI_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self._queues = OrderedDict()  # user_id -> deque of waiting futures, in round-robin order
+        self._waiting = 0
+        self._active = 0
+        self._timer = None
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self):
+        return self._waiting
+
+    @property
+    def active(self):
+        return self._active
+
+    async def run(self, user_id, work):
+        """Wait for a slot, then await work(). Raises SchedulerOverloaded if the queue is full."""
+        async with self.slot(user_id):
+            return await work()
+
+    @asynccontextmanager
+    async def slot(self, user_id):
+        """Hold one in-flight slot for the body of the block (e.g. a whole streamed reply)."""
+        await self._acquire(user_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, user_id):
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerOverloaded(f"{self._waiting} Gemini requests already waiting")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self._waiting += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+        queued_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as we were cancelled, hand it back
+                self._release()
+            else:
+                self._discard(user_id, future)
+            raise
+
+        wait = time.monotonic() - queued_at
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def _discard(self, user_id, future):
+        queue = self._queues.get(user_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[user_id]
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant slots to waiting users, round-robin, while capacity and tokens allow."""
+        while self._queues and self._active < self.max_concurrency:
+            wait = self.bucket.time_until_available()
+            if wait > 0:
+                self._schedule_retry(wait)
+                return
+            user_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(user_id)  # back of the line for this user's next request
+            else:
+                del self._queues[user_id]
+            if future.done():
+                continue
+            self.bucket.try_acquire()
+            self._active += 1
+            future.set_result(None)
+
+    def _schedule_retry(self, delay):
+        if self._timer is not None:
+            return
+
+        def retry():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, retry)
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait
+        }
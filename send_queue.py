@@ -0,0 +1,238 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE_PER_MINUTE, TELEGRAM_MAX_RETRIES
+)
+from metrics import TELEGRAM_QUEUE_SECONDS, record_stage
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Priorities, most urgent first
+ANSWER, REPLY, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = ("answer", "reply", "background")
+
+ANSWER_ENDPOINTS = ("answerInlineQuery", "answerCallbackQuery")
+EDIT_ENDPOINTS = ("editMessageText", "editMessageCaption", "editMessageReplyMarkup")
+
+
+class _Waiting:
+    __slots__ = ("chat_id", "edit_key", "future", "queued_at")
+
+    def __init__(self, chat_id, edit_key, future):
+        self.chat_id = chat_id
+        self.edit_key = edit_key
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class TelegramSendQueue(BaseRateLimiter):
+    """Outbound dispatcher for the Bot API calls every handler makes.
+
+    Messages, edits and answers spend a token from a global bucket, and
+    messages and edits also one from their chat's bucket, so bursts queue
+    here instead of collecting 429s. Waiting calls go out by priority
+    (inline/callback answers, then replies and final edits, then streaming
+    edits), FIFO within a priority; a chat that is out of tokens doesn't
+    hold up other chats. The calling handler waits for its turn; updates
+    are dispatched per user (PerUserUpdateProcessor), so a throttled chat
+    holds up only its own updates. A newer edit of a message replaces one
+    still waiting. A RetryAfter pauses all sending for as long as Telegram
+    asks, then the call is retried.
+
+    Pass rate_limit_args={"priority": ...} to a bot method to override the
+    priority. Other calls (getMe, setWebhook, ...) aren't queued.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, global_burst=TELEGRAM_GLOBAL_BURST,
+                 chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST,
+                 group_rate_per_minute=TELEGRAM_GROUP_RATE_PER_MINUTE, max_retries=TELEGRAM_MAX_RETRIES,
+                 max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60.0
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> TokenBucket, least recently used first
+        self._waiting = [deque() for _ in PRIORITY_NAMES]
+        self._pending_edits = {}  # edit key -> its waiting entry
+        self._edits_in_flight = set()
+        self._paused_until = 0.0
+        self._timer = None
+
+        # Metrics
+        self.queued = 0
+        self.sent = 0
+        self.superseded = 0
+        self.retry_afters = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @staticmethod
+    def _priority(endpoint, data, rate_limit_args):
+        if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+            return rate_limit_args["priority"]
+        if endpoint in ANSWER_ENDPOINTS:
+            return ANSWER
+        if endpoint in EDIT_ENDPOINTS and data.get("reply_markup") is None:
+            # Partial edits while a reply streams in; the final edit carries the buttons
+            return BACKGROUND
+        return REPLY
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Private chats have positive IDs; groups and channels get the stricter rate
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, 1)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None and endpoint not in ANSWER_ENDPOINTS and not data.get("inline_message_id"):
+            return await callback(*args, **kwargs)
+
+        priority = self._priority(endpoint, data, rate_limit_args)
+        edit_key = None
+        if endpoint in EDIT_ENDPOINTS:
+            edit_key = (chat_id, data.get("message_id"), data.get("inline_message_id"))
+
+        for attempt in range(self.max_retries + 1):
+            entry = self._enqueue(priority, chat_id, edit_key)
+            try:
+                go = await entry.future
+            except asyncio.CancelledError:
+                if entry.future.done() and not entry.future.cancelled() and entry.future.result():
+                    self._finish(edit_key)
+                raise
+            wait = time.monotonic() - entry.queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            TELEGRAM_QUEUE_SECONDS.observe(wait, endpoint, PRIORITY_NAMES[min(priority, BACKGROUND)])
+            record_stage("telegram_queue", wait)
+            if not go:
+                # A newer edit of the same message replaced this one
+                self.superseded += 1
+                return True
+
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self.retry_afters += 1
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Telegram flood control on {endpoint}, pausing sends for {retry_after}s")
+            finally:
+                self._finish(edit_key)
+
+    def _enqueue(self, priority, chat_id, edit_key):
+        entry = _Waiting(chat_id, edit_key, asyncio.get_running_loop().create_future())
+        if edit_key is not None:
+            older = self._pending_edits.get(edit_key)
+            if older is not None and not older.future.done():
+                older.future.set_result(False)
+            self._pending_edits[edit_key] = entry
+        self._waiting[min(priority, BACKGROUND)].append(entry)
+        self.queued += 1
+        self._dispatch()
+        return entry
+
+    def _finish(self, edit_key):
+        if edit_key is not None:
+            self._edits_in_flight.discard(edit_key)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Release waiting calls, most urgent first, while the buckets allow."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._schedule(self._paused_until - now)
+            return
+        delay = None
+        for waiting in self._waiting:
+            remaining = deque()
+            while waiting:
+                entry = waiting.popleft()
+                if entry.future.done():
+                    continue  # Superseded or cancelled
+                if entry.edit_key in self._edits_in_flight:
+                    remaining.append(entry)  # The previous edit of this message goes first
+                    continue
+                wait = self.global_bucket.time_until_available()
+                if entry.chat_id is not None:
+                    wait = max(wait, self._chat_bucket(entry.chat_id).time_until_available())
+                if wait > 0:
+                    remaining.append(entry)
+                    delay = wait if delay is None else min(delay, wait)
+                    continue
+                self.global_bucket.try_acquire()
+                if entry.chat_id is not None:
+                    self._chat_bucket(entry.chat_id).try_acquire()
+                if entry.edit_key is not None:
+                    self._edits_in_flight.add(entry.edit_key)
+                    if self._pending_edits.get(entry.edit_key) is entry:
+                        del self._pending_edits[entry.edit_key]
+                entry.future.set_result(True)
+            waiting.extend(remaining)
+        if delay is not None:
+            self._schedule(delay)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            if self._timer.when() <= asyncio.get_running_loop().time() + delay:
+                return
+            self._timer.cancel()
+
+        def retry():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, retry)
+
+    @property
+    def queue_depth(self):
+        return sum(len(waiting) for waiting in self._waiting)
+
+    def stats(self):
+        released = self.sent + self.superseded + self.retry_afters
+        return {
+            "queue_depth": self.queue_depth,
+            "queued": self.queued,
+            "sent": self.sent,
+            "superseded_edits": self.superseded,
+            "retry_afters": self.retry_afters,
+            "paused": time.monotonic() < self._paused_until,
+            "avg_wait": self.total_wait / released if released else 0.0,
+            "max_wait": self.max_wait,
+            "chats": len(self._chats)
+        }
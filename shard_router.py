@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+
+from config import (
+    WEB_WORKERS, WORKER_METRICS_INTERVAL, UPDATE_QUEUE_SIZE, UPDATE_DEDUP_WINDOW, SQLITE_DB_FILE,
+    GEMINI_MAX_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE, GEMINI_RATE_BURST
+)
+from metrics import REGISTRY
+from update_queue import UpdateQueue
+
+try:
+    import fcntl
+except ImportError:  # No advisory file locks (Windows); shards are then unguarded
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Updates a shard worker takes off its queue per executor round-trip
+DRAIN_BATCH = 64
+
+
+def shard_key(update_json):
+    """The user an update belongs to: its sender, else its chat, else the update_id.
+
+    Matches PerUserUpdateProcessor's effective_user / effective_chat order.
+    """
+    for value in update_json.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            owner = value.get(field)
+            if isinstance(owner, dict) and isinstance(owner.get("id"), int):
+                return owner["id"]
+    return update_json["update_id"]
+
+
+def shard_for(key, shards):
+    """Shard index for a user; stable across processes, unlike hash()."""
+    return key % shards
+
+
+class ShardRouter(UpdateQueue):
+    """Routes webhook updates to worker processes by user.
+
+    Each worker process runs the full bot for the users of one shard
+    (user_id % workers), so a user's state lives in exactly one process: its
+    caches stay coherent, and the worker's PerUserUpdateProcessor keeps each
+    user's updates in order. Workers share the SQLite store. Each holds an
+    exclusive lock on its shard's lock file, so two processes never own the
+    same users at once (e.g. while an old instance is still shutting down).
+    Workers send their metrics every WORKER_METRICS_INTERVAL seconds; the
+    latest from each is rendered on this process's /metrics with a worker
+    label.
+    """
+
+    def __init__(self, workers=WEB_WORKERS, maxsize=UPDATE_QUEUE_SIZE, dedup_window=UPDATE_DEDUP_WINDOW):
+        super().__init__(None, maxsize=maxsize, dedup_window=dedup_window)
+        self.worker_count = workers
+        self._queues = []
+        self._processes = []
+        self._ready = []
+        self._metrics = None
+        self._metrics_thread = None
+        self.routed = [0] * workers
+
+    def start(self):
+        """Start one worker process per shard."""
+        context = multiprocessing.get_context("spawn")
+        self._metrics = context.Queue(self.worker_count * 4)
+        for index in range(self.worker_count):
+            updates = context.Queue(self.maxsize)
+            ready = context.Event()
+            process = context.Process(target=run_shard_worker,
+                                      args=(index, self.worker_count, updates, ready, self._metrics),
+                                      name=f"shard-worker-{index}")
+            process.start()
+            self._queues.append(updates)
+            self._ready.append(ready)
+            self._processes.append(process)
+        self._metrics_thread = threading.Thread(target=self._receive_metrics, name="shard-metrics", daemon=True)
+        self._metrics_thread.start()
+        logger.info(f"Started {self.worker_count} shard worker processes")
+
+    async def ready(self, timeout=60.0):
+        """Wait until every worker has its bot initialized."""
+        for index, ready in enumerate(self._ready):
+            if not await asyncio.to_thread(ready.wait, timeout):
+                logger.warning(f"Shard worker {index} is not ready after {timeout:.0f}s")
+
+    async def stop(self, timeout=10.0):
+        """Let each worker finish its queued updates (up to timeout seconds), then stop it."""
+        if not self.started:
+            return
+        for updates in self._queues:
+            await asyncio.to_thread(updates.put, None)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating it")
+                process.terminate()
+        self._metrics.put(None)
+        await asyncio.to_thread(self._metrics_thread.join, timeout)
+        self._queues = []
+        self._processes = []
+        self._ready = []
+
+    @property
+    def started(self):
+        return bool(self._queues)
+
+    def _receive_metrics(self):
+        """Hand each worker's metrics to REGISTRY as they arrive, until None."""
+        while True:
+            message = self._metrics.get()
+            if message is None:
+                return
+            index, snapshot = message
+            REGISTRY.set_remote(str(index), snapshot)
+
+    def _enqueue(self, update_json):
+        shard = shard_for(shard_key(update_json), self.worker_count)
+        self._queues[shard].put_nowait(update_json)
+        self.routed[shard] += 1
+
+    @property
+    def depth(self):
+        try:
+            return sum(updates.qsize() for updates in self._queues)
+        except NotImplementedError:  # macOS has no sem_getvalue
+            return 0
+
+    def stats(self):
+        return {
+            "workers": self.worker_count,
+            "workers_alive": sum(process.is_alive() for process in self._processes),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "routed": sum(self.routed),
+            "max_shard_routed": max(self.routed, default=0),
+            "queue_depth": self.depth
+        }
+
+
+def _lock_shard(index, count):
+    """Take this shard's lock file, waiting while another process still holds it."""
+    if fcntl is None:
+        return None
+    lock_file = open(f"{SQLITE_DB_FILE}.shard-{index}-of-{count}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.warning(f"Shard {index} is still owned by another process, waiting for it")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def run_shard_worker(index, count, updates, ready, metrics):
+    """Worker process entry point: run the bot for one shard until None arrives."""
+    from log_setup import configure_logging
+    configure_logging()
+    lock_file = _lock_shard(index, count)
+    try:
+        asyncio.run(_serve_shard(index, count, updates, ready, metrics))
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+
+def _shard_scheduler(count):
+    """A GeminiScheduler with this worker's share of the API quota and concurrency."""
+    from scheduler import GeminiScheduler
+    return GeminiScheduler(max_concurrency=max(1, GEMINI_MAX_CONCURRENCY // count),
+                           requests_per_minute=GEMINI_REQUESTS_PER_MINUTE / count,
+                           burst=max(1, GEMINI_RATE_BURST // count))
+
+
+async def _push_metrics(index, metrics):
+    """Send this worker's metrics to the router every WORKER_METRICS_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(WORKER_METRICS_INTERVAL)
+        try:
+            metrics.put_nowait((index, REGISTRY.snapshot()))
+        except queue.Full:
+            pass  # The router is behind; the next push is as good
+
+
+async def _serve_shard(index, count, updates, ready, metrics):
+    # Imported here so only worker processes build bot services
+    from telegram import Update
+    from ai_handler import AIHandler
+    from main import create_application, register_metrics
+    from update_processor import PerUserUpdateProcessor
+
+    processor = PerUserUpdateProcessor()
+    application = create_application(ai_handler=AIHandler(scheduler=_shard_scheduler(count)),
+                                     update_processor=processor)
+    loop = asyncio.get_running_loop()
+    # Admit no more than the processor's own limit, so updates reach it in arrival order
+    slots = asyncio.Semaphore(processor.max_concurrent_updates)
+    in_flight = set()
+
+    def done(task):
+        in_flight.discard(task)
+        slots.release()
+
+    register_metrics(application)
+    pusher = asyncio.create_task(_push_metrics(index, metrics))
+
+    async with application:
+        logger.info(f"Shard worker {index} of {count} ready")
+        ready.set()
+        running = True
+        while running:
+            batch = [await loop.run_in_executor(None, updates.get)]
+            try:
+                while len(batch) < DRAIN_BATCH:
+                    batch.append(updates.get_nowait())
+            except queue.Empty:
+                pass
+            for update_json in batch:
+                if update_json is None:
+                    running = False
+                    break
+                try:
+                    update = Update.de_json(update_json, application.bot)
+                except Exception as e:
+                    logger.error(f"Error decoding update {update_json.get('update_id')}: {e}")
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(processor.process_update(update, application.process_update(update)))
+                in_flight.add(task)
+                task.add_done_callback(done)
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        pusher.cancel()
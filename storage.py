@@ -0,0 +1,451 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from config import (
+    STORAGE_BACKEND, USER_DATA_FILE, SQLITE_DB_FILE,
+    WRITE_BEHIND, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_DIRTY
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _snapshot_user(user):
+    """Copy a user record so it can be serialized while handlers keep mutating it."""
+    return {
+        "style": user.get("style", "romantic"),
+        "history": [list(pair) for pair in list(user.get("history", []))],
+        "girlfriend_name": user.get("girlfriend_name", ""),
+        "personal_details": dict(user.get("personal_details", {}))
+    }
+
+
+class StorageBackend:
+    """Interface for persisting user records behind UserManager.
+
+    A user record has "style", "girlfriend_name", "history" (a list of
+    [message, response] pairs) and "personal_details". Backends load plain
+    dicts; UserManager hands back UserRecords, which read the same way.
+    """
+
+    def load_all(self):
+        """Return a dict of every stored user, keyed by user_id."""
+        raise NotImplementedError
+
+    def load_user(self, user_id):
+        """Return a single user record, or None if the user isn't stored."""
+        raise NotImplementedError
+
+    def track_user(self, user_id, user):
+        """Note the live record UserManager holds for a user it just loaded.
+
+        Backends that write from memory keep a reference so later in-place
+        changes are persisted.
+        """
+
+    def evict_user(self, user_id, user):
+        """Called when UserManager drops a user from memory.
+
+        Write any unsaved changes now and release cached references.
+        """
+
+    def save_user(self, user_id, user):
+        """Write the scalar fields (style, girlfriend name) of one user."""
+        raise NotImplementedError
+
+    def append_history(self, user_id, message_pair, max_length):
+        """Append a message pair and keep only the last max_length entries."""
+        raise NotImplementedError
+
+    def set_personal_detail(self, user_id, key, value):
+        """Add or replace one personal detail of a user."""
+        raise NotImplementedError
+
+    def write_users(self, users):
+        """Write complete records for several users in one batch."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JSONStorage(StorageBackend):
+    """Stores every user in one JSON file, rewritten on each change.
+
+    Fine for small installs; every write costs O(total users).
+    """
+
+    def __init__(self, data_file=USER_DATA_FILE):
+        self.data_file = data_file
+        self.users = None  # whole file, read on first use
+
+    def load_all(self):
+        self.users = {}
+        if os.path.exists(self.data_file):
+            with open(self.data_file, 'r') as f:
+                self.users = json.load(f)
+        return self.users
+
+    def _all_users(self):
+        if self.users is None:
+            self.load_all()
+        return self.users
+
+    def load_user(self, user_id):
+        return self._all_users().get(str(user_id))
+
+    def track_user(self, user_id, user):
+        # The file is rewritten from memory, so every user stays here even after eviction
+        self._all_users()[str(user_id)] = user
+
+    def _save_data(self):
+        # Write to a temp file and rename so a crash never leaves a truncated file
+        snapshot = {user_id: _snapshot_user(user) for user_id, user in list(self._all_users().items())}
+        directory = os.path.dirname(os.path.abspath(self.data_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".user_data.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.data_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save_user(self, user_id, user):
+        self._all_users()[str(user_id)] = user
+        self._save_data()
+
+    def append_history(self, user_id, message_pair, max_length):
+        # The caller has already updated the shared record in place
+        self._save_data()
+
+    def set_personal_detail(self, user_id, key, value):
+        self._save_data()
+
+    def write_users(self, users):
+        self._all_users().update(users)
+        self._save_data()
+
+
+class SQLiteStorage(StorageBackend):
+    """Stores users in SQLite (WAL mode), touching only the affected rows."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            style TEXT NOT NULL,
+            girlfriend_name TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            response TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_user ON history (user_id, id);
+        CREATE TABLE IF NOT EXISTS personal_details (
+            user_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (user_id, key)
+        );
+    """
+
+    def __init__(self, db_file=SQLITE_DB_FILE):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def load_all(self):
+        users = {}
+        with self._lock:
+            for user_id, style, name in self.conn.execute(
+                    "SELECT user_id, style, girlfriend_name FROM users"):
+                users[user_id] = {
+                    "style": style,
+                    "history": [],
+                    "girlfriend_name": name,
+                    "personal_details": {}
+                }
+            for user_id, message, response in self.conn.execute(
+                    "SELECT user_id, message, response FROM history ORDER BY id"):
+                if user_id in users:
+                    users[user_id]["history"].append([message, response])
+            for user_id, key, value in self.conn.execute(
+                    "SELECT user_id, key, value FROM personal_details"):
+                if user_id in users:
+                    users[user_id]["personal_details"][key] = value
+        return users
+
+    def load_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT style, girlfriend_name FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            history = [list(pair) for pair in self.conn.execute(
+                "SELECT message, response FROM history WHERE user_id = ? ORDER BY id", (user_id,))]
+            details = dict(self.conn.execute(
+                "SELECT key, value FROM personal_details WHERE user_id = ?", (user_id,)))
+        return {
+            "style": row[0],
+            "history": history,
+            "girlfriend_name": row[1],
+            "personal_details": details
+        }
+
+    def save_user(self, user_id, user):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO users (user_id, style, girlfriend_name) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET style = excluded.style, "
+                "girlfriend_name = excluded.girlfriend_name",
+                (str(user_id), user["style"], user["girlfriend_name"])
+            )
+
+    def append_history(self, user_id, message_pair, max_length):
+        user_id = str(user_id)
+        message, response = message_pair
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO history (user_id, message, response) VALUES (?, ?, ?)",
+                (user_id, message, response)
+            )
+            self.conn.execute(
+                "DELETE FROM history WHERE user_id = ? AND id NOT IN "
+                "(SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, max_length)
+            )
+
+    def set_personal_detail(self, user_id, key, value):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO personal_details (user_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value",
+                (str(user_id), key, value)
+            )
+
+    def write_users(self, users):
+        with self._lock, self.conn:
+            for user_id, user in users.items():
+                self._replace_user(str(user_id), _snapshot_user(user))
+
+    def _replace_user(self, user_id, user):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, style, girlfriend_name) VALUES (?, ?, ?)",
+            (user_id, user["style"], user["girlfriend_name"])
+        )
+        self.conn.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+        self.conn.executemany(
+            "INSERT INTO history (user_id, message, response) VALUES (?, ?, ?)",
+            [(user_id, message, response) for message, response in user["history"]]
+        )
+        self.conn.execute("DELETE FROM personal_details WHERE user_id = ?", (user_id,))
+        self.conn.executemany(
+            "INSERT INTO personal_details (user_id, key, value) VALUES (?, ?, ?)",
+            [(user_id, key, value) for key, value in user["personal_details"].items()]
+        )
+
+    def import_json(self, json_file):
+        """One-shot import of an existing user_data.json file. Returns the user count."""
+        with open(json_file, 'r') as f:
+            users = json.load(f)
+
+        self.write_users(users)
+        logger.info(f"Imported {len(users)} users from {json_file} into {self.db_file}")
+        return len(users)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class WriteBehindStorage(StorageBackend):
+    """Wraps another backend and batches its writes in a background thread.
+
+    Changes only mark the user dirty. Dirty users are written in one batch
+    every flush_interval seconds, or sooner once max_dirty users are pending,
+    so repeated writes to the same user between flushes coalesce into one.
+    A dirty user evicted from UserManager stays pending until that flush
+    rather than being written on eviction. close() performs a final flush
+    and also runs at interpreter exit.
+    """
+
+    def __init__(self, backend, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_dirty=WRITE_BEHIND_MAX_DIRTY):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.users = {}
+        self._dirty = set()
+        self._evicted = set()  # Dirty users evicted since the last flush, dropped once written
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        # Counters for tuning the flush interval
+        self.evicted_writes = 0
+        self.writes = 0
+        self.coalesced_writes = 0
+        self.flushes = 0
+        self.flushed_users = 0
+        self.last_flush_duration = 0.0
+        self.total_flush_duration = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def load_all(self):
+        self.users = self.backend.load_all()
+        return self.users
+
+    def load_user(self, user_id):
+        user = self.users.get(str(user_id))
+        return user if user is not None else self.backend.load_user(user_id)
+
+    def track_user(self, user_id, user):
+        with self._lock:
+            self.users[str(user_id)] = user
+            self._evicted.discard(str(user_id))
+        self.backend.track_user(user_id, user)
+
+    def evict_user(self, user_id, user):
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._dirty:
+                # Written with the next flush, which then releases it
+                self.users[user_id] = user
+                self._evicted.add(user_id)
+                return
+            self.users.pop(user_id, None)
+        self.backend.evict_user(user_id, user)
+
+    def _mark_dirty(self, user_id, user=None):
+        user_id = str(user_id)
+        with self._lock:
+            if user is not None:
+                self.users[user_id] = user
+            self.writes += 1
+            if user_id in self._dirty:
+                self.coalesced_writes += 1
+            else:
+                self._dirty.add(user_id)
+            if len(self._dirty) >= self.max_dirty:
+                self._wakeup.set()
+
+    def save_user(self, user_id, user):
+        self._mark_dirty(user_id, user)
+
+    def append_history(self, user_id, message_pair, max_length):
+        self._mark_dirty(user_id)
+
+    def set_personal_detail(self, user_id, key, value):
+        self._mark_dirty(user_id)
+
+    def write_users(self, users):
+        for user_id, user in users.items():
+            self._mark_dirty(user_id, user)
+
+    def flush(self):
+        """Write every dirty user to the wrapped backend now."""
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return 0
+
+            start = time.perf_counter()
+            with self._lock:
+                batch = {user_id: self.users[user_id] for user_id in dirty if user_id in self.users}
+            try:
+                self.backend.write_users(batch)
+            except Exception as e:
+                # Keep the users dirty so the next flush retries them
+                logger.error(f"Write-behind flush of {len(batch)} users failed: {e}")
+                with self._lock:
+                    self._dirty.update(dirty)
+                return 0
+
+            with self._lock:
+                # Evicted users not changed again since this batch was taken
+                released = {user_id: self.users.pop(user_id) for user_id in batch
+                            if user_id in self._evicted and user_id not in self._dirty}
+                self._evicted.difference_update(released)
+            for user_id, user in released.items():
+                self.backend.evict_user(user_id, user)
+            self.evicted_writes += len(released)
+
+            duration = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed_users += len(batch)
+            self.last_flush_duration = duration
+            self.total_flush_duration += duration
+            return len(batch)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._closed:
+                self.flush()
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "evicted_writes": self.evicted_writes,
+            "coalesced_writes": self.coalesced_writes,
+            "flushes": self.flushes,
+            "flushed_users": self.flushed_users,
+            "dirty_users": len(self._dirty),
+            "last_flush_duration": self.last_flush_duration,
+            "avg_flush_duration": self.total_flush_duration / self.flushes if self.flushes else 0.0
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self.backend.close()
+        atexit.unregister(self.close)
+
+
+def create_storage(backend=STORAGE_BACKEND, write_behind=WRITE_BEHIND):
+    """Create the storage backend selected in config."""
+    if backend == "sqlite":
+        storage = SQLiteStorage(SQLITE_DB_FILE)
+    elif backend == "json":
+        storage = JSONStorage(USER_DATA_FILE)
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if write_behind:
+        storage = WriteBehindStorage(storage)
+    return storage
+
+
+if __name__ == '__main__':
+    # Usage: python storage.py import [user_data.json] [user_data.db]
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: python storage.py import [json_file] [db_file]")
+        sys.exit(1)
+    json_file = sys.argv[2] if len(sys.argv) > 2 else USER_DATA_FILE
+    db_file = sys.argv[3] if len(sys.argv) > 3 else SQLITE_DB_FILE
+    storage = SQLiteStorage(db_file)
+    count = storage.import_json(json_file)
+    storage.close()
+    print(f"Imported {count} users into {db_file}")
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import POLLING_CONCURRENT_UPDATES, POLLING_MAX_PENDING_UPDATES
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Concurrent update processing that keeps each user's updates in order.
+
+    Updates from different users run concurrently, at most `concurrency` at
+    a time; a user's updates run one after another in arrival order, so
+    history is never updated out of order. Inline queries skip the per-user
+    order and the running limit: they don't touch history, the inline
+    debouncer needs a newer query to be able to cancel the one in flight,
+    and they spend most of their time in its quiet period (their Gemini
+    calls are limited by the scheduler).
+
+    max_pending bounds the updates admitted at once (running or waiting for
+    their user); it's python-telegram-bot's own limit, applied before ours.
+    """
+
+    def __init__(self, concurrency=POLLING_CONCURRENT_UPDATES, max_pending=POLLING_MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending, concurrency, 2))  # > 1 turns on concurrent fetching
+        self.concurrency = concurrency
+        self._running = asyncio.BoundedSemaphore(concurrency)
+        self._users = {}  # user key -> [lock, updates holding or waiting for it]
+        self.running = 0
+        self.processed = 0
+        self.waited_for_user = 0
+
+    @staticmethod
+    def _user_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        if isinstance(update, Update) and update.inline_query is not None:
+            await self._run(coroutine)
+            return
+
+        key = self._user_key(update)
+        if key is None:
+            async with self._running:
+                await self._run(coroutine)
+            return
+
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        elif entry[0].locked():
+            self.waited_for_user += 1
+        entry[1] += 1
+        try:
+            # Take the user's turn before a running slot, so a user with a
+            # backlog doesn't tie up slots other users could run in
+            async with entry[0], self._running:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._users[key]
+
+    async def _run(self, coroutine):
+        self.running += 1
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "pending": self.current_concurrent_updates,
+            "users_in_flight": len(self._users),
+            "processed": self.processed,
+            "waited_for_user": self.waited_for_user
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import queue
+import time
+from collections import OrderedDict
+
+from telegram import Update
+
+from config import UPDATE_QUEUE_SIZE, UPDATE_DEDUP_WINDOW
+from metrics import stage, record_stage
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+QUEUE_FULL = "queue_full"
+
+
+class UpdateQueue:
+    """Bounded in-process queue between the webhook route and the bot handlers.
+
+    The webhook only validates and enqueues, so Telegram gets its 200 right
+    away. A dispatcher task hands each update, in arrival order, to the
+    application's update processor (a PerUserUpdateProcessor) as a task of
+    its own, admitting as many as the processor accepts; the processor
+    bounds how many run and keeps each user's updates in order. Updates
+    waiting on their user or in the inline debouncer hold no worker, so they
+    never stall other users. Update IDs seen recently are remembered so
+    Telegram's redeliveries are dropped.
+    """
+
+    def __init__(self, application, maxsize=UPDATE_QUEUE_SIZE, dedup_window=UPDATE_DEDUP_WINDOW):
+        self.application = application
+        self.maxsize = maxsize
+        self.dedup_window = dedup_window
+        self._queue = None
+        self._dispatcher = None
+        self._in_flight = set()
+        self._seen = OrderedDict()  # recent update_ids, oldest first
+
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_processing_time = 0.0
+
+    def start(self):
+        """Start the dispatcher task on the running event loop."""
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="update-dispatcher")
+        processor = self.application.update_processor
+        logger.info(f"Dispatching updates to {type(processor).__name__} "
+                    f"(up to {processor.max_concurrent_updates} at once)")
+
+    async def ready(self):
+        """Wait until updates can be processed; the dispatcher is ready once started."""
+
+    async def stop(self, timeout=10.0):
+        """Let queued and running updates finish (up to timeout seconds), then stop."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping with {self._queue.qsize()} updates still queued "
+                           f"and {len(self._in_flight)} running")
+        tasks = [self._dispatcher, *self._in_flight]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+
+    def submit(self, update_json):
+        """Validate and enqueue an update. Returns ACCEPTED, DUPLICATE, INVALID or QUEUE_FULL."""
+        if not isinstance(update_json, dict) or not isinstance(update_json.get("update_id"), int):
+            return INVALID
+        self.received += 1
+
+        if not self.started:
+            # Workers not started yet; Telegram will redeliver
+            self.rejected += 1
+            return QUEUE_FULL
+
+        update_id = update_json["update_id"]
+        if update_id in self._seen:
+            self.duplicates += 1
+            return DUPLICATE
+
+        try:
+            self._enqueue(update_json)
+        except (asyncio.QueueFull, queue.Full):
+            # Not marked as seen, so Telegram's retry gets another chance
+            self.rejected += 1
+            return QUEUE_FULL
+
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_window:
+            self._seen.popitem(last=False)
+        return ACCEPTED
+
+    @property
+    def started(self):
+        return self._queue is not None
+
+    def _enqueue(self, update_json):
+        """Hand the update to the dispatcher; raises QueueFull if there's no room."""
+        self._queue.put_nowait((update_json, time.monotonic()))
+
+    async def _dispatch(self):
+        processor = self.application.update_processor
+        # Admit no more than the processor's own limit, so updates reach it in arrival order
+        slots = asyncio.Semaphore(processor.max_concurrent_updates)
+        while True:
+            job = await self._queue.get()
+            await slots.acquire()
+            task = asyncio.create_task(self._process(processor, *job))
+            self._in_flight.add(task)
+            task.add_done_callback(lambda task: (self._in_flight.discard(task), slots.release()))
+
+    async def _process(self, processor, update_json, enqueued_at):
+        try:
+            with stage("decode", handler="update"):
+                update = Update.de_json(update_json, self.application.bot)
+            await processor.process_update(update, self.application.process_update(update))
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing update {update_json.get('update_id')}: {e}")
+        finally:
+            elapsed = time.monotonic() - enqueued_at
+            self.total_processing_time += elapsed
+            record_stage("time_in_system", elapsed, handler="update")
+            self._queue.task_done()
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        done = self.processed + self.failed
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_depth": self.depth,
+            "running": len(self._in_flight),
+            "avg_time_in_system": self.total_processing_time / done if done else 0.0
+        }
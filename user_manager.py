@@ -1,62 +1,98 @@
-import json
-import os
+import time
+from collections import OrderedDict
+
+from config import MAX_HISTORY_LENGTH, USER_DATA_FILE, USER_CACHE_SIZE
+from storage import JSONStorage
+from user_record import UserRecord
 
 class UserManager:
-    def __init__(self, data_file="user_data.json"):
+    def __init__(self, data_file=USER_DATA_FILE, storage=None, max_resident=USER_CACHE_SIZE):
         self.data_file = data_file
-        self.users = self._load_data()
-    
-    def _load_data(self):
-        if os.path.exists(self.data_file):
-            with open(self.data_file, 'r') as f:
-                return json.load(f)
-        return {}
+        # JSON file storage stays the default for small installs
+        self.storage = storage if storage is not None else JSONStorage(data_file)
+        self.max_resident = max_resident
+        # Working set of active users, least recently used first; the rest load on demand
+        self.users = OrderedDict()
+        
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_load_time = 0.0
+        self.max_load_time = 0.0
     
-    def _save_data(self):
-        with open(self.data_file, 'w') as f:
-            json.dump(self.users, f)
+    def _load_user(self, user_id):
+        start = time.perf_counter()
+        data = self.storage.load_user(user_id)
+        if data is None:
+            user = UserRecord()
+            self.storage.save_user(user_id, user)
+        else:
+            user = UserRecord.from_dict(data)
+            self.storage.track_user(user_id, user)
+        elapsed = time.perf_counter() - start
+        self.total_load_time += elapsed
+        self.max_load_time = max(self.max_load_time, elapsed)
+        return user
     
     def get_user(self, user_id):
         user_id = str(user_id)
-        if user_id not in self.users:
-            self.users[user_id] = {
-                "style": "romantic",
-                "history": [],
-                "girlfriend_name": "",
-                "personal_details": {}
-            }
-            self._save_data()
-        return self.users[user_id]
+        user = self.users.get(user_id)
+        if user is not None:
+            self.hits += 1
+            self.users.move_to_end(user_id)
+            return user
+        
+        self.misses += 1
+        user = self._load_user(user_id)
+        self.users[user_id] = user
+        while len(self.users) > self.max_resident:
+            # Storage writes back anything not yet persisted
+            evicted_id, evicted = self.users.popitem(last=False)
+            self.storage.evict_user(evicted_id, evicted)
+            self.evictions += 1
+        return user
     
     def update_style(self, user_id, style):
         user_id = str(user_id)
         user = self.get_user(user_id)
         user["style"] = style
-        self._save_data()
+        self.storage.save_user(user_id, user)
     
     def add_to_history(self, user_id, message_pair):
         """Add a message pair (girlfriend's message, bot's response) to history"""
         user_id = str(user_id)
         user = self.get_user(user_id)
         
-        # Add new message pair
-        user["history"].append(message_pair)
+        # The ring buffer keeps only the last MAX_HISTORY_LENGTH messages
+        user.history.append(message_pair)
         
-        # Keep only the last MAX_HISTORY_LENGTH messages
-        from config import MAX_HISTORY_LENGTH
-        if len(user["history"]) > MAX_HISTORY_LENGTH:
-            user["history"] = user["history"][-MAX_HISTORY_LENGTH:]
-        
-        self._save_data()
+        self.storage.append_history(user_id, message_pair, MAX_HISTORY_LENGTH)
     
     def update_girlfriend_name(self, user_id, name):
         user_id = str(user_id)
         user = self.get_user(user_id)
         user["girlfriend_name"] = name
-        self._save_data()
+        self.storage.save_user(user_id, user)
     
     def add_personal_detail(self, user_id, key, value):
         user_id = str(user_id)
         user = self.get_user(user_id)
         user["personal_details"][key] = value
-        self._save_data() 
\ No newline at end of file
+        self.storage.set_personal_detail(user_id, key, value)
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "resident_users": len(self.users),
+            "max_resident": self.max_resident,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "avg_load_time": self.total_load_time / self.misses if self.misses else 0.0,
+            "max_load_time": self.max_load_time
+        }
+    
+    def close(self):
+        self.storage.close()
@@ -0,0 +1,111 @@
+import sys
+
+from config import MAX_HISTORY_LENGTH, DEFAULT_STYLE
+
+
+class HistoryRing:
+    """Fixed-capacity ring buffer of (message, response) pairs, oldest first.
+
+    Once full, each append overwrites the oldest pair in place instead of
+    re-slicing the list. Supports len(), iteration and indexing/slicing like
+    the list it replaces.
+    """
+
+    __slots__ = ("_items", "_head")
+
+    capacity = MAX_HISTORY_LENGTH
+
+    def __init__(self, pairs=()):
+        self._items = []
+        self._head = 0  # index of the oldest pair once the buffer is full
+        for pair in pairs:
+            self.append(pair)
+
+    def append(self, pair):
+        pair = tuple(pair)
+        if len(self._items) < self.capacity:
+            self._items.append(pair)
+        else:
+            self._items[self._head] = pair
+            self._head = (self._head + 1) % self.capacity
+
+    def _ordered(self):
+        items, head = self._items, self._head
+        return items[head:] + items[:head] if head else items[:]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._ordered())
+
+    def __getitem__(self, index):
+        return self._ordered()[index]
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __repr__(self):
+        return f"HistoryRing({self._ordered()!r})"
+
+
+class UserRecord:
+    """Compact in-memory user: __slots__ fields, ring-buffer history, interned style.
+
+    Also answers the dict-style access (record["style"], record.get(...))
+    the handlers, prompt builder and storage backends use, and converts to
+    and from the JSON format of user_data.json.
+    """
+
+    __slots__ = ("style", "girlfriend_name", "history", "personal_details")
+
+    FIELDS = __slots__
+
+    def __init__(self, style=DEFAULT_STYLE, girlfriend_name="", history=(), personal_details=None):
+        self.style = sys.intern(style)
+        self.girlfriend_name = girlfriend_name
+        self.history = HistoryRing(history)
+        self.personal_details = {sys.intern(key): value for key, value in (personal_details or {}).items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            style=data.get("style", DEFAULT_STYLE),
+            girlfriend_name=data.get("girlfriend_name", ""),
+            history=data.get("history", ()),
+            personal_details=data.get("personal_details")
+        )
+
+    def to_dict(self):
+        return {
+            "style": self.style,
+            "history": [list(pair) for pair in self.history],
+            "girlfriend_name": self.girlfriend_name,
+            "personal_details": dict(self.personal_details)
+        }
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        if key == "style":
+            value = sys.intern(value)
+        elif key == "history" and not isinstance(value, HistoryRing):
+            value = HistoryRing(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return iter(self.FIELDS)
+
+    def __repr__(self):
+        return f"UserRecord({self.to_dict()!r})"
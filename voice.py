@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import (
+    TTS_ENGINE, VOICE_WORKERS, VOICE_BITRATE, VOICE_CACHE_DIR, VOICE_CACHE_MAX_BYTES, VOICE_FILE_ID_MAX_ENTRIES
+)
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# espeak-ng speed (words per minute) and pitch (0-99) per response style
+STYLE_PROSODY = {
+    "romantic": (150, 40),
+    "playful": (185, 65),
+    "supportive": (145, 45),
+    "passionate": (160, 35),
+    "casual": (175, 50)
+}
+
+
+class TTSEngine:
+    """Text-to-speech engine interface.
+
+    synthesize() runs in a worker process and returns a pydub AudioSegment,
+    so engines must be picklable: keep settings in plain attributes and
+    create clients inside synthesize(). `name` is part of the cache key.
+    """
+
+    name = None
+
+    def synthesize(self, text, voice, style):
+        raise NotImplementedError
+
+
+class EspeakEngine(TTSEngine):
+    """Offline speech with the local espeak-ng binary; no network needed."""
+
+    name = "espeak"
+
+    def __init__(self, command="espeak-ng", timeout=30.0):
+        self.command = command
+        self.timeout = timeout
+
+    def synthesize(self, text, voice, style):
+        from pydub import AudioSegment
+
+        speed, pitch = STYLE_PROSODY.get(style, STYLE_PROSODY["casual"])
+        # espeak writes an unsized WAV header to stdout, so go through a file
+        with tempfile.NamedTemporaryFile(suffix=".wav") as wav:
+            subprocess.run(
+                [self.command, "-v", voice, "-s", str(speed), "-p", str(pitch), "-w", wav.name, "--stdin"],
+                input=text.encode("utf-8"), capture_output=True, timeout=self.timeout, check=True
+            )
+            return AudioSegment.from_wav(wav.name)
+
+
+TTS_ENGINES = {
+    "espeak": EspeakEngine
+}
+
+
+def create_tts_engine(name=TTS_ENGINE):
+    """Build the configured TTS engine."""
+    try:
+        return TTS_ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown TTS_ENGINE {name!r}; expected one of {', '.join(TTS_ENGINES)}")
+
+
+def render_clip(engine, text, voice, style, audio_format, bitrate):
+    """Synthesize and encode one clip (runs in a worker process)."""
+    segment = engine.synthesize(text, voice, style)
+    # Telegram voice notes are mono Opus in an OGG container
+    segment = segment.set_channels(1).set_frame_rate(48000)
+    buffer = io.BytesIO()
+    if audio_format == "ogg":
+        segment.export(buffer, format="ogg", codec="libopus", bitrate=bitrate)
+    else:
+        segment.export(buffer, format=audio_format)
+    return buffer.getvalue()
+
+
+class VoiceClip:
+    """A synthesized clip: the Telegram file_id of an earlier upload, or the audio bytes."""
+
+    __slots__ = ("digest", "file_id", "data")
+
+    def __init__(self, digest, file_id=None, data=None):
+        self.digest = digest
+        self.file_id = file_id
+        self.data = data
+
+    @property
+    def voice(self):
+        """What to pass as send_voice(voice=...)."""
+        return self.file_id if self.file_id is not None else self.data
+
+
+class VoiceCache:
+    """Content-addressed clip files on disk, evicted least recently used past max_bytes.
+
+    Also remembers the Telegram file_id each clip got when first sent, so a
+    repeated clip is re-sent by reference instead of uploaded again. Clips
+    survive restarts; file_ids are kept in memory.
+    """
+
+    def __init__(self, directory=VOICE_CACHE_DIR, max_bytes=VOICE_CACHE_MAX_BYTES,
+                 max_file_ids=VOICE_FILE_ID_MAX_ENTRIES, extension="ogg"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_ids = max_file_ids
+        self.extension = extension
+        self._entries = OrderedDict()  # digest -> size, least recently used first
+        self._file_ids = OrderedDict()  # digest -> Telegram file_id
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.file_id_hits = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.{self.extension}")
+
+    def _load(self):
+        """Index the clips already on disk, oldest access first."""
+        suffix = f".{self.extension}"
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(suffix)], stat.st_size))
+        for _, digest, size in sorted(files):
+            self._entries[digest] = size
+            self.current_bytes += size
+        self._evict()
+
+    def file_id(self, digest):
+        file_id = self._file_ids.get(digest)
+        if file_id is not None:
+            self._file_ids.move_to_end(digest)
+            self.file_id_hits += 1
+        return file_id
+
+    def remember_file_id(self, digest, file_id):
+        self._file_ids[digest] = file_id
+        self._file_ids.move_to_end(digest)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    def get(self, digest):
+        """Return the clip's bytes, or None. Does file I/O; call it off the event loop."""
+        with self._lock:
+            known = digest in self._entries
+        path = self._path(digest)
+        data = None
+        if known:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)  # Keeps the LRU order across restarts
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            if data is None:
+                self._forget(digest)
+                self.misses += 1
+            elif digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+        return data
+
+    def put(self, digest, data):
+        """Store a clip. Does file I/O; call it off the event loop."""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(digest)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._forget(digest)
+            self._entries[digest] = len(data)
+            self.current_bytes += len(data)
+            self._evict()
+
+    def _forget(self, digest):
+        size = self._entries.pop(digest, None)
+        if size is not None:
+            self.current_bytes -= size
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            digest = next(iter(self._entries))
+            self._forget(digest)
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "clips": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "file_ids": len(self._file_ids),
+            "file_id_hits": self.file_id_hits
+        }
+
+
+class VoiceSynthesizer:
+    """Turns reply text into voice clips without blocking the event loop.
+
+    Synthesis and encoding run in a pool of worker processes (started on
+    first use); the loop only hashes the text and awaits the result. Clips
+    are looked up by a digest of engine, voice, style, format and text:
+    first as a Telegram file_id, then in the disk cache. Concurrent requests
+    for the same clip share one synthesis.
+    """
+
+    def __init__(self, engine=None, cache=None, workers=VOICE_WORKERS, bitrate=VOICE_BITRATE, audio_format="ogg"):
+        self.engine = engine if engine is not None else create_tts_engine()
+        self.audio_format = audio_format
+        self.cache = cache if cache is not None else VoiceCache(extension=audio_format)
+        self.workers = workers
+        self.bitrate = bitrate
+        self._pool = None
+        self._in_flight = {}  # digest -> task synthesizing that clip
+        self.synthesized = 0
+        self.shared = 0
+        self.failures = 0
+
+    def clip_digest(self, text, voice, style):
+        parts = (self.engine.name, voice, style, self.audio_format, self.bitrate, text)
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Spawned, not forked: the serving process has threads and a running loop
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def synthesize(self, text, voice, style):
+        """Return a VoiceClip for text, synthesizing it only if no earlier clip matches."""
+        digest = self.clip_digest(text, voice, style)
+        file_id = self.cache.file_id(digest)
+        if file_id is not None:
+            return VoiceClip(digest, file_id=file_id)
+
+        task = self._in_flight.get(digest)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = asyncio.create_task(self._load_or_render(digest, text, voice, style))
+            self._in_flight[digest] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(digest, None))
+        # Shielded so one caller giving up doesn't cancel the others' clip
+        return VoiceClip(digest, data=await asyncio.shield(task))
+
+    async def _load_or_render(self, digest, text, voice, style):
+        with stage("voice_cache"):
+            data = await asyncio.to_thread(self.cache.get, digest)
+        if data is not None:
+            return data
+
+        loop = asyncio.get_running_loop()
+        with stage("voice_synthesis"):
+            try:
+                data = await loop.run_in_executor(self._get_pool(), render_clip, self.engine, text, voice, style,
+                                                  self.audio_format, self.bitrate)
+            except BrokenProcessPool:
+                self._pool = None  # A worker died; start a fresh pool next time
+                self.failures += 1
+                raise
+            except Exception:
+                self.failures += 1
+                raise
+        self.synthesized += 1
+        await asyncio.to_thread(self.cache.put, digest, data)
+        return data
+
+    def remember_file_id(self, clip, file_id):
+        """Record the file_id Telegram gave an uploaded clip."""
+        if clip.file_id is None and file_id:
+            self.cache.remember_file_id(clip.digest, file_id)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        stats = {
+            "engine": self.engine.name,
+            "workers": self.workers,
+            "in_flight": len(self._in_flight),
+            "synthesized": self.synthesized,
+            "shared": self.shared,
+            "failures": self.failures
+        }
+        stats.update(self.cache.stats())
+        return stats